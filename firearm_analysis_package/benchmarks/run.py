@@ -0,0 +1,347 @@
+# benchmarks/run.py
+
+import argparse
+import datetime
+import functools
+import gc
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Sequence
+
+import pandas as pd
+
+from firearm_analysis.breakdown import (
+    read_breakdown, transaction_breakdown
+)
+from firearm_analysis.data_processing import (
+    breakdown_date, erase_month, groupby_state_and_year, read_csv, read_nics
+)
+from firearm_analysis.map_generation import create_maps
+from firearm_analysis.state_analysis import (
+    calculate_relative_values, clean_states, groupby_state, merge_datasets
+)
+from firearm_analysis.visualization import time_evolution
+
+from .synthetic import generate_nics, synthetic_path, synthetic_rows
+
+# Multiples of the rows of the shipped file
+SCALES = (10, 100, 1000)
+
+# Packages whose versions are recorded with the results
+PACKAGES = ("numpy", "pandas", "pyarrow", "matplotlib")
+
+
+class Inputs:
+    """
+    Inputs of the benchmarks of a data file. Each intermediate DataFrame is
+    computed the first time a benchmark needs it, outside of the measures.
+
+    Args:
+        data (str): Path of the NICS CSV file.
+        url2 (str): The URL of the population CSV file.
+        geo_data (str): Path of the GeoJSON file of the states.
+        output_dir (str): Directory of the rendered maps.
+    """
+
+    def __init__(self, data: str, url2: str, geo_data: str, output_dir: str):
+        self.data = data
+        self.url2 = url2
+        self.geo_data = geo_data
+        self.output_dir = output_dir
+        self._frames = {}
+
+    def frame(self, name: str) -> pd.DataFrame:
+        """Returns an intermediate DataFrame (see the `_<name>` methods)."""
+        if name not in self._frames:
+            self._frames[name] = getattr(self, "_" + name)()
+        return self._frames[name]
+
+    def _raw(self) -> pd.DataFrame:
+        """Columns of interest, as read by `read_csv`."""
+        return read_csv(self.data, cache=False)
+
+    def _cached(self) -> None:
+        """Builds the persistent cache of `read_nics`."""
+        read_nics(self.data)
+
+    def _dated(self) -> pd.DataFrame:
+        """Columns of interest with the "year" and "month" columns."""
+        return breakdown_date(self.frame("raw").copy())
+
+    def _yearly(self) -> pd.DataFrame:
+        """Columns of interest with the "year" column only."""
+        return erase_month(self.frame("dated"))
+
+    def _merged(self) -> pd.DataFrame:
+        """Sums of the states with their population."""
+        return merge_datasets(clean_states(groupby_state(self.frame("dated"))),
+                              self.url2)
+
+    def _breakdown(self) -> pd.DataFrame:
+        """Every transaction column, as read by `read_breakdown`."""
+        return read_breakdown(self.data, cache=False)
+
+    def _percent(self) -> pd.DataFrame:
+        """Sums of the states as percentages of the population."""
+        return calculate_relative_values(self.frame("merged").copy())
+
+
+def _read_csv_cached(inputs: Inputs) -> Callable[[], pd.DataFrame]:
+    """Reads the file through the persistent cache, once it is built."""
+    inputs.frame("cached")
+    return functools.partial(read_csv, inputs.data)
+
+
+# Functions that prepare the call of each benchmark. They run before every
+# measure, so the calls that modify their input get a fresh copy.
+BENCHMARKS: Dict[str, Callable[[Inputs], Callable[[], object]]] = {
+    "read_csv": lambda inputs: functools.partial(
+        read_csv, inputs.data, cache=False),
+    "read_csv_cached": _read_csv_cached,
+    "breakdown_date": lambda inputs: functools.partial(
+        breakdown_date, inputs.frame("raw").copy()),
+    "groupby_state_and_year": lambda inputs: functools.partial(
+        groupby_state_and_year, inputs.frame("yearly")),
+    "groupby_state": lambda inputs: functools.partial(
+        groupby_state, inputs.frame("dated")),
+    "calculate_relative_values": lambda inputs: functools.partial(
+        calculate_relative_values, inputs.frame("merged").copy()),
+    "time_evolution": lambda inputs: functools.partial(
+        time_evolution, inputs.frame("dated")),
+    "create_maps": lambda inputs: functools.partial(
+        create_maps, inputs.frame("percent"), geo_data=inputs.geo_data,
+        output_dir=inputs.output_dir, backend="matplotlib"),
+    "read_breakdown": lambda inputs: functools.partial(
+        read_breakdown, inputs.data, cache=False),
+    "transaction_breakdown": lambda inputs: functools.partial(
+        transaction_breakdown, inputs.frame("breakdown")),
+}
+
+
+def measure(setup: Callable[[], Callable[[], object]],
+            repeat: int = 3) -> dict:
+    """
+    Measures the peak memory and the time of a call. The peak memory is the
+    highest amount of memory allocated by the call (traced by
+    `tracemalloc`, which sees the Python and NumPy allocations but not the
+    ones of the Arrow memory pool) in a first run, which also loads the lazy
+    imports and the caches. The time is measured in `repeat` later runs
+    without tracing.
+
+    Args:
+        setup (callable): Returns the call to measure. It runs before every
+            run and is not measured.
+        repeat (int, optional): Number of timed runs. Defaults to 3.
+
+    Returns:
+        dict: "seconds" (fastest run), "times" (all the runs) and
+            "peak_bytes".
+    """
+    call = setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    times = []
+    for _ in range(repeat):
+        call = setup()
+        gc.collect()
+        start = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start)
+    return {"seconds": min(times), "times": times, "peak_bytes": peak}
+
+
+def run_benchmarks(scales: Sequence[int] = SCALES,
+                   names: Optional[Sequence[str]] = None,
+                   data_dir: str = "./benchmarks/data",
+                   url2: str = "./Data/us-state-populations.csv",
+                   geo_data: str = "./Data/us-states.json",
+                   seed: int = 0, repeat: int = 3,
+                   progress: Optional[Callable[[dict], None]] = None
+                   ) -> List[dict]:
+    """
+    Runs the benchmarks against synthetic NICS files of several sizes. The
+    files are generated in `data_dir` (see `generate_nics`) and reused by
+    later runs with the same scale and seed.
+
+    Args:
+        scales (sequence of int, optional): Multiples of the rows of the
+            shipped file. Defaults to 10, 100 and 1000.
+        names (sequence of str, optional): Benchmarks to run. Defaults to all
+            the ones of `BENCHMARKS`.
+        data_dir (str, optional): Directory of the synthetic files. Defaults
+            to "./benchmarks/data".
+        url2 (str, optional): The URL of the population CSV file. Defaults
+            to "./Data/us-state-populations.csv".
+        geo_data (str, optional): Path of the GeoJSON file of the states.
+            Defaults to "./Data/us-states.json".
+        seed (int, optional): Seed of the synthetic files. Defaults to 0.
+        repeat (int, optional): Number of timed runs (see `measure`).
+            Defaults to 3.
+        progress (callable, optional): Called with every result as soon as
+            it is measured.
+
+    Returns:
+        list of dict: One result per scale and benchmark, with the keys
+            "benchmark", "scale", "rows" and the ones of `measure`.
+    """
+    names = list(BENCHMARKS) if names is None else list(names)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f"Unknown benchmarks: {sorted(unknown)}")
+    results = []
+    for scale in scales:
+        data = generate_nics(synthetic_path(data_dir, scale, seed), scale,
+                             seed)
+        with tempfile.TemporaryDirectory() as output_dir:
+            inputs = Inputs(data, url2, geo_data, output_dir)
+            for name in names:
+                result = {"benchmark": name, "scale": scale,
+                          "rows": synthetic_rows(scale)}
+                result.update(measure(
+                    functools.partial(BENCHMARKS[name], inputs), repeat))
+                results.append(result)
+                if progress is not None:
+                    progress(result)
+            # Free the DataFrames of this scale before the next one
+            del inputs
+    return results
+
+
+def _git(*args: str) -> Optional[str]:
+    """Output of a git command, or None outside of a repository."""
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> dict:
+    """
+    Describes the code and the machine of the results.
+
+    Returns:
+        dict: Date, git commit (and whether the tree had changes), Python
+            version, platform, processors and versions of `PACKAGES`.
+    """
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = __import__(package).__version__
+        except ImportError:
+            versions[package] = None
+    status = _git("status", "--porcelain", "--untracked-files=no")
+    return {
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(status) if status is not None else None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "packages": versions,
+    }
+
+
+def compare(baseline: dict, current: dict) -> pd.DataFrame:
+    """
+    Compares two results files of `main`.
+
+    Args:
+        baseline (dict): Results of the reference commit.
+        current (dict): Results to compare.
+
+    Returns:
+        pd.DataFrame: Times and peak memories of the benchmarks of both
+            files, with their ratios (current / baseline) in the columns
+            "time_ratio" and "memory_ratio".
+    """
+    keys = ["benchmark", "scale"]
+    columns = keys + ["seconds", "peak_bytes"]
+    df = pd.merge(pd.DataFrame(baseline["results"], columns=columns),
+                  pd.DataFrame(current["results"], columns=columns),
+                  on=keys, suffixes=("_baseline", ""))
+    df["time_ratio"] = df["seconds"] / df["seconds_baseline"]
+    df["memory_ratio"] = df["peak_bytes"] / df["peak_bytes_baseline"]
+    return df
+
+
+def main(argv: Optional[Sequence[str]] = None) -> dict:
+    """
+    Runs the benchmarks from the command line and writes their results to a
+    JSON file: `python -m benchmarks.run --scales 10 100`.
+
+    Args:
+        argv (sequence of str, optional): Command line arguments. Defaults to
+            the ones of the process.
+
+    Returns:
+        dict: Results, with the keys "environment", "settings" and
+            "results".
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.run",
+        description="Measures the time and peak memory of the analysis on "
+                    "synthetic NICS files.")
+    parser.add_argument("--scales", nargs="+", type=int,
+                        default=list(SCALES),
+                        help="multiples of the rows of the shipped file "
+                             "(default: 10 100 1000)")
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS),
+                        default=list(BENCHMARKS),
+                        help="benchmarks to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timed runs of every benchmark")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the synthetic files")
+    parser.add_argument("--data-dir", default="./benchmarks/data",
+                        help="directory of the synthetic files")
+    parser.add_argument("--population",
+                        default="./Data/us-state-populations.csv",
+                        help="population CSV file")
+    parser.add_argument("--geo-data", default="./Data/us-states.json",
+                        help="GeoJSON file of the states")
+    parser.add_argument("--output",
+                        help="JSON file of the results (default: "
+                             "./benchmarks/results/<commit>.json)")
+    parser.add_argument("--baseline",
+                        help="JSON file of earlier results to compare with")
+    args = parser.parse_args(argv)
+    env = environment()
+    output = args.output or os.path.join(
+        "benchmarks", "results", f"{(env['commit'] or 'results')[:12]}.json")
+
+    def progress(result):
+        print(f"{result['benchmark']:>26} x{result['scale']:<5} "
+              f"{result['seconds']:10.4f} s "
+              f"{result['peak_bytes'] / 2 ** 20:10.1f} MiB", flush=True)
+
+    report = {
+        "environment": env,
+        "settings": {"seed": args.seed, "repeat": args.repeat},
+        "results": run_benchmarks(args.scales, args.benchmarks, args.data_dir,
+                                  args.population, args.geo_data, args.seed,
+                                  args.repeat, progress),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=1)
+    print(f"Results written to {output}")
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        print(compare(baseline, report).to_string(index=False))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+# benchmarks/synthetic.py
+
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# Header of the NICS CSV file
+HEADER = [
+    "month", "state", "permit", "permit_recheck", "handgun", "long_gun",
+    "other", "multiple", "admin", "prepawn_handgun", "prepawn_long_gun",
+    "prepawn_other", "redemption_handgun", "redemption_long_gun",
+    "redemption_other", "returned_handgun", "returned_long_gun",
+    "returned_other", "rentals_handgun", "rentals_long_gun",
+    "private_sale_handgun", "private_sale_long_gun", "private_sale_other",
+    "return_to_seller_handgun", "return_to_seller_long_gun",
+    "return_to_seller_other", "totals",
+]
+
+# Months of the shipped file (257 months of 55 states, 14135 rows)
+FIRST_MONTH = "1998-11"
+LAST_MONTH = "2020-03"
+
+# Mean of the "totals" column of the shipped file
+MEAN_TOTALS = 24019
+
+# Mean of each state relative to the mean of all the rows of the shipped
+# file
+STATE_WEIGHTS = {
+    "Alabama": 1.338, "Alaska": 0.217, "Arizona": 0.88, "Arkansas": 0.708,
+    "California": 3.614, "Colorado": 1.193, "Connecticut": 0.586,
+    "Delaware": 0.1, "District of Columbia": 0.003, "Florida": 2.41,
+    "Georgia": 1.402, "Guam": 0.003, "Hawaii": 0.038, "Idaho": 0.405,
+    "Illinois": 4.142, "Indiana": 1.718, "Iowa": 0.452, "Kansas": 0.5,
+    "Kentucky": 6.645, "Louisiana": 0.889, "Maine": 0.243,
+    "Mariana Islands": 0.0005, "Maryland": 0.395, "Massachusetts": 0.503,
+    "Michigan": 1.39, "Minnesota": 1.285, "Mississippi": 0.684,
+    "Missouri": 1.276, "Montana": 0.355, "Nebraska": 0.215, "Nevada": 0.335,
+    "New Hampshire": 0.307, "New Jersey": 0.224, "New Mexico": 0.404,
+    "New York": 0.905, "North Carolina": 1.487, "North Dakota": 0.18,
+    "Ohio": 1.663, "Oklahoma": 0.891, "Oregon": 0.76, "Pennsylvania": 2.551,
+    "Puerto Rico": 0.043, "Rhode Island": 0.058, "South Carolina": 0.784,
+    "South Dakota": 0.235, "Tennessee": 1.468, "Texas": 3.809, "Utah": 0.939,
+    "Vermont": 0.095, "Virgin Islands": 0.003, "Virginia": 1.173,
+    "Washington": 1.288, "West Virginia": 0.614, "Wisconsin": 1.023,
+    "Wyoming": 0.17,
+}
+
+# Mean of each calendar month relative to the mean of all the rows
+MONTH_WEIGHTS = [1.01, 1.08, 1.18, 0.93, 0.84, 0.82, 0.81, 0.91, 0.93, 1.04,
+                 1.09, 1.32]
+
+# Mean of each year from 1998 to 2020 relative to the mean of all the rows.
+# Earlier and later years repeat the first and last weights.
+YEAR_WEIGHTS = [0.34, 0.57, 0.53, 0.56, 0.53, 0.53, 0.54, 0.56, 0.63, 0.7,
+                0.8, 0.88, 0.9, 1.03, 1.23, 1.32, 1.32, 1.45, 1.73, 1.57, 1.63,
+                1.77, 2.31]
+FIRST_YEAR = 1998
+
+# Share of the totals of each column and first month with data (the column
+# is empty before, as in the shipped file)
+COLUMNS = {
+    "permit": (0.29611, "1998-11"),
+    "permit_recheck": (0.23249, "2016-02"),
+    "handgun": (0.27187, "1998-11"),
+    "long_gun": (0.32557, "1998-11"),
+    "other": (0.01943, "2009-06"),
+    "multiple": (0.01189, "1998-11"),
+    "admin": (0.00229, "1998-11"),
+    "prepawn_handgun": (0.00021, "2001-10"),
+    "prepawn_long_gun": (0.00032, "2001-10"),
+    "prepawn_other": (0.00001, "2010-01"),
+    "redemption_handgun": (0.01832, "2001-10"),
+    "redemption_long_gun": (0.02427, "2001-10"),
+    "redemption_other": (0.0001, "2010-01"),
+    "returned_handgun": (0.00202, "2006-05"),
+    "returned_long_gun": (0.00047, "2006-05"),
+    "returned_other": (0.00006, "2015-01"),
+    "rentals_handgun": (0.00001, "2013-03"),
+    "rentals_long_gun": (0.00001, "2013-06"),
+    "private_sale_handgun": (0.00096, "2013-08"),
+    "private_sale_long_gun": (0.00078, "2013-08"),
+    "private_sale_other": (0.0001, "2013-08"),
+    "return_to_seller_handgun": (0.00003, "2013-08"),
+    "return_to_seller_long_gun": (0.00003, "2013-08"),
+    "return_to_seller_other": (0.000005, "2013-09"),
+}
+
+# Spread (sigma of a log-normal factor) of the share of each column between
+# states, which makes some states permit heavy and others handgun heavy
+STATE_MIX_SIGMA = 0.5
+
+
+def _months(first: str, last: str) -> pd.PeriodIndex:
+    """Months from the last to the first, the order of the NICS file."""
+    return pd.period_range(first, last, freq="M")[::-1]
+
+
+def synthetic_rows(scale: int = 1, first: str = FIRST_MONTH,
+                   last: str = LAST_MONTH) -> int:
+    """
+    Returns the number of rows of a synthetic file.
+
+    Args:
+        scale (int, optional): Multiple of the shipped file (see
+            `generate_nics`). Defaults to 1.
+        first (str, optional): First month. Defaults to "1998-11".
+        last (str, optional): Last month. Defaults to "2020-03".
+
+    Returns:
+        int: Number of rows.
+    """
+    return scale * len(STATE_WEIGHTS) * len(_months(first, last))
+
+
+def synthetic_month(month: pd.Period, scale: int = 1,
+                    seed: int = 0) -> pd.DataFrame:
+    """
+    Generates the rows of a month: `scale` rows per state, in the order of
+    the states, with every count drawn from a Poisson distribution whose
+    mean follows the state, the year, the calendar month and the column
+    share of the shipped file. The rows only depend on the month, the scale
+    and the seed.
+
+    Args:
+        month (pd.Period): Month of the rows.
+        scale (int, optional): Rows per state. Defaults to 1.
+        seed (int, optional): Seed of the random numbers. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: Rows with the columns of `HEADER`.
+    """
+    states = list(STATE_WEIGHTS)
+    shares = np.array([share for share, _ in COLUMNS.values()])
+    # The mix of each state is the same in every month, with a mean of 1
+    mix = np.random.default_rng(seed).lognormal(
+        -STATE_MIX_SIGMA ** 2 / 2, STATE_MIX_SIGMA,
+        (len(states), len(shares)))
+    year = min(max(month.year - FIRST_YEAR, 0), len(YEAR_WEIGHTS) - 1)
+    level = (MEAN_TOTALS * YEAR_WEIGHTS[year] * MONTH_WEIGHTS[month.month - 1]
+             * np.array(list(STATE_WEIGHTS.values())))
+    means = level[:, None] * shares * mix
+    rng = np.random.default_rng([seed, month.ordinal])
+    counts = rng.poisson(np.repeat(means, scale, axis=0)).astype(np.float64)
+    for position, (_, start) in enumerate(COLUMNS.values()):
+        if month < pd.Period(start, freq="M"):
+            counts[:, position] = np.nan
+    df = pd.DataFrame(counts, columns=list(COLUMNS))
+    df.insert(0, "month", str(month))
+    df.insert(1, "state", np.repeat(states, scale))
+    df["totals"] = np.nansum(counts, axis=1)
+    return df
+
+
+def generate_nics(path: str, scale: int = 1, seed: int = 0,
+                  first: str = FIRST_MONTH, last: str = LAST_MONTH,
+                  overwrite: bool = False) -> str:
+    """
+    Writes a synthetic CSV file with the header of the NICS file and
+    `scale` times its rows: every state has `scale` rows per month (as if
+    it sent `scale` reports), from the last month to the first, like the
+    shipped file. The same arguments always give the same file. The file is
+    written one month at a time, so only the rows of a month are in memory.
+
+    Args:
+        path (str): Path of the CSV file.
+        scale (int, optional): Multiple of the rows of the shipped file.
+            Defaults to 1.
+        seed (int, optional): Seed of the random numbers. Defaults to 0.
+        first (str, optional): First month. Defaults to "1998-11".
+        last (str, optional): Last month. Defaults to "2020-03".
+        overwrite (bool, optional): Writes the file even if it exists.
+            Defaults to False, which keeps an existing file.
+
+    Returns:
+        str: Path of the CSV file.
+    """
+    if scale < 1:
+        raise ValueError(f"The scale must be at least 1, not {scale}")
+    if os.path.exists(path) and not overwrite:
+        return path
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # Write to a temporary file, so an interrupted run leaves no partial file
+    partial = path + ".partial"
+    with open(partial, "w", newline="") as file:
+        file.write(",".join(HEADER) + "\n")
+        for month in _months(first, last):
+            synthetic_month(month, scale, seed).to_csv(
+                file, header=False, index=False, float_format="%.0f")
+    os.replace(partial, path)
+    return path
+
+
+def synthetic_path(directory: str, scale: int = 1, seed: int = 0,
+                   first: Optional[str] = None,
+                   last: Optional[str] = None) -> str:
+    """
+    Returns the path of a synthetic file in a directory, named after its
+    arguments.
+
+    Args:
+        directory (str): Directory of the files.
+        scale (int, optional): Multiple of the shipped file. Defaults to 1.
+        seed (int, optional): Seed of the random numbers. Defaults to 0.
+        first (str, optional): First month, if not the default one.
+        last (str, optional): Last month, if not the default one.
+
+    Returns:
+        str: Path of the CSV file.
+    """
+    name = f"nics-x{scale}-seed{seed}"
+    if first or last:
+        name += f"-{first or FIRST_MONTH}-{last or LAST_MONTH}"
+    return os.path.join(directory, f"{name}.csv")
@@ -1,19 +1,68 @@
 # firearm_analysis/__init__.py
 
-from .data_processing import (
-    read_csv, clean_csv, rename_col, breakdown_date, erase_month,
-    groupby_state_and_year, print_biggest_handguns, print_biggest_longguns
-)
-from .visualization import time_evolution
-from .state_analysis import (
-        groupby_state, clean_states, merge_datasets, calculate_relative_values,
-        analyze_kentucky
-)
-from .map_generation import create_maps
-
-__all__ = [
-    "read_csv", "clean_csv", "rename_col", "breakdown_date", "erase_month",
-    "groupby_state_and_year", "print_biggest_handguns", "print_biggest_longguns",
-    "time_evolution", "groupby_state", "clean_states", "merge_datasets",
-    "calculate_relative_values", "analyze_kentucky", "create_maps"
-]
+import importlib
+
+from .config import set_verbose
+
+# Module of every public name. The modules are only imported when one of
+# their names is first used, so importing the package does not load the
+# rendering libraries (matplotlib, folium, selenium) of the maps and charts.
+_EXPORTS = {
+    "read_csv": "data_processing",
+    "read_nics": "data_processing",
+    "read_compact": "data_processing",
+    "load_dataset": "data_processing",
+    "clean_csv": "data_processing",
+    "rename_col": "data_processing",
+    "split_date": "data_processing",
+    "breakdown_date": "data_processing",
+    "erase_month": "data_processing",
+    "groupby_state_and_year": "data_processing",
+    "print_biggest_handguns": "data_processing",
+    "print_biggest_longguns": "data_processing",
+    "time_evolution": "visualization",
+    "groupby_state": "state_analysis",
+    "clean_states": "state_analysis",
+    "merge_datasets": "state_analysis",
+    "calculate_relative_values": "state_analysis",
+    "analyze_kentucky": "state_analysis",
+    "create_maps": "map_generation",
+    "Pipeline": "pipeline",
+    "AggregationCube": "cube",
+    "stream_groupby_state_and_year": "ingestion",
+    "parallel_groupby_state_and_year": "ingestion",
+    "IncrementalAggregates": "incremental",
+    "render_batch": "batch_rendering",
+    "PopulationTable": "population",
+    "load_population": "population",
+    "per_capita": "population",
+    "detect_outliers": "outliers",
+    "find_outliers": "outliers",
+    "Ranking": "ranking",
+    "top_k": "ranking",
+    "StateIndex": "state_index",
+    "StateYearArray": "state_index",
+    "load_state_index": "state_index",
+    "MonthlySeries": "time_series",
+    "read_breakdown": "breakdown",
+    "add_groups": "breakdown",
+    "breakdown_cube": "breakdown",
+    "transaction_breakdown": "breakdown",
+}
+
+__all__ = ["set_verbose"] + list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    """Imports the module of a public name the first time it is used."""
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__),
+                    name)
+    # Later lookups find the name directly, without calling this function
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,6 @@
+# firearm_analysis/__main__.py
+
+from .cli import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# firearm_analysis/batch_rendering.py
+
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from .data_processing import COLUMNS_OF_INTEREST
+
+logger = logging.getLogger(__name__)
+
+# Name of the file with the content hash of every rendered figure
+MANIFEST = ".batch_manifest.json"
+
+
+def _use_agg() -> None:
+    """Selects the non-interactive backend of matplotlib in a worker."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+def _render_map(df: pd.DataFrame, metric: str, path: str, geo_data: str,
+                legend_name: str) -> None:
+    """Renders the choropleth of one metric."""
+    from .raster_maps import render_choropleth
+
+    render_choropleth(df, metric, path, geo_data=geo_data,
+                      legend_name=legend_name)
+
+
+def _render_chart(df: pd.DataFrame, metric: str, path: str,
+                  title: str) -> None:
+    """Renders the time series of one metric."""
+    from .visualization import time_evolution
+
+    time_evolution(df, output=path, title=title, metrics=[metric])
+
+
+def _render(task: Tuple[str, dict]) -> str:
+    """
+    Renders a task of `render_batch` in a worker process.
+
+    Args:
+        task (tuple): Kind of figure ("map" or "chart") and keyword arguments
+            of its renderer.
+
+    Returns:
+        str: Path of the image.
+    """
+    kind, kwargs = task
+    if kind == "map":
+        _render_map(**kwargs)
+    else:
+        _render_chart(**kwargs)
+    return kwargs["path"]
+
+
+def _digest(df: pd.DataFrame, *params) -> str:
+    """
+    Calculates the content hash of the slice of data of a figure and the
+    parameters used to draw it.
+
+    Args:
+        df (pd.DataFrame): Data of the figure.
+        *params: Other values that change the figure.
+
+    Returns:
+        str: Hexadecimal digest.
+    """
+    sha = hashlib.sha256(
+        pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    sha.update(repr((df.columns.tolist(), params)).encode())
+    return sha.hexdigest()
+
+
+def render_batch(df: pd.DataFrame, output_dir: str,
+                 metrics: Sequence[str] = COLUMNS_OF_INTEREST[2:],
+                 per_state: bool = False,
+                 geo_data: str = "./Data/us-states.json",
+                 url2: str = "./Data/us-state-populations.csv",
+                 fmt: str = "png", max_workers: Optional[int] = None,
+                 force: bool = False) -> Dict[str, List[str]]:
+    """
+    Renders, from one table grouped by "state" and "year" (as returned by
+    `groupby_state_and_year`), a choropleth map for every year and metric
+    and a chart with the national time series of every metric (and of every
+    state, if requested). The figures are drawn in a pool of processes with
+    the non-interactive Agg backend of matplotlib.
+
+    A manifest in the output directory keeps the content hash of the data
+    of every figure, so figures whose data did not change since the last run
+    are not drawn again.
+
+    Args:
+        df (pd.DataFrame): DataFrame with the columns "state", "year" and the
+            metrics.
+        output_dir (str): Directory of the images. The maps go to the "maps"
+            subdirectory and the charts to the "charts" one.
+        metrics (sequence of str, optional): Columns to draw. Defaults to
+            "permit", "handgun" and "long_gun".
+        per_state (bool, optional): Also draws the time series of every
+            state. Defaults to False.
+        geo_data (str, optional): Path of the GeoJSON file of the states.
+            Defaults to "./Data/us-states.json".
+        url2 (str, optional): The URL of the population CSV file, used to
+            get the code of every state. Defaults to
+            "./Data/us-state-populations.csv".
+        fmt (str, optional): Format of the images. Defaults to "png".
+        max_workers (int, optional): Number of processes. With 1, the
+            figures are drawn in the current process. Defaults to the number
+            of CPUs.
+        force (bool, optional): Draws every figure even if it did not
+            change. Defaults to False.
+
+    Returns:
+        dict: Paths of the "rendered" and the "skipped" images.
+    """
+    for subdirectory in ("maps", "charts"):
+        os.makedirs(os.path.join(output_dir, subdirectory), exist_ok=True)
+    manifest_file = os.path.join(output_dir, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_file) and not force:
+        with open(manifest_file) as file:
+            manifest = json.load(file)
+    codes = pd.read_csv(url2, usecols=["code", "state"])
+    df = df.astype({"state": str}).merge(codes, on="state", how="left")
+    tasks = []
+    hashes = {}
+
+    def add(kind, name, data, **kwargs):
+        """Adds the task of a figure unless it did not change."""
+        path = os.path.join(output_dir, kind + "s", f"{name}.{fmt}")
+        hashes[path] = _digest(data, kind, fmt, sorted(kwargs.items()))
+        if manifest.get(path) != hashes[path] or not os.path.exists(path):
+            tasks.append((kind, dict(df=data, path=path, **kwargs)))
+
+    for metric in metrics:
+        legend_name = f"{metric.replace('_', ' ')} per state"
+        # Territories without a code are not in the GeoJSON file
+        for year, df_year in df.dropna(subset=["code"]).groupby("year"):
+            add("map", f"{metric}_{year}",
+                df_year[["code", metric]].reset_index(drop=True),
+                metric=metric, geo_data=geo_data,
+                legend_name=f"{legend_name} ({year})")
+        add("chart", metric, df.groupby("year")[metric].sum().reset_index(),
+            metric=metric, title=f"Time evolution of {metric} in the US")
+        if per_state:
+            for state, df_state in df.groupby("state"):
+                add("chart", f"{state.replace(' ', '_')}_{metric}",
+                    df_state[["year", metric]].reset_index(drop=True),
+                    metric=metric,
+                    title=f"Time evolution of {metric} in {state}")
+    if max_workers == 1:
+        rendered = [_render(task) for task in tasks]
+    elif tasks:
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 initializer=_use_agg) as executor:
+            rendered = list(executor.map(_render, tasks))
+    else:
+        rendered = []
+    with open(manifest_file, "w") as file:
+        json.dump(hashes, file, indent=1, sort_keys=True)
+    skipped = sorted(set(hashes) - set(rendered))
+    logger.info("Rendered %s figures, skipped %s unchanged ones",
+                len(rendered), len(skipped))
+    return {"rendered": rendered, "skipped": skipped}
@@ -0,0 +1,213 @@
+# firearm_analysis/breakdown.py
+
+import logging
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from .cube import AggregationCube
+from .data_processing import read_nics, split_date
+
+logger = logging.getLogger(__name__)
+
+# Transaction columns of the NICS file, in the order of the file. "totals"
+# is the sum of all the others.
+TRANSACTIONS = [
+    "permit", "permit_recheck", "handgun", "long_gun", "other", "multiple",
+    "admin", "prepawn_handgun", "prepawn_long_gun", "prepawn_other",
+    "redemption_handgun", "redemption_long_gun", "redemption_other",
+    "returned_handgun", "returned_long_gun", "returned_other",
+    "rentals_handgun", "rentals_long_gun", "private_sale_handgun",
+    "private_sale_long_gun", "private_sale_other",
+    "return_to_seller_handgun", "return_to_seller_long_gun",
+    "return_to_seller_other", "totals",
+]
+
+# Derived groups of transactions and the columns they sum
+GROUPS = {
+    "handgun_all": [
+        "handgun", "prepawn_handgun", "redemption_handgun",
+        "returned_handgun", "rentals_handgun", "private_sale_handgun",
+        "return_to_seller_handgun",
+    ],
+    "long_gun_all": [
+        "long_gun", "prepawn_long_gun", "redemption_long_gun",
+        "returned_long_gun", "rentals_long_gun", "private_sale_long_gun",
+        "return_to_seller_long_gun",
+    ],
+    "other_all": [
+        "other", "prepawn_other", "redemption_other", "returned_other",
+        "private_sale_other", "return_to_seller_other",
+    ],
+    "permit_all": ["permit", "permit_recheck"],
+    "prepawn": ["prepawn_handgun", "prepawn_long_gun", "prepawn_other"],
+    "redemption": ["redemption_handgun", "redemption_long_gun",
+                   "redemption_other"],
+    "returned": ["returned_handgun", "returned_long_gun", "returned_other"],
+    "rentals": ["rentals_handgun", "rentals_long_gun"],
+    "private_sale": ["private_sale_handgun", "private_sale_long_gun",
+                     "private_sale_other"],
+    "return_to_seller": ["return_to_seller_handgun",
+                         "return_to_seller_long_gun",
+                         "return_to_seller_other"],
+}
+
+
+def _smallest_int(values: np.ndarray) -> np.dtype:
+    """Smallest integer dtype that holds all the values."""
+    if not len(values):
+        return np.dtype(np.uint8)
+    return np.result_type(np.min_scalar_type(int(values.min())),
+                          np.min_scalar_type(int(values.max())))
+
+
+def _present(categories: Iterable[str],
+             groups: Dict[str, Sequence[str]]) -> Dict[str, List[str]]:
+    """Groups restricted to the given categories, without empty groups."""
+    categories = set(categories)
+    groups = {name: [c for c in members if c in categories]
+              for name, members in groups.items()}
+    return {name: members for name, members in groups.items() if members}
+
+
+def read_breakdown(url: str = "./Data/nics-firearm-background-checks.csv",
+                   cache: bool = True) -> pd.DataFrame:
+    """
+    Reads every transaction column of the NICS CSV file in a compact
+    layout: "year" (int16) and "month" (int8) as integer keys, "state" as a
+    categorical (8-bit codes) and every transaction column with the
+    smallest integer dtype that holds its values (missing values as 0).
+    Only the transaction columns are read: from the persistent cache, or
+    parsed straight into nullable 32-bit integers, so the counts stay exact
+    and the file is never held with 64-bit columns.
+
+    Args:
+        url (str, optional): Path of the CSV file. Defaults to
+            "./Data/nics-firearm-background-checks.csv".
+        cache (bool, optional): Reads the columns through the persistent
+            cache of `read_nics`. Defaults to True.
+
+    Returns:
+        pd.DataFrame: DataFrame with the columns "year", "month", "state"
+            and the transaction columns of the file (see `TRANSACTIONS`).
+    """
+    header = pd.read_csv(url, nrows=0).rename(
+        columns={"longgun": "long_gun"}).columns
+    columns = ["month", "state"] + [c for c in TRANSACTIONS if c in header]
+    if cache:
+        df = read_nics(url, columns=columns)
+    else:
+        df = pd.read_csv(
+            url, usecols=lambda c: c in columns or c == "longgun",
+            dtype=dict({"month": "category", "state": "category"},
+                       **{column: "Int32"
+                          for column in TRANSACTIONS + ["longgun"]}))
+        df = df.rename(columns={"longgun": "long_gun"})
+    df = split_date(df, inplace=True)
+    compact = {"year": df["year"], "month": df["month"],
+               "state": df["state"].astype("category")}
+    for column in columns[2:]:
+        values = df[column].fillna(0).to_numpy(dtype=np.int64)
+        compact[column] = values.astype(_smallest_int(values))
+    compact = pd.DataFrame(compact)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("\nCompact breakdown of the transactions (%s bytes):\n%s",
+                    compact.memory_usage(deep=True).sum(),
+                    compact.dtypes.to_string())
+    return compact
+
+
+def add_groups(df: pd.DataFrame,
+               groups: Dict[str, Sequence[str]] = GROUPS) -> pd.DataFrame:
+    """
+    Adds the derived groups of transactions of a DataFrame, all at once
+    with a single matrix product of its transaction columns. The members
+    that are not in the DataFrame are left out of the groups.
+
+    Args:
+        df (pd.DataFrame): DataFrame with transaction columns, such as the
+            one returned by `read_breakdown`.
+        groups (dict, optional): Names of the groups and the columns they
+            sum. Defaults to `GROUPS`.
+
+    Returns:
+        pd.DataFrame: Copy of the DataFrame with a column per group.
+    """
+    groups = _present(df.columns, groups)
+    columns = sorted({c for members in groups.values() for c in members},
+                     key=list(df.columns).index)
+    members = np.zeros((len(columns), len(groups)), dtype=np.int64)
+    for j, group in enumerate(groups.values()):
+        members[[columns.index(c) for c in group], j] = 1
+    df = df.copy()
+    df[list(groups)] = df[columns].to_numpy(dtype=np.int64) @ members
+    return df
+
+
+def breakdown_cube(data: Union[str, pd.DataFrame] =
+                   "./Data/nics-firearm-background-checks.csv",
+                   groups: Optional[Dict[str, Sequence[str]]] = GROUPS
+                   ) -> AggregationCube:
+    """
+    Aggregates every transaction column by state, year and month into an
+    `AggregationCube` in a single build, with the derived groups as extra
+    metrics.
+
+    Args:
+        data (str or pd.DataFrame, optional): Path of the CSV file or the
+            DataFrame returned by `read_breakdown`. Defaults to
+            "./Data/nics-firearm-background-checks.csv".
+        groups (dict, optional): Derived groups (see `add_groups`). Defaults
+            to `GROUPS`; None adds no group.
+
+    Returns:
+        AggregationCube: Cube with the transaction columns and the groups as
+            metrics.
+    """
+    df = read_breakdown(data) if isinstance(data, str) else data
+    categories = [column for column in TRANSACTIONS if column in df.columns]
+    cube = AggregationCube.from_dataset(df, categories)
+    if groups:
+        cube = cube.with_sums(_present(categories, groups))
+    return cube
+
+
+def transaction_breakdown(data: Union[str, pd.DataFrame, AggregationCube] =
+                          "./Data/nics-firearm-background-checks.csv",
+                          by: Iterable[str] = ("state", "year"),
+                          categories: Optional[Sequence[str]] = None,
+                          long: bool = False) -> pd.DataFrame:
+    """
+    Returns the sums of the transaction categories and of their groups by
+    the given dimensions.
+
+    Args:
+        data (str, pd.DataFrame or AggregationCube, optional): Path of the
+            CSV file, the DataFrame returned by `read_breakdown` or the cube
+            returned by `breakdown_cube`. Defaults to
+            "./Data/nics-firearm-background-checks.csv".
+        by (iterable of str, optional): Dimensions to group by, among
+            "state", "year" and "month". Defaults to ("state", "year").
+        categories (sequence of str, optional): Only these categories or
+            groups. Defaults to all of them.
+        long (bool, optional): Returns a row per category, with the columns
+            "category" and "count", instead of a column per category.
+            Defaults to False.
+
+    Returns:
+        pd.DataFrame: DataFrame with a column per dimension of `by` and the
+            sums of the categories.
+    """
+    cube = (data if isinstance(data, AggregationCube)
+            else breakdown_cube(data))
+    by = list(by)
+    df = cube.query(by)
+    if categories is not None:
+        unknown = [c for c in categories if c not in cube.metrics]
+        if unknown:
+            raise KeyError(f"Unknown categories: {unknown}")
+        df = df[by + list(categories)]
+    if long:
+        df = df.melt(id_vars=by, var_name="category", value_name="count")
+    return df
@@ -0,0 +1,274 @@
+# firearm_analysis/cli.py
+
+import argparse
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from .config import set_verbose
+from .cube import AggregationCube
+from .data_processing import file_hash
+from .map_generation import create_maps
+from .outliers import find_outliers
+from .population import per_capita
+from .profiling import profile_stages
+from .state_analysis import (
+    clean_states, merge_datasets, calculate_relative_values
+)
+from .visualization import time_evolution
+
+logger = logging.getLogger(__name__)
+
+# Stages of the analysis, in the order they run
+STAGES = ("ingest", "aggregate", "per-capita", "outliers", "charts", "maps")
+
+# Stages whose outputs are the inputs of each stage
+DEPENDENCIES = {
+    "ingest": (),
+    "aggregate": ("ingest",),
+    "per-capita": ("aggregate",),
+    "outliers": ("per-capita",),
+    "charts": ("ingest",),
+    "maps": ("outliers",),
+}
+
+# Name of the file with the input hashes of every stage that ran
+MANIFEST = "manifest.json"
+
+# Columns mapped by the "maps" stage (see `create_maps`)
+MAP_COLUMNS = ["permit_perc", "handgun_perc", "longgun_perc"]
+
+
+class Build:
+    """
+    Runs the stages of the analysis, writing their outputs (tables, charts
+    and maps) to a directory. A manifest in that directory records the
+    SHA-256 hash of the inputs and the options of every stage that ran; a
+    stage whose inputs and options did not change, and whose outputs still
+    exist, is skipped and its previous outputs are reused. The outputs of a
+    stage are the inputs of the next ones, so an unchanged table also skips
+    everything that is built from it.
+
+    Args:
+        data (str, optional): Path of the NICS CSV file. Defaults to
+            "./Data/nics-firearm-background-checks.csv".
+        url2 (str, optional): The URL of the population CSV file. Defaults
+            to "./Data/us-state-populations.csv".
+        geo_data (str, optional): Path of the GeoJSON file of the states.
+            Defaults to "./Data/us-states.json".
+        output_dir (str, optional): Directory of the outputs. Defaults to
+            "./output".
+        map_backend (str, optional): Backend of `create_maps`, "folium" or
+            "matplotlib". Defaults to "folium".
+    """
+
+    def __init__(self, data: str = "./Data/nics-firearm-background-checks.csv",
+                 url2: str = "./Data/us-state-populations.csv",
+                 geo_data: str = "./Data/us-states.json",
+                 output_dir: str = "./output", map_backend: str = "folium"):
+        self.data = data
+        self.url2 = url2
+        self.geo_data = geo_data
+        self.output_dir = output_dir
+        self.map_backend = map_backend
+        self.manifest_file = self.path(MANIFEST)
+        self.manifest = {}
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file) as file:
+                self.manifest = json.load(file)
+
+    def path(self, name: str) -> str:
+        """Path of an output file."""
+        return os.path.join(self.output_dir, name)
+
+    def files(self, stage: str) -> Tuple[List[str], List[str]]:
+        """
+        Returns the input and output files of a stage.
+
+        Args:
+            stage (str): Name of the stage.
+
+        Returns:
+            tuple: Paths of the inputs and of the outputs.
+        """
+        path = self.path
+        return {
+            "ingest": ([self.data], [path("cube.npz")]),
+            "aggregate": ([path("cube.npz")],
+                          [path("state_year.csv"), path("state.csv"),
+                           path("year.csv")]),
+            "per-capita": ([path("state_year.csv"), path("state.csv"),
+                            self.url2],
+                           [path("per_capita_state_year.csv"),
+                            path("per_capita_state.csv")]),
+            "outliers": ([path("per_capita_state_year.csv"),
+                          path("per_capita_state.csv")],
+                         [path("outliers_state.csv"),
+                          path("outlier_mask_state.csv"),
+                          path("outlier_mask_state_year.csv")]),
+            "charts": ([path("cube.npz")],
+                       [path(os.path.join("charts", "time_evolution.png"))]),
+            "maps": ([path("outliers_state.csv"), self.geo_data],
+                     [path(os.path.join("maps", f"{column}.png"))
+                      for column in MAP_COLUMNS]),
+        }[stage]
+
+    def options(self, stage: str) -> dict:
+        """Options of a stage that change its outputs."""
+        return {"backend": self.map_backend} if stage == "maps" else {}
+
+    def run(self, stages: Sequence[str] = STAGES,
+            force: bool = False) -> Dict[str, str]:
+        """
+        Runs the given stages and the stages they depend on, skipping the
+        ones that are up to date.
+
+        Args:
+            stages (sequence of str, optional): Stages to build. Defaults to
+                all of them.
+            force (bool, optional): Runs the given stages even if they are
+                up to date. Their dependencies are still skipped if they are
+                up to date. Defaults to False.
+
+        Returns:
+            dict: "ran" or "skipped" for every stage that was considered, in
+                the order they were considered.
+        """
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            raise ValueError(f"Unknown stages: {sorted(unknown)}")
+        needed = set()
+        pending = list(stages)
+        while pending:
+            stage = pending.pop()
+            if stage not in needed:
+                needed.add(stage)
+                pending.extend(DEPENDENCIES[stage])
+        os.makedirs(self.output_dir, exist_ok=True)
+        status = {}
+        for stage in (s for s in STAGES if s in needed):
+            inputs, outputs = self.files(stage)
+            entry = {"inputs": {os.path.relpath(path, self.output_dir):
+                                file_hash(path) for path in inputs},
+                     "options": self.options(stage)}
+            up_to_date = (self.manifest.get(stage) == entry
+                          and all(os.path.exists(path) for path in outputs))
+            if up_to_date and not (force and stage in stages):
+                logger.info("Stage %s is up to date", stage)
+                status[stage] = "skipped"
+                continue
+            logger.info("Running stage %s", stage)
+            for path in outputs:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            getattr(self, "_" + stage.replace("-", "_"))()
+            self.manifest[stage] = entry
+            # Save after every stage, so an interrupted build keeps them
+            with open(self.manifest_file, "w") as file:
+                json.dump(self.manifest, file, indent=1, sort_keys=True)
+            status[stage] = "ran"
+        return status
+
+    def _ingest(self) -> None:
+        """Parses the NICS CSV file into the aggregation cube."""
+        AggregationCube.from_dataset(self.data).save(self.path("cube.npz"))
+
+    def _aggregate(self) -> None:
+        """Writes the sums by state and year, by state and by year."""
+        cube = AggregationCube.load(self.path("cube.npz"))
+        for name, by in (("state_year", ["state", "year"]),
+                         ("state", ["state"]), ("year", ["year"])):
+            cube.query(by).to_csv(self.path(f"{name}.csv"), index=False)
+
+    def _per_capita(self) -> None:
+        """Writes the percentages of the population."""
+        df = pd.read_csv(self.path("state_year.csv"))
+        per_capita(df, self.url2).to_csv(
+            self.path("per_capita_state_year.csv"), index=False)
+        df = clean_states(pd.read_csv(self.path("state.csv")))
+        df = calculate_relative_values(merge_datasets(df, self.url2))
+        df.to_csv(self.path("per_capita_state.csv"), index=False)
+
+    def _outliers(self) -> None:
+        """Treats the outliers of the states and flags the ones of each
+        year."""
+        df = pd.read_csv(self.path("per_capita_state.csv"))
+        df, mask = find_outliers(df, MAP_COLUMNS, treatment="median")
+        df.to_csv(self.path("outliers_state.csv"), index=False)
+        mask.assign(state=df["state"]).to_csv(
+            self.path("outlier_mask_state.csv"), index=False)
+        df = pd.read_csv(self.path("per_capita_state_year.csv"))
+        _, mask = find_outliers(df, MAP_COLUMNS, by="year")
+        mask.assign(state=df["state"], year=df["year"]).to_csv(
+            self.path("outlier_mask_state_year.csv"), index=False)
+
+    def _charts(self) -> None:
+        """Draws the time evolution of the metrics."""
+        cube = AggregationCube.load(self.path("cube.npz"))
+        time_evolution(cube, output=self.path(
+            os.path.join("charts", "time_evolution.png")))
+
+    def _maps(self) -> None:
+        """Draws the maps of the percentages."""
+        create_maps(pd.read_csv(self.path("outliers_state.csv")),
+                    geo_data=self.geo_data,
+                    output_dir=self.path("maps"), backend=self.map_backend)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> Dict[str, str]:
+    """
+    Runs the analysis from the command line:
+    `python -m firearm_analysis --stages per-capita charts`.
+
+    Args:
+        argv (sequence of str, optional): Command line arguments. Defaults to
+            the ones of the process.
+
+    Returns:
+        dict: "ran" or "skipped" for every stage (see `Build.run`).
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m firearm_analysis",
+        description="Builds the tables, charts and maps of the NICS data, "
+                    "skipping the stages whose inputs did not change.")
+    parser.add_argument("--data",
+                        default="./Data/nics-firearm-background-checks.csv",
+                        help="NICS CSV file")
+    parser.add_argument("--population",
+                        default="./Data/us-state-populations.csv",
+                        help="population CSV file")
+    parser.add_argument("--geo-data", default="./Data/us-states.json",
+                        help="GeoJSON file of the states")
+    parser.add_argument("--output", default="./output",
+                        help="directory of the outputs and the manifest")
+    parser.add_argument("--stages", nargs="+", choices=STAGES,
+                        default=list(STAGES),
+                        help="stages to build, with their dependencies "
+                             "(default: all)")
+    parser.add_argument("--map-backend", choices=["folium", "matplotlib"],
+                        default="folium", help="backend of the maps")
+    parser.add_argument("--force", action="store_true",
+                        help="run the selected stages even if up to date")
+    parser.add_argument("--verbose", action="store_true",
+                        help="log the intermediate DataFrames")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="write the time and memory of every stage of "
+                             "the analysis to a JSON file")
+    parser.add_argument("--profile-dir", metavar="DIR",
+                        help="with --profile, also write a cProfile dump "
+                             "per stage to a directory")
+    args = parser.parse_args(argv)
+    if args.verbose:
+        set_verbose()
+    build = Build(args.data, args.population, args.geo_data, args.output,
+                  args.map_backend)
+    if args.profile:
+        with profile_stages(args.profile, cprofile_dir=args.profile_dir):
+            status = build.run(args.stages, force=args.force)
+    else:
+        status = build.run(args.stages, force=args.force)
+    for stage, result in status.items():
+        print(f"{stage}: {result}")
+    return status
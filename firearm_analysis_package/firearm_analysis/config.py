@@ -0,0 +1,36 @@
+# firearm_analysis/config.py
+
+import logging
+import sys
+
+# Package logger. It stays silent unless `set_verbose` is called.
+logger = logging.getLogger("firearm_analysis")
+logger.addHandler(logging.NullHandler())
+
+# Handler writing the diagnostic messages to the standard output
+_handler = logging.StreamHandler()
+_handler.setFormatter(logging.Formatter("%(message)s"))
+
+
+def set_verbose(verbose: bool = True) -> None:
+    """
+    Turns on or off the diagnostic output of the package (first rows,
+    structure and columns of the intermediate DataFrames). The output goes
+    through the `logging` module at the INFO level, so when it is off none
+    of the reported DataFrames are formatted.
+
+    Args:
+        verbose (bool, optional): Shows the diagnostic output on the standard
+            output. Defaults to True.
+
+    Returns:
+        None
+    """
+    if verbose:
+        logger.setLevel(logging.INFO)
+        _handler.setStream(sys.stdout)
+        if _handler not in logger.handlers:
+            logger.addHandler(_handler)
+    else:
+        logger.setLevel(logging.WARNING)
+        logger.removeHandler(_handler)
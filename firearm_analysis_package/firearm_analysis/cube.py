@@ -0,0 +1,276 @@
+# firearm_analysis/cube.py
+
+import itertools
+from typing import Dict, Iterable, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from .data_processing import COLUMNS_OF_INTEREST, load_dataset
+
+# Dimensions of the cube, in the order of the axes of its arrays
+DIMENSIONS = ("state", "year", "month")
+
+
+class AggregationCube:
+    """
+    Sums of the NICS metrics at the state x year x month grain, together with
+    all their roll-ups (state x year, state, year, national totals, ...).
+    The cube is built with a single pass over the monthly rows and stored as
+    dense NumPy arrays, so every query only touches the cells it returns.
+
+    Args:
+        states (sequence of str): Names of the states (first axis).
+        years (sequence of int): Consecutive years (second axis).
+        values (np.ndarray): Sums with shape (states, years, 12, metrics).
+        observed (np.ndarray): Boolean array with shape (states, years, 12)
+            marking the cells with at least one row of data.
+        metrics (sequence of str): Names of the metrics (last axis).
+    """
+
+    def __init__(self, states: Sequence[str], years: Sequence[int],
+                 values: np.ndarray, observed: np.ndarray,
+                 metrics: Sequence[str]):
+        self.states = list(states)
+        self.years = [int(year) for year in years]
+        self.metrics = list(metrics)
+        self._state_ids = {state: i for i, state in enumerate(self.states)}
+        # Pre-compute every roll-up, keyed by the dimensions that are kept
+        self._values = {}
+        self._observed = {}
+        for n in range(len(DIMENSIONS) + 1):
+            for kept in itertools.combinations(DIMENSIONS, n):
+                axes = tuple(i for i, d in enumerate(DIMENSIONS)
+                             if d not in kept)
+                self._values[kept] = values.sum(axis=axes)
+                self._observed[kept] = observed.any(axis=axes)
+
+    @classmethod
+    def from_dataset(cls, data: Union[str, pd.DataFrame] =
+                     "./Data/nics-firearm-background-checks.csv",
+                     metrics: Sequence[str] = COLUMNS_OF_INTEREST[2:]
+                     ) -> "AggregationCube":
+        """
+        Builds the cube from the monthly NICS rows.
+
+        Args:
+            data (str or pd.DataFrame, optional): Path of the CSV file or the
+                DataFrame returned by `load_dataset`. Defaults to
+                "./Data/nics-firearm-background-checks.csv".
+            metrics (sequence of str, optional): Columns to sum. Defaults to
+                "permit", "handgun" and "long_gun".
+
+        Returns:
+            AggregationCube: Cube with the sums of the given data.
+        """
+        df = load_dataset(data)
+        state = df["state"].astype("category")
+        states = state.cat.categories.tolist()
+        year = df["year"].to_numpy(dtype=np.int64)
+        first_year = int(year.min()) if len(year) else 0
+        n_years = int(year.max()) - first_year + 1 if len(year) else 0
+        shape = (len(states), n_years, 12)
+        # Flat position of each row in the base grain of the cube
+        cell = np.ravel_multi_index(
+            (state.cat.codes.to_numpy(dtype=np.int64), year - first_year,
+             df["month"].to_numpy(dtype=np.int64) - 1), shape)
+        size = int(np.prod(shape))
+        values = np.empty(shape + (len(metrics),), dtype=np.int64)
+        for i, metric in enumerate(metrics):
+            # Missing counts (NaN in the frames of `read_csv`) count as 0
+            weights = np.nan_to_num(df[metric].to_numpy(dtype=np.float64))
+            values[..., i] = np.bincount(cell, weights=weights,
+                                         minlength=size).reshape(shape)
+        observed = np.bincount(cell, minlength=size).reshape(shape) > 0
+        return cls(states, range(first_year, first_year + n_years), values,
+                   observed, metrics)
+
+    def query(self, by: Iterable[str] = ("state", "year"),
+              state: Optional[Union[str, Sequence[str]]] = None,
+              year: Optional[Union[int, Sequence[int]]] = None,
+              month: Optional[Union[int, Sequence[int]]] = None
+              ) -> pd.DataFrame:
+        """
+        Returns the sums of the metrics grouped by the given dimensions, in
+        the same shape as `groupby_state_and_year` and `groupby_state`.
+
+        Args:
+            by (iterable of str, optional): Dimensions to group by, among
+                "state", "year" and "month". Defaults to ("state", "year").
+            state (str or sequence of str, optional): Only these states.
+                They must also be in `by`.
+            year (int or sequence of int, optional): Only these years.
+                They must also be in `by`.
+            month (int or sequence of int, optional): Only these months.
+                They must also be in `by`.
+
+        Returns:
+            pd.DataFrame: DataFrame with a column per dimension of `by` and
+                per metric. Combinations without data are left out.
+        """
+        by = list(by)
+        kept = tuple(d for d in DIMENSIONS if d in by)
+        if len(kept) != len(by):
+            raise ValueError(f"Unknown dimensions in {by}")
+        filters = {"state": state, "year": year, "month": month}
+        index = []
+        labels = []
+        for dimension in kept:
+            all_labels = self._labels(dimension)
+            selected = filters[dimension]
+            if selected is None:
+                positions = np.arange(len(all_labels))
+            else:
+                if np.isscalar(selected):
+                    selected = [selected]
+                positions = np.array([self._position(dimension, label)
+                                      for label in selected], dtype=np.int64)
+            index.append(positions)
+            labels.append(np.asarray(all_labels, dtype=object)[positions])
+        for dimension, selected in filters.items():
+            if selected is not None and dimension not in kept:
+                raise ValueError(f"Filter on '{dimension}' requires grouping "
+                                 f"by it")
+        grid = np.ix_(*index) if index else ()
+        values = self._values[kept][grid].reshape(-1, len(self.metrics))
+        observed = self._observed[kept][grid].reshape(-1)
+        columns = {}
+        for dimension, dimension_labels in zip(
+                kept, _cartesian(labels, len(observed))):
+            columns[dimension] = dimension_labels
+        for i, metric in enumerate(self.metrics):
+            columns[metric] = values[:, i]
+        df = pd.DataFrame(columns)
+        df = df[observed].reset_index(drop=True)
+        for dimension in ("year", "month"):
+            if dimension in df.columns:
+                df[dimension] = df[dimension].astype("int64")
+        return df
+
+    def national(self) -> pd.Series:
+        """
+        Returns the national totals of every metric.
+
+        Returns:
+            pd.Series: Totals indexed by metric.
+        """
+        return pd.Series(self._values[()], index=self.metrics)
+
+    def to_array(self, by: Iterable[str] = ("state", "year")) -> np.ndarray:
+        """
+        Returns the sums of the metrics grouped by the given dimensions as a
+        dense array, with NaN in the combinations without data.
+
+        Args:
+            by (iterable of str, optional): Dimensions to group by, among
+                "state", "year" and "month". Defaults to ("state", "year").
+
+        Returns:
+            np.ndarray: Array with an axis per dimension, in the order
+                "state", "year", "month", and a last axis for the metrics.
+        """
+        by = list(by)
+        kept = tuple(d for d in DIMENSIONS if d in by)
+        if len(kept) != len(by):
+            raise ValueError(f"Unknown dimensions in {by}")
+        values = self._values[kept].astype(np.float64)
+        values[~self._observed[kept]] = np.nan
+        return values
+
+    def with_sums(self, groups: Dict[str, Sequence[str]]
+                  ) -> "AggregationCube":
+        """
+        Returns a cube with extra metrics that are sums of the existing ones,
+        such as all the handgun transactions. All the groups are computed
+        with a single matrix product over the state x year x month sums.
+
+        Args:
+            groups (dict): Names of the new metrics and the metrics they sum.
+
+        Returns:
+            AggregationCube: Cube with the metrics and then the groups.
+        """
+        positions = {metric: i for i, metric in enumerate(self.metrics)}
+        members = np.zeros((len(self.metrics), len(groups)), dtype=np.int64)
+        for j, metrics in enumerate(groups.values()):
+            for metric in metrics:
+                if metric not in positions:
+                    raise KeyError(f"Unknown metric: {metric}")
+                members[positions[metric], j] = 1
+        values = self._values[DIMENSIONS]
+        return AggregationCube(
+            self.states, self.years,
+            np.concatenate([values, values @ members], axis=-1),
+            self._observed[DIMENSIONS], self.metrics + list(groups))
+
+    def save(self, path: str) -> None:
+        """
+        Saves the cube to a compressed NumPy file, so it can be loaded
+        without reading the CSV file again.
+
+        Args:
+            path (str): Path of the file (".npz").
+
+        Returns:
+            None
+        """
+        kept = DIMENSIONS
+        np.savez_compressed(path, states=np.array(self.states, dtype=str),
+                            years=np.array(self.years, dtype=np.int64),
+                            metrics=np.array(self.metrics, dtype=str),
+                            values=self._values[kept],
+                            observed=self._observed[kept])
+
+    @classmethod
+    def load(cls, path: str) -> "AggregationCube":
+        """
+        Loads a cube saved with `save`.
+
+        Args:
+            path (str): Path of the file.
+
+        Returns:
+            AggregationCube: Loaded cube.
+        """
+        with np.load(path) as data:
+            return cls(data["states"].tolist(), data["years"].tolist(),
+                       data["values"], data["observed"],
+                       data["metrics"].tolist())
+
+    def _labels(self, dimension: str) -> list:
+        """Labels of the given dimension."""
+        if dimension == "state":
+            return self.states
+        if dimension == "year":
+            return self.years
+        return list(range(1, 13))
+
+    def _position(self, dimension: str, label) -> int:
+        """Position of a label in the axis of the given dimension."""
+        if dimension == "state":
+            if label not in self._state_ids:
+                raise KeyError(f"Unknown state: {label}")
+            return self._state_ids[label]
+        first = self.years[0] if dimension == "year" and self.years else 1
+        size = len(self.years) if dimension == "year" else 12
+        if not 0 <= int(label) - first < size:
+            raise KeyError(f"Unknown {dimension}: {label}")
+        return int(label) - first
+
+
+def _cartesian(labels: list, size: int) -> list:
+    """
+    Repeats the labels of each dimension to follow the row-major order of
+    the selected cells.
+
+    Args:
+        labels (list of np.ndarray): Labels of each dimension.
+        size (int): Number of selected cells.
+
+    Returns:
+        list of np.ndarray: One array of `size` labels per dimension.
+    """
+    if not labels:
+        return []
+    grids = np.meshgrid(*labels, indexing="ij")
+    return [grid.reshape(size) for grid in grids]
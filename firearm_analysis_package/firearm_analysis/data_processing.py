@@ -1,31 +1,339 @@
 # firearm_analysis/data_processing.py
 
+import contextlib
+import functools
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+from typing import Callable, Iterator, List, Optional, Union
+
 import pandas as pd
 
+from .profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+# Columns of the NICS file used by the analysis
+COLUMNS_OF_INTEREST = ["month", "state", "permit", "handgun", "long_gun"]
+
+# Compact dtypes of the columns of interest. A monthly count of a state fits
+# in 32 bits, but their sums may not: see `widen_counts`
+COMPACT_DTYPES = {"state": "category", "permit": "int32", "handgun": "int32",
+                  "long_gun": "int32"}
+
+# Parsed NICS datasets keyed by (absolute path, mtime, size)
+_DATASET_CACHE = {}
+
+
+@profiled
+def file_hash(path: str) -> str:
+    """
+    Calculates the SHA-256 hash of a file reading it in blocks.
+
+    Args:
+        path (str): Path of the file.
+
+    Returns:
+        str: Hexadecimal digest of the file.
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+@profiled
+def read_nics(url: str = "./Data/nics-firearm-background-checks.csv",
+              columns: Optional[List[str]] = COLUMNS_OF_INTEREST,
+              cache: bool = True) -> pd.DataFrame:
+    """
+    Reads the NICS CSV file through a persistent columnar cache. The first
+    read writes the table (with "longgun" renamed to "long_gun") to a Parquet
+    file in a ".cache" directory next to the CSV file. Later reads load only
+    the requested columns from that file instead of parsing the CSV again.
+    The cache is trusted while the modification time and size of the CSV
+    file match the ones it was built from. When only the modification time
+    changed, the SHA-256 hash of the file decides whether it is rebuilt.
+    Without pyarrow, or if the cache cannot be written, the CSV file is
+    parsed directly.
 
-def read_csv(url: str =
-             "./Data/nics-firearm-background-checks.csv") -> pd.DataFrame:
+    Args:
+        url (str, optional): Path of the CSV file. Defaults to
+            "./Data/nics-firearm-background-checks.csv".
+        columns (list of str, optional): Columns to materialize, or None for
+            all of them. Defaults to `COLUMNS_OF_INTEREST`.
+        cache (bool, optional): Uses the persistent cache. Defaults to True.
 
+    Returns:
+        pd.DataFrame: DataFrame with the requested columns.
     """
-    Reads a CSV file from a specified URL and displays the first five
-    rows and the information of the file.
+    if cache:
+        try:
+            import pyarrow
+        except ImportError:
+            cache = False
+    if not cache:
+        df = pd.read_csv(url).rename(columns={"longgun": "long_gun"})
+        return df if columns is None else df[columns]
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(url)), ".cache")
+    name = os.path.splitext(os.path.basename(url))[0]
+    cache_file = os.path.join(cache_dir, f"{name}.parquet")
+    meta_file = os.path.join(cache_dir, f"{name}.json")
+    stat = os.stat(url)
+    meta = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+    try:
+        with open(meta_file) as file:
+            cached_meta = json.load(file)
+    except (OSError, ValueError):
+        cached_meta = {}
+    valid = False
+    if os.path.exists(cache_file):
+        if all(cached_meta.get(k) == v for k, v in meta.items()):
+            valid = True
+        elif cached_meta.get("size") == stat.st_size:
+            # The file was touched or copied: only hash it when the cheap
+            # checks disagree, so an unchanged content keeps the cache
+            meta["sha256"] = file_hash(url)
+            valid = cached_meta.get("sha256") == meta["sha256"]
+            if valid:
+                _write_meta(meta_file, meta)
+    if valid:
+        return pd.read_parquet(cache_file, columns=columns, memory_map=True)
+    df = pd.read_csv(url).rename(columns={"longgun": "long_gun"})
+    if "sha256" not in meta:
+        meta["sha256"] = file_hash(url)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        _write_atomic(cache_file,
+                      functools.partial(df.to_parquet, index=False))
+        _write_meta(meta_file, meta)
+    except (OSError, pyarrow.ArrowException) as err:
+        # Columns that Parquet cannot store (mixed types, ...) only lose the
+        # cache, the parsed file is still returned
+        logger.warning("The cache of %s could not be written: %s", url, err)
+    return df if columns is None else df[columns]
+
+
+def _write_atomic(path: str, write: Callable[[str], None]) -> None:
+    """
+    Writes a file through a temporary file of its directory that replaces
+    it once complete, so readers never see partial data. The temporary name
+    is unique, so concurrent writers do not overwrite each other's file.
+
+    Args:
+        path (str): Path of the file.
+        write (callable): Writes the content to the given path.
+
+    Returns:
+        None
+    """
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path),
+                                     suffix=".tmp", delete=False) as file:
+        temporary = file.name
+    try:
+        write(temporary)
+        os.replace(temporary, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temporary)
+        raise
+
+
+def _write_meta(path: str, meta: dict) -> None:
+    """Writes the metadata of a cache file, replacing it atomically."""
+
+    def write(temporary: str) -> None:
+        with open(temporary, "w") as file:
+            json.dump(meta, file)
+
+    try:
+        _write_atomic(path, write)
+    except OSError:
+        pass
+
+
+def widen_counts(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Casts the compact 32-bit counts of a DataFrame to 64 bits, so they can be
+    summed or multiplied without overflowing. The other columns are left as
+    they are.
+
+    Args:
+        df (pd.DataFrame): DataFrame with some of the count columns of
+            `COMPACT_DTYPES`.
+
+    Returns:
+        pd.DataFrame: DataFrame with the counts as 64-bit integers.
+    """
+    return df.astype({column: "int64" for column, dtype
+                      in COMPACT_DTYPES.items()
+                      if column in df.columns and dtype == "int32"})
+
+
+def _compact(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Splits the "month" column and converts the columns of interest of a
+    DataFrame read from the NICS CSV file to their compact dtypes.
+
+    Args:
+        df (pd.DataFrame): DataFrame with the columns of interest.
+
+    Returns:
+        pd.DataFrame: DataFrame with the columns "year", "month", "state",
+            "permit", "handgun" and "long_gun".
+    """
+    df = split_date(df, inplace=True)
+    for column, dtype in COMPACT_DTYPES.items():
+        values = df[column]
+        if dtype != "category":
+            values = values.fillna(0)
+        df[column] = values.astype(dtype)
+    return df[["year", "month"] + COLUMNS_OF_INTEREST[1:]]
+
+
+@profiled
+def read_compact(url: str = "./Data/nics-firearm-background-checks.csv",
+                 cache: bool = True, chunksize: Optional[int] = None
+                 ) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+    """
+    Reads only the columns of interest of the NICS CSV file with compact
+    dtypes: "state" as a categorical, the counts as 32-bit integers (missing
+    values as 0) and "month" parsed into integer "year" and "month" columns.
+    The "longgun" header variation is resolved while reading, so there is no
+    need to call `rename_col` afterwards. Compressed files (".gz", ".bz2",
+    ...) are decompressed on the fly.
+
+    Args:
+        url (str, optional): Path of the CSV file. Defaults to
+            "./Data/nics-firearm-background-checks.csv".
+        cache (bool, optional): Reads through the persistent cache of
+            `read_nics`. Ignored when reading in chunks. Defaults to True.
+        chunksize (int, optional): Returns an iterator of DataFrames with
+            this number of rows instead of a single DataFrame, so the file is
+            never loaded in memory at once. Defaults to None.
+
+    Returns:
+        pd.DataFrame or iterator: DataFrame (or chunks of it) with the columns
+            "year", "month", "state", "permit", "handgun" and "long_gun".
+    """
+    if cache and chunksize is None:
+        return _compact(read_nics(url, COLUMNS_OF_INTEREST))
+    # Only tokenize the needed columns, under either header name
+    reader = pd.read_csv(
+        url,
+        usecols=lambda c: c in COLUMNS_OF_INTEREST or c == "longgun",
+        dtype={"month": "category", "state": "category"},
+        chunksize=chunksize,
+    )
+    if chunksize is None:
+        return _compact(reader.rename(columns={"longgun": "long_gun"}))
+    return _iter_compact(reader)
+
+
+def _iter_compact(reader: Iterator[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """
+    Converts the chunks of a CSV reader to the compact layout and closes the
+    file when the iteration ends.
+
+    Args:
+        reader (iterator): Reader returned by `pd.read_csv` with a chunksize.
+
+    Returns:
+        iterator: Compact DataFrames.
+    """
+    with reader:
+        for chunk in reader:
+            yield _compact(chunk.rename(columns={"longgun": "long_gun"}))
+
+
+@profiled
+def read_csv(url: str = "./Data/nics-firearm-background-checks.csv",
+             columns: Optional[List[str]] = COLUMNS_OF_INTEREST,
+             cache: bool = True, compact: bool = False,
+             breakdown: bool = False) -> pd.DataFrame:
+
+    """
+    Reads a CSV file from a specified URL and logs the first five
+    rows and the information of the file. The file is read through the
+    persistent columnar cache of `read_nics`, or through `read_compact`
+    in compact mode.
 
     Args:
         (str, optional): URL of the CSV file. Must contain, at least, the
             columns "month", "state", "permit", "handgun" and "long_gun".
             Defaults to "./Data/nics-firearm-background-checks.csv".
+        columns (list of str, optional): Columns to materialize, or None for
+            all of them. Defaults to `COLUMNS_OF_INTEREST`.
+        cache (bool, optional): Uses the persistent cache. Defaults to True.
+        compact (bool, optional): Reads the columns of interest with compact
+            dtypes and the "month" column already split into "year" and
+            "month" (`columns` is then ignored). Defaults to False.
+        breakdown (bool, optional): Reads every transaction column in the
+            compact layout of `read_breakdown` (`columns` and `compact` are
+            then ignored). Defaults to False.
 
     Returns:
         pd.DataFrame: DataFrame of the corresponding CSV file.
     """
-    df = pd.read_csv(url)
-    print("\nFirst five columns of the DataFrame:\n")
-    display(df.head())
-    print("\nStructure of the DataFrame:\n")
-    display(df.info())
+    if breakdown:
+        from .breakdown import read_breakdown
+        df = read_breakdown(url, cache)
+    elif compact:
+        df = read_compact(url, cache)
+    else:
+        df = read_nics(url, columns, cache)
+    if logger.isEnabledFor(logging.INFO):
+        buffer = io.StringIO()
+        df.info(buf=buffer)
+        logger.info("\nFirst five columns of the DataFrame:\n\n%s", df.head())
+        logger.info("\nStructure of the DataFrame:\n\n%s", buffer.getvalue())
     return df
 
 
+@profiled
+def load_dataset(data: Union[str, pd.DataFrame] =
+                 "./Data/nics-firearm-background-checks.csv"
+                 ) -> pd.DataFrame:
+    """
+    Parses the NICS CSV file only once into a cleaned DataFrame with the
+    columns "year", "month", "state", "permit", "handgun" and "long_gun"
+    (see `read_compact`).
+    The parsed DataFrame is cached by file path, modification time and size,
+    so later calls with the same unchanged file do not read it again. An
+    already loaded DataFrame is returned as it is, with its "month" column
+    split by `split_date` if it has no "year" column yet.
+
+    Args:
+        data (str or pd.DataFrame, optional): Path of the CSV file or an
+            already loaded DataFrame. Defaults to
+            "./Data/nics-firearm-background-checks.csv".
+
+    Returns:
+        pd.DataFrame: Cleaned DataFrame (a copy when it comes from the
+            cache).
+    """
+    if isinstance(data, pd.DataFrame):
+        if "year" not in data.columns:
+            data = split_date(data)
+        return data
+    path = os.path.abspath(data)
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if key not in _DATASET_CACHE:
+        df = read_compact(path)
+        # Drop the entries of older versions of the same file
+        for old_key in [k for k in _DATASET_CACHE if k[0] == path]:
+            del _DATASET_CACHE[old_key]
+        _DATASET_CACHE[key] = df
+    # Callers modify the DataFrame in place, so never hand out the cached one
+    return _DATASET_CACHE[key].copy()
+
+
+@profiled
 def clean_csv(df: pd.DataFrame) -> pd.DataFrame:
     """
     Cleans the DataFrame obtained from the CSV file obtained from the URL
@@ -38,13 +346,16 @@ def clean_csv(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         pd.DataFrame: DataFrame with the columns of interest.
     """
-    columns_of_interest = ["month", "state", "permit", "handgun", "long_gun"]
-    df_clean = df[columns_of_interest]
-    print(f"\nColumns of the original DataFrame:\n{df.columns.tolist()}")
-    print(f"\nColumns of the cleaned DataFrame:\n{df_clean.columns.tolist()}")
+    df_clean = df[COLUMNS_OF_INTEREST]
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("\nColumns of the original DataFrame:\n%s",
+                    df.columns.tolist())
+        logger.info("\nColumns of the cleaned DataFrame:\n%s",
+                    df_clean.columns.tolist())
     return df_clean
 
 
+@profiled
 def rename_col(df: pd.DataFrame) -> pd.DataFrame:
     """
     Modify the column name "longgun" for "long_gun" in the given DataFrame.
@@ -55,16 +366,55 @@ def rename_col(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         pd.DataFrame: DataFrame with the modified column.
     """
+    original_columns = df.columns
     df.rename(columns={"longgun": "long_gun"}, inplace=True)
-    print(f"\nOriginal DataFrame columns:\n{df.columns.tolist()}")
-    print(f"\nColumns of DataFrame after renaming:\n{df.columns.tolist()}")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("\nOriginal DataFrame columns:\n%s",
+                    original_columns.tolist())
+        logger.info("\nColumns of DataFrame after renaming:\n%s",
+                    df.columns.tolist())
+    return df
+
+
+@profiled
+def split_date(df: pd.DataFrame, inplace: bool = False,
+               as_period: bool = False) -> pd.DataFrame:
+    """
+    Splits the "month" column of a given DataFrame, in the format "YYYY-MM",
+    into the integer columns "year" (int16) and "month" (int8), with the
+    "year" column inserted right before the "month" column. Only the
+    distinct values of the column are parsed, and the result is spread over
+    the rows through their categorical codes.
+
+    Args:
+        df (pd.DataFrame): DataFrame with the original "month" column.
+        inplace (bool, optional): Modifies the given DataFrame instead of
+            a shallow copy of it. Defaults to False.
+        as_period (bool, optional): Also sets a monthly `pd.PeriodIndex`
+            as the index of the DataFrame. Defaults to False.
+
+    Returns:
+        pd.DataFrame: DataFrame with the columns "year" and "month".
+    """
+    if not inplace:
+        df = df.copy(deep=False)
+    month = df["month"].astype("category")
+    parts = month.cat.categories.to_series().str.split("-", expand=True)
+    codes = month.cat.codes.to_numpy()
+    year = parts[0].astype("int16").to_numpy()[codes]
+    df.insert(df.columns.get_loc("month"), "year", year)
+    df["month"] = parts[1].astype("int8").to_numpy()[codes]
+    if as_period:
+        df.index = pd.PeriodIndex.from_fields(year=df["year"],
+                                              month=df["month"], freq="M")
     return df
 
 
+@profiled
 def breakdown_date(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Divides the "month" column of a given DataFrame into two columns:
-    "year" and "month".
+    Divides the "month" column of a given DataFrame into two integer columns:
+    "year" and "month" (see `split_date`).
 
     Args:
         df (pd.DataFrame): DataFrame with the original "month" column
@@ -73,16 +423,14 @@ def breakdown_date(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         pd.DataFrame: DataFrame with the columns "year" and "month".
     """
-    month_index = df.columns.get_loc("month")  # find index of 'month' column
-    df.insert(month_index, "year", "")  # insert 'year' col right before
-    # Copy-on-Write recommended way to change the values of an object
-    df.loc[:, ["year"]] = df["month"].str.split("-", expand=True)[0]
-    df.loc[:, ["month"]] = df["month"].str.split("-", expand=True)[1]
-    print("\nDataFrame with 'month' columns split into 'year' and 'month':")
-    display(df.head())
+    df = split_date(df, inplace=True)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("\nDataFrame with 'month' columns split into 'year' and "
+                    "'month':\n%s", df.head())
     return df
 
 
+@profiled
 def erase_month(df: pd.DataFrame) -> pd.DataFrame:
     """
     Deletes the "month" column of a given DataFrame.
@@ -94,12 +442,14 @@ def erase_month(df: pd.DataFrame) -> pd.DataFrame:
         pd.DataFrame: DataFrame without the "month" column.
     """
     df = df.drop(columns=["month"])
-    print("\nDataFrame without the 'month' column:")
-    display(df.head())
-    print(f"\nCurrent columns of the DataFrame:\n{df.columns.tolist()}")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("\nDataFrame without the 'month' column:\n%s", df.head())
+        logger.info("\nCurrent columns of the DataFrame:\n%s",
+                    df.columns.tolist())
     return df
 
 
+@profiled
 def groupby_state_and_year(df: pd.DataFrame) -> pd.DataFrame:
     """
     Groups the data by the "year" and "state" columns of a given DataFrame and
@@ -113,16 +463,19 @@ def groupby_state_and_year(df: pd.DataFrame) -> pd.DataFrame:
         pd.DataFrame: DataFrame grouped by "state" and "year" with cumulative
         values.
     """
-    grouped_df = df.groupby(["state", "year"]).sum().reset_index()
-    print("\nGrouped data by 'year' and 'state':")
-    display(grouped_df.head())
+    grouped_df = (widen_counts(df).groupby(["state", "year"], observed=True)
+                  .sum().reset_index())
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("\nGrouped data by 'year' and 'state':\n%s",
+                    grouped_df.head())
     return grouped_df
 
 
+@profiled
 def print_biggest_handguns(df: pd.DataFrame):
     """
     Prints out the state and year with the biggest number of registered
-    handguns.
+    handguns. See `Ranking` for the top-k pairs of any metric.
 
     Args:
         df (pd.DataFrame): DataFrame with the columns "year", "state",
@@ -138,10 +491,11 @@ def print_biggest_handguns(df: pd.DataFrame):
           f"with a total of {max_row['handgun']} handguns.")
 
 
+@profiled
 def print_biggest_longguns(df: pd.DataFrame):
     """
     Prints out the state and year with the biggest number of registered long
-    guns.
+    guns. See `Ranking` for the top-k pairs of any metric.
 
     Args:
         df (pd.DataFrame): DataFrame with the columns "year", "state",
@@ -0,0 +1,211 @@
+# firearm_analysis/incremental.py
+
+import functools
+import json
+import logging
+import os
+import tempfile
+from typing import Callable, Dict, List
+
+import pandas as pd
+
+from .data_processing import COLUMNS_OF_INTEREST, read_compact
+from .state_analysis import (
+    clean_states, merge_datasets, calculate_relative_values
+)
+
+logger = logging.getLogger(__name__)
+
+# Numeric columns summed by the aggregations
+METRICS = COLUMNS_OF_INTEREST[2:]
+
+# Columns of the persisted state x month table
+STATE_MONTH_COLUMNS = ["state", "year", "month"] + METRICS
+
+
+def _period(df: pd.DataFrame) -> pd.Series:
+    """
+    Encodes the "year" and "month" columns as a single integer YYYYMM.
+
+    Args:
+        df (pd.DataFrame): DataFrame with the columns "year" and "month".
+
+    Returns:
+        pd.Series: Periods of the rows.
+    """
+    return df["year"].astype("int32") * 100 + df["month"].astype("int32")
+
+
+class IncrementalAggregates:
+    """
+    State x year and state totals of the NICS data that are kept up to date
+    with each new release of the CSV file without reprocessing the history.
+
+    The totals are persisted in a directory together with the sums of every
+    state and month, the last month ingested (the watermark, as the integer
+    YYYYMM), a fingerprint of the rows of every month and the modification
+    time and size of the last file ingested. On `update`, a file that did not
+    change since the last one is not read at all. Otherwise the file is read
+    once: a CSV file cannot be seeked by month, so the rows of the months up
+    to the watermark are still parsed, but they are only hashed and summed
+    by state and month. The months newer than the watermark are folded in,
+    and a month whose fingerprint changed (a late correction) replaces its
+    previous values.
+
+    Args:
+        path (str): Directory of the persisted aggregates. It is created on
+            the first `save`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.watermark = None
+        self.fingerprints = {}
+        self.source = None
+        self.state_month = pd.DataFrame(columns=STATE_MONTH_COLUMNS)
+        self.state_year = pd.DataFrame(columns=["state", "year"] + METRICS)
+        self.state = pd.DataFrame(columns=["state"] + METRICS)
+        meta_file = os.path.join(path, "meta.json")
+        if os.path.exists(meta_file):
+            with open(meta_file) as file:
+                meta = json.load(file)
+            self.watermark = meta["watermark"]
+            self.fingerprints = {int(k): int(v)
+                                 for k, v in meta["fingerprints"].items()}
+            self.source = meta.get("source")
+            self.state_month = pd.read_csv(
+                os.path.join(path, "state_month.csv"))
+            self._roll_up()
+
+    def update(self, url: str = "./Data/nics-firearm-background-checks.csv",
+               chunksize: int = 100_000) -> Dict[str, List[int]]:
+        """
+        Folds a new release of the NICS CSV file into the aggregates and
+        saves them. The file may contain the whole history or only the new
+        months; months missing from it are left untouched.
+
+        Args:
+            url (str, optional): Path of the CSV file. Defaults to
+                "./Data/nics-firearm-background-checks.csv".
+            chunksize (int, optional): Number of rows read at once. Defaults
+                to 100000.
+
+        Returns:
+            dict: Months (as YYYYMM) that were "added" and "corrected".
+        """
+        watermark = self.watermark or 0
+        stat = os.stat(url)
+        source = {"path": os.path.abspath(url), "mtime_ns": stat.st_mtime_ns,
+                  "size": stat.st_size}
+        if source == self.source:
+            logger.info("%s did not change since the last update", url)
+            return {"added": [], "corrected": []}
+        fingerprints = {}
+        parts = []
+        for chunk in read_compact(url, chunksize=chunksize):
+            period = _period(chunk)
+            hashes = pd.util.hash_pandas_object(
+                chunk[["state"] + METRICS].astype({"state": str}),
+                index=False)
+            # Sums of hashes (modulo 2**64) do not depend on the row order
+            for key, value in hashes.groupby(period.to_numpy()).sum().items():
+                fingerprints[key] = (fingerprints.get(key, 0)
+                                     + int(value)) % 2 ** 64
+            # The sums by state and month are small, so the ones of every
+            # month are kept until the corrected months are known
+            parts.append(self._aggregate(chunk))
+        corrected = sorted(
+            key for key, value in fingerprints.items()
+            if key <= watermark and self.fingerprints.get(key) != value)
+        added = sorted(key for key in fingerprints if key > watermark)
+        if corrected:
+            logger.info("Re-applying corrected months: %s", corrected)
+        if added or corrected:
+            new_rows = (pd.concat(parts)
+                        .groupby(["state", "year", "month"])[METRICS].sum()
+                        .reset_index())
+            new_rows = new_rows[_period(new_rows).isin(added + corrected)
+                                .to_numpy()]
+            if len(self.state_month):
+                # Replacing the added months too makes a repeated update
+                # idempotent, for instance after an interrupted save
+                kept = ~_period(self.state_month).isin(added + corrected)
+                new_rows = pd.concat([self.state_month[kept.to_numpy()],
+                                      new_rows])
+            self.state_month = (new_rows
+                                .sort_values(["state", "year", "month"])
+                                .reset_index(drop=True))
+            self._roll_up()
+        self.fingerprints.update(fingerprints)
+        if fingerprints:
+            self.watermark = max(watermark, max(fingerprints))
+        self.source = source
+        logger.info("Added %s months, watermark %s", len(added),
+                    self.watermark)
+        self.save()
+        return {"added": added, "corrected": corrected}
+
+    def relative_values(self, url2: str = "./Data/us-state-populations.csv"
+                        ) -> pd.DataFrame:
+        """
+        Calculates the state-level output of `calculate_relative_values`
+        from the current state totals.
+
+        Args:
+            url2 (str, optional): The URL of the population CSV file.
+                Defaults to "./Data/us-state-populations.csv".
+
+        Returns:
+            pd.DataFrame: DataFrame with the relative values per state.
+        """
+        df = clean_states(self.state.copy())
+        return calculate_relative_values(merge_datasets(df, url2))
+
+    def save(self) -> None:
+        """
+        Saves the aggregates, the watermark and the fingerprints in the
+        directory of the instance. Every file is written to a temporary file
+        first and then replaced, the metadata last, so an interrupted save
+        never leaves a watermark ahead of the aggregates.
+
+        Returns:
+            None
+        """
+        os.makedirs(self.path, exist_ok=True)
+        meta = {"watermark": self.watermark,
+                "fingerprints": {str(k): str(v)
+                                 for k, v in self.fingerprints.items()},
+                "source": self.source}
+        for name, df in (("state_month.csv", self.state_month),
+                         ("state_year.csv", self.state_year),
+                         ("state.csv", self.state)):
+            self._replace(name, functools.partial(df.to_csv, index=False))
+        self._replace("meta.json", functools.partial(json.dump, meta))
+
+    def _replace(self, name: str, write: Callable) -> None:
+        """Writes a file of the directory through a temporary file."""
+        with tempfile.NamedTemporaryFile("w", dir=self.path, suffix=".tmp",
+                                         delete=False) as file:
+            try:
+                write(file)
+            except BaseException:
+                file.close()
+                os.remove(file.name)
+                raise
+        os.replace(file.name, os.path.join(self.path, name))
+
+    @staticmethod
+    def _aggregate(df: pd.DataFrame) -> pd.DataFrame:
+        """Sums the metrics of the given rows by state and month."""
+        df = df.astype(dict({"state": str, "year": "int64", "month": "int64"},
+                            **{metric: "int64" for metric in METRICS}))
+        return df.groupby(["state", "year", "month"])[METRICS].sum()
+
+    def _roll_up(self) -> None:
+        """Updates the state x year and state totals."""
+        self.state_year = (self.state_month
+                           .groupby(["state", "year"])[METRICS].sum()
+                           .reset_index())
+        self.state = (self.state_month.groupby("state")[METRICS].sum()
+                      .reset_index())
+
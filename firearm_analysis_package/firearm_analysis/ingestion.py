@@ -0,0 +1,135 @@
+# firearm_analysis/ingestion.py
+
+import glob
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Union
+
+import pandas as pd
+
+from .data_processing import COLUMNS_OF_INTEREST, read_compact, widen_counts
+
+logger = logging.getLogger(__name__)
+
+# Numeric columns summed by the aggregations
+METRICS = COLUMNS_OF_INTEREST[2:]
+
+
+def stream_groupby_state_and_year(url: str =
+                                  "./Data/nics-firearm-background-checks.csv",
+                                  chunksize: int = 100_000) -> pd.DataFrame:
+    """
+    Groups the NICS data by "state" and "year" reading the CSV file in chunks
+    of a bounded number of rows. Each chunk is folded into the running sums of
+    "permit", "handgun" and "long_gun", so the memory used depends on the
+    chunk size and the number of state-year pairs, not on the size of the
+    file. Compressed files (".gz", ".bz2", ...) are read directly.
+
+    The result is the same as `groupby_state_and_year` after
+    `erase_month(load_dataset(url))`, so it can be passed as it is to
+    `print_biggest_handguns` and `print_biggest_longguns`.
+
+    Args:
+        url (str, optional): Path of the CSV file. Defaults to
+            "./Data/nics-firearm-background-checks.csv".
+        chunksize (int, optional): Number of rows per chunk. Defaults to
+            100000.
+
+    Returns:
+        pd.DataFrame: DataFrame grouped by "state" and "year" with cumulative
+            values.
+    """
+    totals = None
+    n_chunks = 0
+    for chunk in read_compact(url, chunksize=chunksize):
+        partial = widen_counts(chunk).groupby(["state", "year"],
+                                              observed=True)[METRICS].sum()
+        # Categories differ between chunks, so align on plain strings
+        partial.index = partial.index.set_levels(
+            partial.index.levels[0].astype(str), level="state")
+        if totals is None:
+            totals = partial.astype("int64")
+        else:
+            totals = totals.add(partial, fill_value=0).astype("int64")
+        n_chunks += 1
+    logger.info("Folded %s chunks of up to %s rows", n_chunks, chunksize)
+    if totals is None:
+        return pd.DataFrame(columns=["state", "year"] + METRICS)
+    grouped_df = totals.sort_index().reset_index()
+    grouped_df["state"] = grouped_df["state"].astype("category")
+    grouped_df["year"] = grouped_df["year"].astype("int16")
+    return grouped_df
+
+
+def _expand_files(files: Union[str, Sequence[str]]) -> List[str]:
+    """
+    Expands a glob pattern, or a list of patterns and paths, into a sorted
+    list of files. A file matched by several patterns is only listed once,
+    in the position of its first match.
+
+    Args:
+        files (str or sequence of str): Glob pattern or list of them.
+
+    Returns:
+        list of str: Paths of the matching files.
+    """
+    if isinstance(files, str):
+        files = [files]
+    # Keyed by the normalized absolute path, so "./data/a.csv" and
+    # "data/a.csv" are the same file
+    paths = {}
+    for pattern in files:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise FileNotFoundError(f"No files match '{pattern}'")
+        for path in matches:
+            paths.setdefault(os.path.normpath(os.path.abspath(path)), path)
+    return list(paths.values())
+
+
+def parallel_groupby_state_and_year(files: Union[str, Sequence[str]],
+                                    max_workers: Optional[int] = None,
+                                    chunksize: int = 100_000,
+                                    files_per_task: int = 1) -> pd.DataFrame:
+    """
+    Groups the NICS data of several CSV files (for example, one per period or
+    per state) by "state" and "year". Each file is read and pre-aggregated
+    with `stream_groupby_state_and_year` in a pool of processes, and the
+    partial sums are merged into the same DataFrame that
+    `groupby_state_and_year` returns for the concatenation of the files.
+    The result does not depend on the order in which the tasks finish.
+
+    Args:
+        files (str or sequence of str): Glob pattern of the CSV files, or a
+            list of paths and patterns.
+        max_workers (int, optional): Number of processes. With 1, the files
+            are processed in the current process. Defaults to the number of
+            CPUs.
+        chunksize (int, optional): Number of rows per chunk read by each
+            process. Defaults to 100000.
+        files_per_task (int, optional): Number of files sent to a process at
+            once. Defaults to 1.
+
+    Returns:
+        pd.DataFrame: DataFrame grouped by "state" and "year" with cumulative
+            values.
+    """
+    paths = _expand_files(files)
+    chunksizes = [chunksize] * len(paths)
+    if max_workers == 1:
+        partials = list(map(stream_groupby_state_and_year, paths, chunksizes))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # map() returns the results in the order of the files
+            partials = list(executor.map(stream_groupby_state_and_year,
+                                         paths, chunksizes,
+                                         chunksize=files_per_task))
+    logger.info("Merging the partial sums of %s files", len(paths))
+    df = pd.concat(partials, ignore_index=True)
+    df["state"] = df["state"].astype(str)
+    grouped_df = (df.groupby(["state", "year"])[METRICS].sum().astype("int64")
+                  .reset_index())
+    grouped_df["state"] = grouped_df["state"].astype("category")
+    grouped_df["year"] = grouped_df["year"].astype("int16")
+    return grouped_df
@@ -1,22 +1,189 @@
 # firearm_analysis/map_generation.py
 
-import folium
+import atexit
+import functools
+import json
+import logging
+import os
+import tempfile
+from typing import TYPE_CHECKING
+
 import pandas as pd
-import selenium
-import io
-from PIL import Image
 
+from .profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+# folium and selenium are only imported when a map is rendered
+if TYPE_CHECKING:
+    import folium
+    from selenium import webdriver
+
+# Headless browser shared by all the renders of the process
+_DRIVER = None
+
+# JavaScript condition for a map that is completely drawn: the page is
+# loaded, the states are drawn and every tile finished (or failed) loading
+_MAP_READY = """
+return document.readyState === "complete"
+    && document.querySelectorAll("path.leaflet-interactive").length > 0
+    && Array.from(document.querySelectorAll("img.leaflet-tile"))
+        .every(function (tile) { return tile.complete; });
+"""
+
+
+@functools.lru_cache(maxsize=None)
+@profiled
+def load_geojson(path: str = "./Data/us-states.json") -> dict:
+    """
+    Reads and parses a GeoJSON file only once. Only the reads that miss the
+    cache are profiled.
+
+    Args:
+        path (str, optional): Path of the GeoJSON file. Defaults to
+            "./Data/us-states.json".
+
+    Returns:
+        dict: Parsed GeoJSON.
+    """
+    with open(path) as file:
+        return json.load(file)
+
+
+def _get_driver() -> "webdriver.Firefox":
+    """
+    Returns the shared headless Firefox session, starting it if needed.
+
+    Returns:
+        webdriver.Firefox: Browser session.
+    """
+    from selenium import webdriver
+
+    global _DRIVER
+    if _DRIVER is None:
+        options = webdriver.firefox.options.Options()
+        options.add_argument("--headless")
+        _DRIVER = webdriver.Firefox(options=options)
+        _DRIVER.fullscreen_window()
+    return _DRIVER
+
+
+@atexit.register
+def close_browser() -> None:
+    """
+    Closes the shared browser session, if any. It is called automatically
+    when the interpreter exits.
+
+    Returns:
+        None
+    """
+    global _DRIVER
+    if _DRIVER is not None:
+        from selenium.common.exceptions import WebDriverException
+
+        try:
+            _DRIVER.quit()
+        except WebDriverException:
+            pass
+        _DRIVER = None
+
+
+@profiled
+def render_png(m: "folium.Map", timeout: float = 30) -> bytes:
+    """
+    Renders a folium map to a PNG image with the shared browser session. The
+    image is taken as soon as the map is drawn instead of after a fixed
+    delay.
+
+    Args:
+        m (folium.Map): Map to render.
+        timeout (float, optional): Maximum number of seconds to wait for the
+            map to be drawn. Defaults to 30.
+
+    Returns:
+        bytes: PNG image of the map.
+    """
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    driver = _get_driver()
+    html = m.get_root().render()
+    # The page is loaded from a file to avoid JavaScript security issues
+    with tempfile.NamedTemporaryFile("w", suffix=".html",
+                                     delete=False) as file:
+        file.write(html)
+    try:
+        driver.get(f"file://{file.name}")
+        try:
+            WebDriverWait(driver, timeout).until(
+                lambda d: d.execute_script(_MAP_READY))
+        except TimeoutException:
+            raise TimeoutError(f"The map was not drawn in {timeout} seconds")
+        return driver.find_element("class name",
+                                   "folium-map").screenshot_as_png
+    finally:
+        os.remove(file.name)
+
+
+@profiled
+def create_maps(df: pd.DataFrame,
+                geo_data: str = "./Data/us-states.json",
+                output_dir: str = ".", timeout: float = 30,
+                backend: str = "folium", fmt: str = "png",
+                fallback: bool = True) -> None:
+    """
+    Creates a choropleth map of the United States for each of the columns
+    "permit_perc", "handgun_perc" and "longgun_perc" and saves them as
+    images named after the columns. The GeoJSON of the states is read from
+    the local file only once.
+
+    With the "folium" backend, the maps are rendered with the same headless
+    browser session. The page loads Leaflet and the map tiles from their
+    CDNs, so this backend needs the network. With the "matplotlib" backend,
+    the projected polygons are rasterized directly (see
+    `render_choropleth`), with the same colors and legend and without any
+    browser or network.
+
+    Args:
+        df (pd.DataFrame): DataFrame with the column "code" (state code) and
+            the columns to map.
+        geo_data (str, optional): Path of the GeoJSON file of the states.
+            Defaults to "./Data/us-states.json".
+        output_dir (str, optional): Directory of the images. Defaults to the
+            current directory.
+        timeout (float, optional): Maximum number of seconds to wait for each
+            map to be drawn by the browser. Defaults to 30.
+        backend (str, optional): "folium" or "matplotlib". Defaults to
+            "folium".
+        fmt (str, optional): Format of the images of the "matplotlib"
+            backend ("png", "svg", ...). The "folium" backend only creates
+            PNG images. Defaults to "png".
+        fallback (bool, optional): When the browser cannot be started or a
+            map is not drawn in time (for instance without network), the
+            rest of the maps are created with the "matplotlib" backend, as
+            PNG images. Defaults to True.
 
-def create_maps(df):
+    Returns:
+        None
+    """
+    if backend not in ("folium", "matplotlib"):
+        raise ValueError(f"Unknown backend: {backend}")
+    from .raster_maps import render_choropleth
+    if backend == "folium":
+        import folium
+        from selenium.common.exceptions import WebDriverException
     for column in ["permit_perc", "handgun_perc", "longgun_perc"]:
-        # GeoJSON URL
-        state_geo = "https://raw.githubusercontent.com/python-visualization/"
-        state_geo += "folium/main/examples/data/us-states.json"
+        legend_name = f"{' '.join(column.split('_'))}entage (%)"
+        if backend == "matplotlib":
+            render_choropleth(df, column,
+                              os.path.join(output_dir, f"{column}.{fmt}"),
+                              geo_data=geo_data, legend_name=legend_name)
+            continue
         # Initialize the map
         m = folium.Map(location=[40, -95], zoom_start=4)
         # Create Choropleth map
         folium.Choropleth(
-            geo_data=state_geo,
+            geo_data=load_geojson(geo_data),
             name="choropleth",
             data=df,
             columns=["code", column],
@@ -24,11 +191,24 @@ def create_maps(df):
             fill_color="YlGn",
             fill_opacity=0.7,
             line_opacity=0.1,
-            legend_name=f"{' '.join(column.split('_'))}entage (%)",
+            legend_name=legend_name,
         ).add_to(m)
         # Add layer control
         folium.LayerControl().add_to(m)
-        # Save map as an image
-        img_data = m._to_png(5)
-        img = Image.open(io.BytesIO(img_data))
-        img.save(f"{column}.png")
+        # Save map as an image, only once it is rendered, so a failed render
+        # does not leave a truncated file behind
+        path = os.path.join(output_dir, f"{column}.png")
+        try:
+            png = render_png(m, timeout)
+        except (TimeoutError, WebDriverException) as err:
+            if not fallback:
+                raise
+            logger.warning("The folium maps could not be rendered (%s), "
+                           "falling back to the matplotlib backend", err)
+            backend, fmt = "matplotlib", "png"
+            render_choropleth(df, column, path, geo_data=geo_data,
+                              legend_name=legend_name)
+            continue
+        with open(path + ".tmp", "wb") as file:
+            file.write(png)
+        os.replace(path + ".tmp", path)
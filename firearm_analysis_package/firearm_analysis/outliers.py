@@ -0,0 +1,170 @@
+# firearm_analysis/outliers.py
+
+import logging
+import warnings
+from typing import Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Default threshold of each method: number of scaled MADs from the median,
+# or number of IQRs beyond the quartiles
+THRESHOLDS = {"mad": 3.5, "iqr": 1.5}
+
+# Treatments of the outliers: keep them, clip them to the bounds or replace
+# them with the median
+TREATMENTS = ("flag", "clip", "median")
+
+# Scale that makes the MAD a consistent estimator of the standard deviation
+MAD_SCALE = 1.4826
+
+
+def robust_bounds(values: np.ndarray, axis: int = 0, method: str = "mad",
+                  threshold: Optional[float] = None
+                  ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Calculates the median and the bounds of the normal values along an axis,
+    with statistics that are not moved by the outliers themselves. NaN
+    values (missing data) are ignored.
+
+    Args:
+        values (np.ndarray): Values to analyze.
+        axis (int, optional): Axis along which the values are compared, for
+            instance the axis of the states. Defaults to 0.
+        method (str, optional): "mad" (median absolute deviation) or "iqr"
+            (interquartile range). Defaults to "mad".
+        threshold (float, optional): Width of the bounds, in scaled MADs from
+            the median or in IQRs beyond the quartiles. Defaults to 3.5 for
+            "mad" and 1.5 for "iqr".
+
+    Returns:
+        tuple: Median, lower bound and upper bound, with the axis kept with
+            size 1 so they broadcast against `values`.
+    """
+    if method not in THRESHOLDS:
+        raise ValueError(f"Unknown method: {method}")
+    if threshold is None:
+        threshold = THRESHOLDS[method]
+    values = np.asarray(values, dtype=np.float64)
+    with warnings.catch_warnings():
+        # Slices without any data just get NaN bounds
+        warnings.simplefilter("ignore", RuntimeWarning)
+        center = np.nanmedian(values, axis=axis, keepdims=True)
+        if method == "mad":
+            spread = MAD_SCALE * np.nanmedian(np.abs(values - center),
+                                              axis=axis, keepdims=True)
+            return (center, center - threshold * spread,
+                    center + threshold * spread)
+        q1, q3 = np.nanpercentile(values, [25, 75], axis=axis, keepdims=True)
+    return center, q1 - threshold * (q3 - q1), q3 + threshold * (q3 - q1)
+
+
+def detect_outliers(values: np.ndarray, axis: int = 0, method: str = "mad",
+                    threshold: Optional[float] = None,
+                    treatment: str = "flag"
+                    ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds and treats the outliers of every slice of an array at once, for
+    instance of every year and metric of the state x year array of an
+    `AggregationCube` (see `AggregationCube.to_array`) along the axis of the
+    states.
+
+    Args:
+        values (np.ndarray): Values to analyze. NaN values are missing data.
+        axis (int, optional): Axis along which the values are compared.
+            Defaults to 0.
+        method (str, optional): "mad" or "iqr" (see `robust_bounds`).
+            Defaults to "mad".
+        threshold (float, optional): Width of the bounds (see
+            `robust_bounds`). Defaults to the one of the method.
+        treatment (str, optional): "flag" keeps the values, "clip" moves the
+            outliers to the nearest bound and "median" replaces them with
+            the median of their slice. Defaults to "flag".
+
+    Returns:
+        tuple: Treated values (float) and boolean mask of the outliers.
+    """
+    if treatment not in TREATMENTS:
+        raise ValueError(f"Unknown treatment: {treatment}")
+    values = np.asarray(values, dtype=np.float64)
+    center, low, high = robust_bounds(values, axis, method, threshold)
+    mask = (values < low) | (values > high)
+    if treatment == "clip":
+        values = np.where(mask, np.clip(values, low, high), values)
+    elif treatment == "median":
+        values = np.where(mask, center, values)
+    return values, mask
+
+
+def find_outliers(df: pd.DataFrame,
+                  columns: Sequence[str] = ("permit_perc", "handgun_perc",
+                                            "longgun_perc"),
+                  by: Optional[Union[str, Sequence[str]]] = None,
+                  method: str = "mad", threshold: Optional[float] = None,
+                  treatment: str = "flag"
+                  ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Finds and treats the outliers of several columns of a DataFrame, such
+    as the output of `calculate_relative_values`. Every column is compared
+    across all the rows, or across the rows of each group (for instance the
+    states of each year of a state x year DataFrame). The groups are laid
+    out in a dense array, so all of them are analyzed in one pass.
+
+    Args:
+        df (pd.DataFrame): The input DataFrame.
+        columns (sequence of str, optional): Columns to analyze. Defaults to
+            "permit_perc", "handgun_perc" and "longgun_perc".
+        by (str or sequence of str, optional): Columns of the groups.
+            Defaults to None, which compares all the rows. The rows with a
+            missing group key are neither treated nor flagged.
+        method (str, optional): "mad" or "iqr" (see `robust_bounds`).
+            Defaults to "mad".
+        threshold (float, optional): Width of the bounds (see
+            `robust_bounds`). Defaults to the one of the method.
+        treatment (str, optional): "flag", "clip" or "median" (see
+            `detect_outliers`). Defaults to "flag".
+
+    Returns:
+        tuple: Copy of the DataFrame with the treated columns and boolean
+            DataFrame with the outliers of each column.
+    """
+    columns = list(columns)
+    values = df[columns].to_numpy(dtype=np.float64)
+    if by is None or not len(df):
+        treated, mask = detect_outliers(values, 0, method, threshold,
+                                        treatment)
+    else:
+        groups = df.groupby(by, sort=False, observed=True)
+        group = groups.ngroup().to_numpy(dtype=np.float64)
+        # Rows with a missing key (group -1 or NaN, depending on the pandas
+        # version) are left untreated and unflagged
+        kept = group >= 0
+        treated = values.copy()
+        mask = np.zeros(values.shape, dtype=bool)
+        if kept.any():
+            group = group[kept].astype(np.int64)
+            member = groups.cumcount().to_numpy()[kept].astype(np.int64)
+            # Shape (groups, rows of the biggest group, columns), NaN padded
+            dense = np.full((group.max() + 1, member.max() + 1,
+                             len(columns)), np.nan)
+            dense[group, member] = values[kept]
+            dense, dense_mask = detect_outliers(dense, 1, method, threshold,
+                                                treatment)
+            treated[kept] = dense[group, member]
+            mask[kept] = dense_mask[group, member]
+    mask = pd.DataFrame(mask, index=df.index, columns=columns)
+    df = df.copy()
+    if treatment != "flag":
+        df[columns] = treated
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Outliers per column (%s):\n%s", method,
+                    mask.sum().to_string())
+        for column in columns:
+            rows = df[mask[column]]
+            if len(rows):
+                labels = rows["state"] if "state" in rows else rows.index
+                logger.info("Outliers of %s (%s): %s", column, treatment,
+                            ", ".join(map(str, labels)))
+    return df, mask
@@ -0,0 +1,186 @@
+# firearm_analysis/pipeline.py
+
+import logging
+from typing import Dict, List, Tuple, Union
+
+import pandas as pd
+
+from . import data_processing
+from .data_processing import COLUMNS_OF_INTEREST, load_dataset, read_compact
+
+logger = logging.getLogger(__name__)
+
+# Row-wise steps that can be fused into the compact reader
+TRANSFORMS = ["rename_col", "clean_csv", "breakdown_date", "erase_month"]
+
+# Aggregations that can be computed from a single state x year scan
+AGGREGATIONS = {
+    "groupby_state_and_year": ["state", "year"],
+    "groupby_state": ["state"],
+    "groupby_year": ["year"],
+}
+
+# Numeric columns summed by the aggregations
+METRICS = COLUMNS_OF_INTEREST[2:]
+
+
+class Pipeline:
+    """
+    Lazy version of the workflow of `main()`. Each method records a step
+    named after the eager function it replaces and returns the pipeline, so
+    the steps can be chained. Nothing is read until `collect()` is called,
+    and before that the plan is optimized:
+
+    - The column projection, the renaming of "longgun" and the split of the
+      "month" column are fused into the compact reader (`read_compact`).
+      The aggregations always read through it, so they get the "year"
+      column even when `breakdown_date` is not in the plan.
+    - All the requested aggregations (by state and year, by state and by
+      year) are computed from a single scan of the data: the state x year
+      sums are calculated once and the other ones are rolled up from them.
+
+    Row-wise steps that cannot be fused fall back to the eager functions of
+    `data_processing`. The eager functions stay independent of the pipeline,
+    which is built on top of them: the scan is `read_compact` and the state x
+    year sums are the ones of `groupby_state_and_year`.
+
+    Args:
+        data (str or pd.DataFrame, optional): Path of the CSV file or the
+            DataFrame returned by `load_dataset`. Defaults to
+            "./Data/nics-firearm-background-checks.csv".
+    """
+
+    def __init__(self, data: Union[str, pd.DataFrame] =
+                 "./Data/nics-firearm-background-checks.csv"):
+        self.data = data
+        self.steps = []
+
+    def _add(self, step: str) -> "Pipeline":
+        """Records a step and returns the pipeline."""
+        self.steps.append(step)
+        return self
+
+    def rename_col(self) -> "Pipeline":
+        """Records the `rename_col` step."""
+        return self._add("rename_col")
+
+    def clean_csv(self) -> "Pipeline":
+        """Records the `clean_csv` step."""
+        return self._add("clean_csv")
+
+    def breakdown_date(self) -> "Pipeline":
+        """Records the `breakdown_date` step."""
+        return self._add("breakdown_date")
+
+    def erase_month(self) -> "Pipeline":
+        """Records the `erase_month` step."""
+        return self._add("erase_month")
+
+    def groupby_state_and_year(self) -> "Pipeline":
+        """Records the `groupby_state_and_year` step."""
+        return self._add("groupby_state_and_year")
+
+    def groupby_state(self) -> "Pipeline":
+        """Records the `groupby_state` step."""
+        return self._add("groupby_state")
+
+    def groupby_year(self) -> "Pipeline":
+        """Records the `groupby_year` step."""
+        return self._add("groupby_year")
+
+    def optimize(self) -> List[Tuple[str, tuple]]:
+        """
+        Translates the recorded steps into the physical plan that
+        `collect()` executes.
+
+        Returns:
+            list of tuple: Operations of the plan as (name, arguments).
+        """
+        transforms = [s for s in self.steps if s in TRANSFORMS]
+        aggregations = [s for s in self.steps if s in AGGREGATIONS]
+        if self.steps != transforms + aggregations:
+            raise ValueError("The aggregations must be the last steps of "
+                             "the pipeline")
+        # The aggregations only need the state, the year and the metrics,
+        # whatever the row-wise steps before them
+        if aggregations or {"clean_csv", "breakdown_date"} <= set(transforms):
+            columns = ["year", "state"] + METRICS
+            if not aggregations and "erase_month" not in transforms:
+                columns.insert(1, "month")
+            plan = [("scan_compact", tuple(columns))]
+        else:
+            plan = [("read", ())] + [(s, ()) for s in transforms]
+        if aggregations:
+            plan.append(("aggregate", tuple(aggregations)))
+        return plan
+
+    def explain(self) -> str:
+        """
+        Describes the optimized plan.
+
+        Returns:
+            str: One line per operation of the plan.
+        """
+        return "\n".join(f"{name}{list(args) if args else ''}"
+                         for name, args in self.optimize())
+
+    def collect(self) -> Union[pd.DataFrame, Dict[str, pd.DataFrame]]:
+        """
+        Executes the optimized plan.
+
+        Returns:
+            pd.DataFrame or dict: Result of the last step, or a dictionary
+                with the result of each aggregation (keyed by the name of the
+                step) when several aggregations were requested.
+        """
+        plan = self.optimize()
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("\nExecuting the plan:\n%s", self.explain())
+        df = None
+        for name, args in plan:
+            if name == "read":
+                if isinstance(self.data, pd.DataFrame):
+                    df = self.data
+                else:
+                    df = data_processing.read_nics(self.data, columns=None)
+            elif name == "scan_compact":
+                if isinstance(self.data, pd.DataFrame):
+                    df = load_dataset(self.data)
+                else:
+                    df = read_compact(self.data)
+                df = df[list(args)]
+            elif name == "aggregate":
+                df = _aggregate(df, args)
+            else:
+                df = getattr(data_processing, name)(df)
+        return df
+
+
+def _aggregate(df: pd.DataFrame, aggregations: Tuple[str, ...]
+               ) -> Union[pd.DataFrame, Dict[str, pd.DataFrame]]:
+    """
+    Calculates the requested aggregations from a single scan of the data.
+
+    Args:
+        df (pd.DataFrame): DataFrame with the columns "year", "state",
+            "permit", "handgun" and "long_gun".
+        aggregations (tuple of str): Names of the aggregation steps.
+
+    Returns:
+        pd.DataFrame or dict: Aggregated DataFrame, or a dictionary of them
+            when several aggregations are requested.
+    """
+    # The scan is the eager aggregation, so both always give the same sums
+    base = data_processing.groupby_state_and_year(
+        df[["state", "year"] + METRICS])
+    results = {}
+    for name in aggregations:
+        keys = AGGREGATIONS[name]
+        if len(keys) == 2:
+            results[name] = base
+        else:
+            results[name] = base.groupby(keys[0], observed=True)[
+                METRICS].sum().reset_index()
+    if len(results) == 1:
+        return results[aggregations[0]]
+    return results
@@ -0,0 +1,199 @@
+# firearm_analysis/population.py
+
+import os
+import re
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .data_processing import COLUMNS_OF_INTEREST
+
+# Population tables already parsed, keyed by (path, mtime_ns, size)
+_POPULATION_CACHE = {}
+
+
+def rate_column(metric: str) -> str:
+    """
+    Returns the name of the column with the relative values of a metric
+    ("permit_perc", "handgun_perc", "longgun_perc", ...).
+
+    Args:
+        metric (str): Name of the metric.
+
+    Returns:
+        str: Name of the column of its relative values.
+    """
+    return f"{metric.replace('_', '')}_perc"
+
+
+class PopulationTable:
+    """
+    Population of every state and year as a dense NumPy array, so the
+    population of many state-year pairs is looked up with integer indexing
+    instead of merging strings.
+
+    The years between the first and the last column of the CSV file without
+    an estimate take the latest previous one. Years before or after the
+    table take the first or the last estimate.
+
+    Args:
+        frame (pd.DataFrame): Population CSV file, with the columns "code",
+            "state" and a "pop_<year>" column per year.
+    """
+
+    def __init__(self, frame: pd.DataFrame):
+        self.frame = frame
+        self.codes = frame["code"].tolist()
+        self.states = frame["state"].tolist()
+        self._index = {"state": pd.Index(self.states),
+                       "code": pd.Index(self.codes)}
+        columns = {}
+        for column in frame.columns:
+            match = re.fullmatch(r"pop_(\d{4})", column)
+            if match:
+                columns[int(match.group(1))] = column
+        if not columns:
+            raise ValueError("The population table has no 'pop_<year>' "
+                             "column")
+        self.first_year = min(columns)
+        self.years = list(range(self.first_year, max(columns) + 1))
+        wide = (frame[list(columns.values())]
+                .set_axis(list(columns), axis=1)
+                .reindex(columns=self.years).ffill(axis=1))
+        # Shape (states, years)
+        self.values = wide.to_numpy(dtype=np.float64)
+
+    def ids(self, labels: Sequence[str], key: str = "state") -> np.ndarray:
+        """
+        Returns the integer identifier (row of `values`) of every state.
+
+        Args:
+            labels (sequence of str): Names (or codes) of the states.
+            key (str, optional): "state" for names or "code" for codes.
+                Defaults to "state".
+
+        Returns:
+            np.ndarray: Identifiers, -1 for the unknown states.
+        """
+        index = self._index[key]
+        labels = pd.Series(labels)
+        if isinstance(labels.dtype, pd.CategoricalDtype):
+            # Only look up each category once
+            ids = index.get_indexer(labels.cat.categories)
+            codes = labels.cat.codes.to_numpy()
+            return np.where(codes >= 0, ids[codes], -1).astype(np.int64)
+        return index.get_indexer(labels).astype(np.int64)
+
+    def population(self, ids: np.ndarray, years: np.ndarray) -> np.ndarray:
+        """
+        Returns the population of the given state-year pairs.
+
+        Args:
+            ids (np.ndarray): Identifiers of the states (see `ids`). They
+                must be valid.
+            years (np.ndarray): Years of the pairs.
+
+        Returns:
+            np.ndarray: Population of each pair.
+        """
+        positions = np.clip(np.asarray(years, dtype=np.int64)
+                            - self.first_year, 0, len(self.years) - 1)
+        return self.values[ids, positions]
+
+
+def load_population(url2: str = "./Data/us-state-populations.csv"
+                    ) -> PopulationTable:
+    """
+    Parses the population CSV file only once. The table is cached by file
+    path, modification time and size.
+
+    Args:
+        url2 (str, optional): The URL of the population CSV file. Defaults to
+            "./Data/us-state-populations.csv".
+
+    Returns:
+        PopulationTable: Population of every state and year.
+    """
+    path = os.path.abspath(url2)
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if key not in _POPULATION_CACHE:
+        table = PopulationTable(pd.read_csv(path))
+        # Drop the entries of older versions of the same file
+        for old_key in [k for k in _POPULATION_CACHE if k[0] == path]:
+            del _POPULATION_CACHE[old_key]
+        _POPULATION_CACHE[key] = table
+    return _POPULATION_CACHE[key]
+
+
+def rates(counts: np.ndarray, population: np.ndarray,
+          per: float = 100.0) -> np.ndarray:
+    """
+    Calculates the relative values of every metric with a single NumPy
+    operation.
+
+    Args:
+        counts (np.ndarray): Counts with shape (rows, metrics).
+        population (np.ndarray): Population of each row.
+        per (float, optional): Scale of the values, 100 for percentages.
+            Defaults to 100.
+
+    Returns:
+        np.ndarray: Relative values with the shape of `counts`.
+    """
+    return (np.asarray(counts, dtype=np.float64)
+            * (per / np.asarray(population, dtype=np.float64))[:, None])
+
+
+def per_capita(df: pd.DataFrame,
+               url2: str = "./Data/us-state-populations.csv",
+               metrics: Sequence[str] = COLUMNS_OF_INTEREST[2:],
+               year: Optional[int] = None, per: float = 100.0,
+               decimals: Optional[int] = None) -> pd.DataFrame:
+    """
+    Calculates the metrics of every row as percentages of the population of
+    its state in its year. Works on the output of `groupby_state_and_year`
+    (the rates of every state-year at once) and of `groupby_state`.
+
+    The states are joined to the cached population table (see
+    `load_population`) by integer identifiers. The rows of states without
+    population (the territories) are left out, as `merge_datasets` does.
+
+    Args:
+        df (pd.DataFrame): DataFrame with the columns "state", the metrics
+            and, optionally, "year".
+        url2 (str, optional): The URL of the population CSV file. Defaults to
+            "./Data/us-state-populations.csv".
+        metrics (sequence of str, optional): Columns to divide. Defaults to
+            "permit", "handgun" and "long_gun".
+        year (int, optional): Year of the population used for the rows of a
+            DataFrame without a "year" column. Defaults to the last year of
+            the table.
+        per (float, optional): Scale of the values, 100 for percentages.
+            Defaults to 100.
+        decimals (int, optional): Rounds the values for presentation.
+            Defaults to None, which keeps the full precision.
+
+    Returns:
+        pd.DataFrame: The rows with known states, with the additional
+            columns "code", "population" and a "<metric>_perc" column per
+            metric (for instance "longgun_perc").
+    """
+    table = load_population(url2)
+    ids = table.ids(df["state"])
+    keep = ids >= 0
+    ids = ids[keep]
+    df = df[keep].reset_index(drop=True)
+    if "year" in df.columns:
+        years = df["year"].to_numpy(dtype=np.int64)
+    else:
+        years = np.full(len(df), table.years[-1] if year is None else year)
+    population = table.population(ids, years)
+    values = rates(df[list(metrics)].to_numpy(), population, per)
+    if decimals is not None:
+        values = values.round(decimals)
+    df = df.assign(code=np.asarray(table.codes, dtype=object)[ids],
+                   population=population)
+    df[[rate_column(metric) for metric in metrics]] = values
+    return df
@@ -0,0 +1,291 @@
+# firearm_analysis/profiling.py
+
+import atexit
+import contextlib
+import cProfile
+import functools
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Iterator, List, Optional
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Environment variables that profile the whole process: path of the JSON
+# summary written at exit, and directory of the cProfile dumps of the stages
+PROFILE_ENV = "FIREARM_ANALYSIS_PROFILE"
+PROFILE_DIR_ENV = "FIREARM_ANALYSIS_PROFILE_DIR"
+
+# Profiler of the running stages, None when profiling is off
+_ACTIVE = None
+
+
+def _peak_rss() -> Optional[int]:
+    """Highest resident memory of the process so far, in bytes."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB and macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _rows(value) -> Optional[int]:
+    """Number of rows of a DataFrame or Series, None for anything else."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    return None
+
+
+def _record(stats: dict, seconds: float, rows_in: Optional[int],
+            rows_out: Optional[int], allocated: Optional[int],
+            retained: Optional[int]) -> None:
+    """Adds the measures of a call to the ones of its stage."""
+    stats["calls"] += 1
+    stats["seconds"] += seconds
+    stats["max_seconds"] = max(stats["max_seconds"], seconds)
+    for key, value in (("rows_in", rows_in), ("rows_out", rows_out),
+                       ("retained_bytes", retained)):
+        if value is not None:
+            stats[key] = (stats[key] or 0) + value
+    if allocated is not None:
+        stats["allocated_bytes"] = max(stats["allocated_bytes"] or 0,
+                                       allocated)
+    stats["peak_rss_bytes"] = _peak_rss()
+
+
+class Profiler:
+    """
+    Collects the wall time, the rows in and out, the allocated memory and the
+    peak resident memory of every call of the profiled functions (see
+    `profiled`), grouped by stage. A stage is a function, named after its
+    module and itself, such as "data_processing.read_csv". The times of the
+    stages called by other stages are included in the times of their
+    callers.
+
+    Args:
+        memory (bool, optional): Traces the allocations with `tracemalloc`,
+            which slows down the calls. Defaults to True.
+        cprofile_dir (str, optional): Directory of a cProfile dump per stage
+            ("<stage>.prof"), which `pstats` reads. Only the outermost stages
+            are profiled, their dumps include the stages they call. Defaults
+            to None (no dumps).
+    """
+
+    def __init__(self, memory: bool = True,
+                 cprofile_dir: Optional[str] = None):
+        self.memory = memory
+        self.cprofile_dir = cprofile_dir
+        self.stages = {}
+        self._profiles = {}
+        self._stack: List[dict] = []
+        self._started = None
+        self._stopped = None
+        self._tracing = False
+
+    def start(self) -> None:
+        """Starts the clock and the tracing of the allocations."""
+        self._started = time.perf_counter()
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+
+    def stop(self) -> None:
+        """Stops the clock and the tracing of the allocations."""
+        self._stopped = time.perf_counter()
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def call(self, stage: str, func: Callable, args: tuple, kwargs: dict):
+        """
+        Calls a function and records the measures of its call.
+
+        Args:
+            stage (str): Name of the stage.
+            func (callable): Function of the stage.
+            args (tuple): Positional arguments.
+            kwargs (dict): Keyword arguments.
+
+        Returns:
+            Result of the function.
+        """
+        # Stages are listed in the order of their first call
+        stats = self.stages.setdefault(stage, {
+            "calls": 0, "seconds": 0.0, "max_seconds": 0.0, "rows_in": None,
+            "rows_out": None, "allocated_bytes": None,
+            "retained_bytes": None, "peak_rss_bytes": None,
+        })
+        tracing = tracemalloc.is_tracing()
+        frame = {"peak": 0, "memory": 0}
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            # The peak of the caller is kept before it is reset for this call
+            if self._stack:
+                parent = self._stack[-1]
+                parent["peak"] = max(parent["peak"], peak)
+            tracemalloc.reset_peak()
+            frame["memory"] = current
+        profile = None
+        if self.cprofile_dir is not None and not self._stack:
+            profile = self._profiles.setdefault(stage, cProfile.Profile())
+        self._stack.append(frame)
+        start = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            if profile is not None:
+                profile.disable()
+            seconds = time.perf_counter() - start
+            self._stack.pop()
+            allocated = retained = None
+            if tracing and tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                peak = max(frame["peak"], peak)
+                allocated = peak - frame["memory"]
+                retained = current - frame["memory"]
+                if self._stack:
+                    parent = self._stack[-1]
+                    parent["peak"] = max(parent["peak"], peak)
+        rows_in = next((rows for rows in map(_rows, (*args, *kwargs.values()))
+                        if rows is not None), None)
+        _record(stats, seconds, rows_in, _rows(result), allocated, retained)
+        return result
+
+    def summary(self) -> dict:
+        """
+        Returns the measures of the stages.
+
+        Returns:
+            dict: "seconds" (wall time of the profiling), "peak_rss_bytes"
+                (of the process) and "stages", with the measures of every
+                stage in the order of their first call: "calls", "seconds"
+                (total), "max_seconds", "rows_in" and "rows_out" (totals of
+                the DataFrames given and returned), "allocated_bytes"
+                (highest memory allocated by a call), "retained_bytes"
+                (memory still allocated after the calls) and
+                "peak_rss_bytes" (of the process after the last call).
+                Measures that do not apply are None, and "calls" only
+                counts the calls that returned.
+        """
+        end = self._stopped or time.perf_counter()
+        return {
+            "seconds": end - self._started if self._started else 0.0,
+            "peak_rss_bytes": _peak_rss(),
+            "stages": {stage: dict(stats)
+                       for stage, stats in self.stages.items()},
+        }
+
+    def write(self, path: str) -> dict:
+        """
+        Writes the summary to a JSON file and the cProfile dumps of the
+        stages, if any.
+
+        Args:
+            path (str): Path of the JSON file.
+
+        Returns:
+            dict: Summary (see `summary`).
+        """
+        summary = self.summary()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as file:
+            json.dump(summary, file, indent=1)
+        if self.cprofile_dir is not None:
+            os.makedirs(self.cprofile_dir, exist_ok=True)
+            for stage, profile in self._profiles.items():
+                profile.dump_stats(os.path.join(self.cprofile_dir,
+                                                f"{stage}.prof"))
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("\nProfile of the stages:\n%s",
+                        pd.DataFrame(summary["stages"]).T.to_string())
+        return summary
+
+
+def profiled(func: Callable) -> Callable:
+    """
+    Reports the calls of a function to the active profiler, if any. When
+    profiling is off the call only costs a check of a global variable.
+
+    Args:
+        func (callable): Function of a stage.
+
+    Returns:
+        callable: Function with the same name, docstring and signature.
+    """
+    stage = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _ACTIVE is None:
+            return func(*args, **kwargs)
+        return _ACTIVE.call(stage, func, args, kwargs)
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def profile_stages(output: Optional[str] = None, memory: bool = True,
+                   cprofile_dir: Optional[str] = None
+                   ) -> Iterator[Profiler]:
+    """
+    Profiles the stages called inside a `with` block:
+
+        with profile_stages("profile.json") as profiler:
+            main()
+
+    Args:
+        output (str, optional): Path of the JSON summary written at the end
+            of the block (see `Profiler.summary`). Defaults to None (no
+            file).
+        memory (bool, optional): Traces the allocations. Defaults to True.
+        cprofile_dir (str, optional): Directory of the cProfile dumps of the
+            stages. Defaults to None (no dumps).
+
+    Yields:
+        Profiler: Profiler of the block.
+    """
+    global _ACTIVE
+    previous = _ACTIVE
+    profiler = Profiler(memory, cprofile_dir)
+    profiler.start()
+    _ACTIVE = profiler
+    try:
+        yield profiler
+    finally:
+        _ACTIVE = previous
+        profiler.stop()
+        if output is not None:
+            profiler.write(output)
+
+
+def _profile_process() -> None:
+    """Profiles the whole process when `PROFILE_ENV` is set."""
+    global _ACTIVE
+    output = os.environ.get(PROFILE_ENV)
+    if not output:
+        return
+    profiler = Profiler(cprofile_dir=os.environ.get(PROFILE_DIR_ENV) or None)
+    profiler.start()
+    _ACTIVE = profiler
+
+    def finish():
+        profiler.stop()
+        profiler.write(output)
+
+    atexit.register(finish)
+
+
+_profile_process()
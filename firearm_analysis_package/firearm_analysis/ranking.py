@@ -0,0 +1,187 @@
+# firearm_analysis/ranking.py
+
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from .cube import AggregationCube
+from .data_processing import COLUMNS_OF_INTEREST
+from .population import load_population, rate_column
+
+
+def top_k(values: np.ndarray, k: int, axis: int = 0,
+          largest: bool = True) -> np.ndarray:
+    """
+    Returns the positions of the k largest (or smallest) values along an
+    axis, in order, with a partial selection (`np.argpartition`) instead of
+    a full sort. All the other axes (for instance the metrics) are served by
+    the same call. NaN values are never selected before a real value.
+
+    Args:
+        values (np.ndarray): Values to rank.
+        k (int): Number of positions. It is limited to the size of the axis.
+        axis (int, optional): Axis to rank along. Defaults to 0.
+        largest (bool, optional): Selects the largest values instead of the
+            smallest ones. Defaults to True.
+
+    Returns:
+        np.ndarray: Positions along the axis, with the shape of `values`
+            except for `k` positions along the axis.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    # Rank the opposite values to select the largest ones, NaN go last
+    keys = np.where(np.isnan(values), np.inf, -values if largest else values)
+    k = min(k, keys.shape[axis])
+    if k == 0:
+        return np.take(np.argsort(keys, axis=axis), [], axis=axis)
+    part = np.argpartition(keys, k - 1, axis=axis)
+    part = np.take(part, np.arange(k), axis=axis)
+    order = np.argsort(np.take_along_axis(keys, part, axis=axis), axis=axis,
+                       kind="stable")
+    return np.take_along_axis(part, order, axis=axis)
+
+
+class Ranking:
+    """
+    Rankings of the state-year sums of the NICS metrics and of their values
+    per capita. The order of the states in every year, and of all the
+    state-year pairs, is computed once for every metric, so each top-k query
+    only slices the precomputed orders.
+
+    Args:
+        states (sequence of str): Names of the states (first axis).
+        years (sequence of int): Consecutive years (second axis).
+        values (np.ndarray): Values with shape (states, years, metrics), NaN
+            for the pairs without data.
+        metrics (sequence of str): Names of the metrics (last axis).
+    """
+
+    def __init__(self, states: Sequence[str], years: Sequence[int],
+                 values: np.ndarray, metrics: Sequence[str]):
+        self.states = np.asarray(list(states), dtype=object)
+        self.years = np.asarray(list(years), dtype=np.int64)
+        self.metrics = list(metrics)
+        self.values = np.asarray(values, dtype=np.float64)
+        self._metric_ids = {metric: i for i, metric in enumerate(metrics)}
+        n_states, n_years, n_metrics = self.values.shape
+        flat = self.values.reshape(n_states * n_years, n_metrics)
+        # Orders of the states of each year and of all the pairs, for every
+        # metric at once, keyed by `largest`
+        self._year_order = {}
+        self._pair_order = {}
+        for largest in (True, False):
+            self._year_order[largest] = top_k(self.values, n_states, 0,
+                                              largest)
+            self._pair_order[largest] = top_k(flat, len(flat), 0, largest)
+        self._year_count = (~np.isnan(self.values)).sum(axis=0)
+        self._pair_count = (~np.isnan(flat)).sum(axis=0)
+        # Metrics returned as integers (the sums, not the rates)
+        self._integer = np.nan_to_num(flat % 1).max(axis=0, initial=0) == 0
+
+    @classmethod
+    def from_aggregates(cls, data: Union[pd.DataFrame, AggregationCube],
+                        url2: Optional[str] =
+                        "./Data/us-state-populations.csv",
+                        metrics: Sequence[str] = COLUMNS_OF_INTEREST[2:]
+                        ) -> "Ranking":
+        """
+        Builds the rankings of the sums grouped by state and year and, if a
+        population file is given, of their percentages of the population
+        (the "<metric>_perc" metrics, see `per_capita`).
+
+        Args:
+            data (pd.DataFrame or AggregationCube): DataFrame grouped by
+                "state" and "year" (as returned by `groupby_state_and_year`)
+                or an `AggregationCube`.
+            url2 (str, optional): The URL of the population CSV file, None
+                to skip the metrics per capita. Defaults to
+                "./Data/us-state-populations.csv".
+            metrics (sequence of str, optional): Columns to rank. Defaults to
+                "permit", "handgun" and "long_gun".
+
+        Returns:
+            Ranking: Rankings of the given aggregates.
+        """
+        metrics = list(metrics)
+        if isinstance(data, AggregationCube):
+            positions = [data.metrics.index(metric) for metric in metrics]
+            states, years = data.states, data.years
+            values = data.to_array(["state", "year"])[..., positions]
+        else:
+            state = data["state"].astype("category")
+            states = state.cat.categories.tolist()
+            year = data["year"].to_numpy(dtype=np.int64)
+            first_year = int(year.min()) if len(year) else 0
+            years = range(first_year, int(year.max()) + 1 if len(year) else 0)
+            values = np.full((len(states), len(years), len(metrics)), np.nan)
+            cells = (state.cat.codes.to_numpy(), year - first_year)
+            values[cells] = data[metrics].to_numpy(dtype=np.float64)
+        if url2 is not None:
+            table = load_population(url2)
+            ids = table.ids(states)
+            population = table.population(ids[:, None],
+                                          np.asarray(years)[None, :])
+            # States without population (the territories) rank as NaN
+            population[ids < 0] = np.nan
+            values = np.concatenate(
+                [values, values * (100.0 / population)[..., None]], axis=2)
+            metrics = metrics + [rate_column(metric) for metric in metrics]
+        return cls(states, years, values, metrics)
+
+    def top(self, metrics: Union[str, Sequence[str]], k: int = 10,
+            year: Optional[int] = None, largest: bool = True,
+            records: bool = False
+            ) -> Union[pd.DataFrame, List[dict], Dict[str, object]]:
+        """
+        Returns the k state-year pairs with the largest (or smallest) values
+        of one or several metrics, among all the years or in a single year.
+        Pairs without data are never returned.
+
+        Args:
+            metrics (str or sequence of str): Metric, or list of metrics, to
+                rank by.
+            k (int, optional): Number of pairs. Defaults to 10.
+            year (int, optional): Only ranks the states in this year.
+                Defaults to None, which ranks all the pairs.
+            largest (bool, optional): Returns the largest values instead of
+                the smallest ones. Defaults to True.
+            records (bool, optional): Returns a list of dicts, which is much
+                faster to build than a DataFrame (for instance to serve JSON).
+                Defaults to False.
+
+        Returns:
+            pd.DataFrame, list or dict: DataFrame (or records) with the
+                columns "state", "year" and the metric, in rank order, or a
+                dict of them keyed by metric if a list of metrics is given.
+        """
+        if not isinstance(metrics, str):
+            return {metric: self.top(metric, k, year, largest, records)
+                    for metric in metrics}
+        if metrics not in self._metric_ids:
+            raise KeyError(f"Unknown metric: {metrics}")
+        m = self._metric_ids[metrics]
+        if year is None:
+            k = min(k, self._pair_count[m])
+            pairs = self._pair_order[largest][:k, m]
+            state_ids, year_ids = np.divmod(pairs, len(self.years))
+        else:
+            y = int(year) - int(self.years[0]) if len(self.years) else -1
+            if not 0 <= y < len(self.years):
+                raise KeyError(f"Unknown year: {year}")
+            k = min(k, self._year_count[y, m])
+            state_ids = self._year_order[largest][:k, y, m]
+            year_ids = np.full(k, y)
+        values = self.values[state_ids, year_ids, m]
+        if self._integer[m]:
+            values = values.astype(np.int64)
+        if records:
+            return [{"state": state, "year": pair_year, metrics: value}
+                    for state, pair_year, value in zip(
+                        self.states[state_ids].tolist(),
+                        self.years[year_ids].tolist(), values.tolist())]
+        return pd.DataFrame({
+            "state": self.states[state_ids],
+            "year": self.years[year_ids],
+            metrics: values,
+        })
@@ -0,0 +1,193 @@
+# firearm_analysis/raster_maps.py
+
+import functools
+import json
+import os
+from typing import BinaryIO, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from branca.utilities import color_brewer
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PathCollection
+from matplotlib.colorbar import ColorbarBase
+from matplotlib.colors import BoundaryNorm, ListedColormap, to_rgba
+from matplotlib.figure import Figure
+from matplotlib.path import Path
+
+# Area shown by the folium maps of `create_maps` (longitude, latitude)
+DEFAULT_EXTENT = (-126.0, -64.0, 23.0, 51.0)
+
+
+def _mercator(coordinates: Sequence[Sequence[float]]) -> np.ndarray:
+    """
+    Projects longitude/latitude pairs with the Web Mercator projection used
+    by the folium maps.
+
+    Args:
+        coordinates (sequence): Pairs of longitude and latitude in degrees.
+
+    Returns:
+        np.ndarray: Projected x and y coordinates.
+    """
+    lon, lat = np.asarray(coordinates, dtype=float)[:, :2].T
+    x = np.radians(lon)
+    y = np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+    return np.column_stack([x, y])
+
+
+@functools.lru_cache(maxsize=None)
+def state_paths(geo_data: str = "./Data/us-states.json"
+                ) -> Tuple[List[str], List[Path]]:
+    """
+    Reads a GeoJSON file of the states and projects their polygons only
+    once.
+
+    Args:
+        geo_data (str, optional): Path of the GeoJSON file. Defaults to
+            "./Data/us-states.json".
+
+    Returns:
+        tuple: Identifiers of the features ("code" of the states) and their
+            projected paths, in the same order.
+    """
+    with open(geo_data) as file:
+        features = json.load(file)["features"]
+    codes = []
+    paths = []
+    for feature in features:
+        geometry = feature["geometry"]
+        polygons = geometry["coordinates"]
+        if geometry["type"] == "Polygon":
+            polygons = [polygons]
+        rings = [Path(_mercator(ring), closed=True)
+                 for polygon in polygons for ring in polygon]
+        codes.append(feature["id"])
+        paths.append(Path.make_compound_path(*rings))
+    return codes, paths
+
+
+@functools.lru_cache(maxsize=None)
+def _template(geo_data: str, extent: Tuple[float, float, float, float],
+              size: Tuple[float, float], dpi: int
+              ) -> Tuple[Figure, PathCollection, object]:
+    """
+    Creates the figure shared by all the renders of the same GeoJSON file,
+    so a new map only needs to fill the states and redraw the legend.
+
+    Args:
+        geo_data (str): Path of the GeoJSON file.
+        extent (tuple): Longitude and latitude limits of the map.
+        size (tuple): Width and height of the figure in inches.
+        dpi (int): Resolution of the figure.
+
+    Returns:
+        tuple: Figure, collection of the states and axes of the legend.
+    """
+    _, paths = state_paths(geo_data)
+    fig = Figure(figsize=size, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_axes((0, 0, 1, 1))
+    ax.set_axis_off()
+    collection = PathCollection(paths, edgecolors=(0, 0, 0, 0.1),
+                                linewidths=1)
+    ax.add_collection(collection)
+    (x_min, y_min), (x_max, y_max) = _mercator(
+        [extent[0::2], extent[1::2]])
+    ax.set_xlim(x_min, x_max)
+    ax.set_ylim(y_min, y_max)
+    ax.set_aspect("equal")
+    legend_ax = fig.add_axes((0.55, 0.93, 0.4, 0.025))
+    return fig, collection, legend_ax
+
+
+def bin_colors(values: np.ndarray, bins: int = 6,
+               fill_color: str = "YlGn") -> Tuple[np.ndarray, List[str],
+                                                  np.ndarray]:
+    """
+    Assigns a color to each value with the same binning as
+    `folium.Choropleth`: equal-width bins between the minimum and the
+    maximum, and the ColorBrewer palette of the given name.
+
+    Args:
+        values (np.ndarray): Values to color. NaN values get the index -1.
+        bins (int, optional): Number of bins. Defaults to 6.
+        fill_color (str, optional): Name of the ColorBrewer palette.
+            Defaults to "YlGn".
+
+    Returns:
+        tuple: Edges of the bins, colors of the bins and index of the bin
+            of each value.
+    """
+    real_values = values[~np.isnan(values)]
+    _, bin_edges = np.histogram(real_values, bins=bins)
+    colors = color_brewer(fill_color, n=len(bin_edges) - 1)
+    # Make the last bin include its right edge, as folium does
+    edges = bin_edges.astype(float)
+    edges[-1] = np.nextafter(edges[-1], np.inf)
+    index = np.digitize(values, edges, right=False) - 1
+    index[np.isnan(values)] = -1
+    return bin_edges, colors, index
+
+
+def render_choropleth(df: pd.DataFrame, column: str,
+                      output: Union[str, BinaryIO],
+                      geo_data: str = "./Data/us-states.json",
+                      legend_name: str = "", key: str = "code",
+                      fill_color: str = "YlGn", fill_opacity: float = 0.7,
+                      nan_fill_color: str = "black", bins: int = 6,
+                      extent: Tuple[float, float, float, float] =
+                      DEFAULT_EXTENT, size: Tuple[float, float] = (10, 6),
+                      dpi: int = 100, fmt: Optional[str] = None) -> None:
+    """
+    Draws a choropleth map of the states without a browser, rasterizing
+    the projected polygons of the GeoJSON file with matplotlib. The colors
+    and the legend follow the ones of `folium.Choropleth`.
+
+    Args:
+        df (pd.DataFrame): DataFrame with the identifiers of the states and
+            the column to map.
+        column (str): Column to map.
+        output (str or file): Path or binary file of the image.
+        geo_data (str, optional): Path of the GeoJSON file. Defaults to
+            "./Data/us-states.json".
+        legend_name (str, optional): Caption of the legend. Defaults to "".
+        key (str, optional): Column with the identifiers of the features of
+            the GeoJSON file. Defaults to "code".
+        fill_color (str, optional): ColorBrewer palette. Defaults to "YlGn".
+        fill_opacity (float, optional): Opacity of the states. Defaults to
+            0.7.
+        nan_fill_color (str, optional): Color of the states without data.
+            Defaults to "black".
+        bins (int, optional): Number of bins. Defaults to 6.
+        extent (tuple, optional): Longitude and latitude limits of the map.
+            Defaults to the area of the folium maps.
+        size (tuple, optional): Width and height in inches. Defaults to
+            (10, 6).
+        dpi (int, optional): Resolution. Defaults to 100.
+        fmt (str, optional): Image format ("png", "svg", ...). Defaults to
+            the extension of the path, or "png".
+
+    Returns:
+        None
+    """
+    codes, _ = state_paths(geo_data)
+    fig, collection, legend_ax = _template(geo_data, tuple(extent),
+                                           tuple(size), dpi)
+    values = (df.set_index(key)[column].astype(float)
+              .reindex(codes).to_numpy())
+    bin_edges, colors, index = bin_colors(values, bins, fill_color)
+    palette = np.array([to_rgba(c, fill_opacity) for c in colors]
+                       + [to_rgba(nan_fill_color, fill_opacity)])
+    collection.set_facecolor(palette[index])
+    legend_ax.clear()
+    ColorbarBase(legend_ax, cmap=ListedColormap(colors),
+                 norm=BoundaryNorm(bin_edges, len(colors)),
+                 orientation="horizontal", ticks=bin_edges)
+    legend_ax.set_title(legend_name, fontsize=9)
+    legend_ax.tick_params(labelsize=7)
+    if fmt is None:
+        fmt = "png"
+        if isinstance(output, str):
+            fmt = os.path.splitext(output)[1][1:] or fmt
+    fig.savefig(output, format=fmt)
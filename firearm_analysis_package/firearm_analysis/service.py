@@ -0,0 +1,433 @@
+# firearm_analysis/service.py
+
+import argparse
+import asyncio
+import collections
+import io
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+from .config import set_verbose
+from .cube import AggregationCube
+from .population import per_capita, rate_column
+from .ranking import Ranking
+from .visualization import time_evolution
+
+logger = logging.getLogger(__name__)
+
+# Status, content type and body of a response
+Response = Tuple[int, str, bytes]
+
+
+def _split(params: Dict[str, List[str]], name: str) -> Optional[List[str]]:
+    """
+    Returns the values of a query parameter, which may be repeated or
+    separated by commas.
+
+    Args:
+        params (dict): Parsed query string.
+        name (str): Name of the parameter.
+
+    Returns:
+        list of str or None: Values of the parameter, None if it is missing.
+    """
+    if name not in params:
+        return None
+    return [value for values in params[name]
+            for value in values.split(",") if value]
+
+
+def _one(params: Dict[str, List[str]], name: str) -> Optional[str]:
+    """Returns the last value of a query parameter, None if it is missing."""
+    return params[name][-1] if name in params else None
+
+
+def _json(data: object) -> Response:
+    """Builds a JSON response."""
+    return (HTTPStatus.OK, "application/json",
+            json.dumps(data).encode())
+
+
+class QueryService:
+    """
+    Aggregates of the NICS data kept in memory to answer queries. The NICS
+    and population files are loaded once, into an `AggregationCube` and a
+    `Ranking`, and loaded again as soon as one of them changes on disk.
+    The responses are kept in an LRU cache keyed by the query, which is
+    emptied on every reload.
+
+    Routes (all GET, with the filters as query parameters):
+
+    - "/totals?by=state,year&state=Texas&year=2016": sums of the metrics
+      grouped by "state", "year" and/or "month" (see `AggregationCube.query`).
+    - "/per-capita?by=state,year&state=...&year=...": sums and percentages
+      of the population (see `per_capita`). `by` must include "state".
+    - "/rankings?metric=handgun_perc&k=10&year=2016&order=desc": top-k (or,
+      with "asc", bottom-k) state-year pairs (see `Ranking.top`), keyed by
+      metric if several metrics are given.
+    - "/maps/<metric>.<fmt>?year=2016": choropleth map of a metric or of its
+      percentage (see `render_choropleth`), for a year or all of them.
+    - "/charts/time_evolution.<fmt>?state=Texas": time series of the metrics
+      (see `time_evolution`), for the US or some states.
+
+    Args:
+        url (str, optional): Path of the NICS CSV file. Defaults to
+            "./Data/nics-firearm-background-checks.csv".
+        url2 (str, optional): The URL of the population CSV file. Defaults
+            to "./Data/us-state-populations.csv".
+        geo_data (str, optional): Path of the GeoJSON file of the states.
+            Defaults to "./Data/us-states.json".
+        cache_size (int, optional): Maximum number of cached responses.
+            Defaults to 256.
+    """
+
+    def __init__(self, url: str = "./Data/nics-firearm-background-checks.csv",
+                 url2: str = "./Data/us-state-populations.csv",
+                 geo_data: str = "./Data/us-states.json",
+                 cache_size: int = 256):
+        self.url = url
+        self.url2 = url2
+        self.geo_data = geo_data
+        self.cache_size = cache_size
+        self.cube = None
+        self.ranking = None
+        self._signature = None
+        self._cache = collections.OrderedDict()
+        self._routes = {"totals": self._totals,
+                        "per-capita": self._per_capita,
+                        "rankings": self._rankings}
+        self.reload()
+
+    def _files_signature(self) -> tuple:
+        """Modification time and size of the source files."""
+        signature = []
+        for path in (self.url, self.url2):
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Loads the aggregates again if a source file changed since the last
+        load.
+
+        Args:
+            force (bool, optional): Loads them even if nothing changed.
+                Defaults to False.
+
+        Returns:
+            bool: Whether the aggregates were loaded.
+        """
+        signature = self._files_signature()
+        if signature == self._signature and not force:
+            return False
+        self.cube = AggregationCube.from_dataset(self.url)
+        self.ranking = Ranking.from_aggregates(self.cube, self.url2)
+        self._cache.clear()
+        self._signature = signature
+        logger.info("Loaded the aggregates of %s", self.url)
+        return True
+
+    def handle(self, target: str) -> Response:
+        """
+        Answers a query, from the cache if possible. The source files are
+        checked for changes first.
+
+        Args:
+            target (str): Path and query string of the request.
+
+        Returns:
+            tuple: HTTP status, content type and body of the response.
+        """
+        self.reload()
+        parts = urlsplit(target)
+        params = parse_qs(parts.query)
+        key = (parts.path, tuple(sorted((k, tuple(v))
+                                        for k, v in params.items())))
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        try:
+            response = self._dispatch(parts.path.strip("/"), params)
+        except KeyError as e:
+            message = e.args[0] if e.args else str(e)
+            return (HTTPStatus.NOT_FOUND, "application/json",
+                    json.dumps({"error": str(message)}).encode())
+        except ValueError as e:
+            return (HTTPStatus.BAD_REQUEST, "application/json",
+                    json.dumps({"error": str(e)}).encode())
+        self._cache[key] = response
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return response
+
+    def _dispatch(self, path: str, params: Dict[str, List[str]]
+                  ) -> Response:
+        """Calls the handler of a route."""
+        route, _, name = path.partition("/")
+        if route in self._routes and not name:
+            return self._routes[route](params)
+        if route in ("maps", "charts") and name:
+            stem, _, fmt = name.rpartition(".")
+            if not stem or not fmt:
+                raise KeyError(f"Unknown image: {name}")
+            if route == "maps":
+                return self._map(stem, fmt, params)
+            if stem == "time_evolution":
+                return self._chart(fmt, params)
+        raise KeyError(f"Unknown route: /{path}")
+
+    def _query(self, params: Dict[str, List[str]],
+               default_by: Sequence[str]) -> pd.DataFrame:
+        """Queries the cube with the grouping and filters of a request."""
+        years = _split(params, "year")
+        months = _split(params, "month")
+        return self.cube.query(
+            _split(params, "by") or default_by,
+            state=_split(params, "state"),
+            year=None if years is None else [int(y) for y in years],
+            month=None if months is None else [int(m) for m in months])
+
+    def _totals(self, params: Dict[str, List[str]]) -> Response:
+        """Sums of the metrics."""
+        df = self._query(params, ["state", "year"])
+        if "state" in df.columns:
+            df["state"] = df["state"].astype(str)
+        return _json(df.to_dict("records"))
+
+    def _per_capita(self, params: Dict[str, List[str]]) -> Response:
+        """Sums and percentages of the population."""
+        df = self._query(params, ["state", "year"])
+        if "state" not in df.columns:
+            raise ValueError("Per capita values require grouping by state")
+        df = per_capita(df, self.url2, self.cube.metrics)
+        return _json(df.astype({"state": str}).to_dict("records"))
+
+    def _rankings(self, params: Dict[str, List[str]]) -> Response:
+        """Top-k state-year pairs."""
+        metrics = _split(params, "metric")
+        if not metrics:
+            raise ValueError("Missing parameter: metric")
+        year = _one(params, "year")
+        order = _one(params, "order") or "desc"
+        if order not in ("asc", "desc"):
+            raise ValueError(f"Unknown order: {order}")
+        k = _one(params, "k") or "10"
+        if not k.isdigit() or int(k) < 1:
+            raise ValueError(f"k must be a positive integer: {k}")
+        # A single metric gives a list, several ones a dict of lists
+        return _json(self.ranking.top(
+            metrics if len(metrics) > 1 else metrics[0], k=int(k),
+            year=None if year is None else int(year),
+            largest=order == "desc", records=True))
+
+    def _map(self, metric: str, fmt: str,
+             params: Dict[str, List[str]]) -> Response:
+        """Choropleth map of a metric, or of its percentage."""
+        from .raster_maps import render_choropleth
+
+        year = _one(params, "year")
+        by = ["state"] if year is None else ["state", "year"]
+        df = self.cube.query(by, year=None if year is None else int(year))
+        df = per_capita(df, self.url2, self.cube.metrics)
+        if metric not in df.columns or metric in ("state", "year"):
+            raise KeyError(f"Unknown metric: {metric}")
+        rates = [rate_column(m) for m in self.cube.metrics]
+        legend_name = metric.replace("_", " ")
+        if metric in rates:
+            legend_name = f"{legend_name}entage (%)"
+        if year is not None:
+            legend_name = f"{legend_name}, {year}"
+        buffer = io.BytesIO()
+        render_choropleth(df, metric, buffer, geo_data=self.geo_data,
+                          legend_name=legend_name, fmt=fmt)
+        return HTTPStatus.OK, _content_type(fmt), buffer.getvalue()
+
+    def _chart(self, fmt: str, params: Dict[str, List[str]]) -> Response:
+        """Time series of the metrics."""
+        states = _split(params, "state")
+        image = time_evolution(self.cube, state=states, fmt=fmt)
+        return HTTPStatus.OK, _content_type(fmt), image
+
+
+def _content_type(fmt: str) -> str:
+    """Content type of an image format."""
+    return {"png": "image/png", "svg": "image/svg+xml",
+            "pdf": "application/pdf", "jpg": "image/jpeg",
+            "jpeg": "image/jpeg"}.get(fmt, "application/octet-stream")
+
+
+async def _respond(service: QueryService, executor: ThreadPoolExecutor,
+                   reader: asyncio.StreamReader,
+                   writer: asyncio.StreamWriter) -> None:
+    """
+    Reads one HTTP request from a connection and writes the response.
+
+    Args:
+        service (QueryService): Service that answers the queries.
+        executor (ThreadPoolExecutor): Thread that runs the queries, so the
+            event loop is never blocked by a query or a render.
+        reader (asyncio.StreamReader): Stream of the request.
+        writer (asyncio.StreamWriter): Stream of the response.
+
+    Returns:
+        None
+    """
+    try:
+        request_line = (await reader.readline()).decode("latin-1").split()
+        # Skip the headers, the queries have no body
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        if len(request_line) != 3:
+            status, content_type, body = (HTTPStatus.BAD_REQUEST,
+                                          "text/plain", b"Bad request")
+        elif request_line[0] != "GET":
+            status, content_type, body = (HTTPStatus.METHOD_NOT_ALLOWED,
+                                          "text/plain", b"Only GET")
+        else:
+            loop = asyncio.get_running_loop()
+            try:
+                status, content_type, body = await loop.run_in_executor(
+                    executor, service.handle, request_line[1])
+            except Exception:
+                logger.exception("Error answering %s", request_line[1])
+                status, content_type, body = (
+                    HTTPStatus.INTERNAL_SERVER_ERROR, "text/plain",
+                    b"Internal server error")
+        status = HTTPStatus(status)
+        logger.info("%s %s", " ".join(request_line[:2]), int(status))
+        writer.write(
+            f"HTTP/1.1 {int(status)} {status.phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def _shutdown_when_closed(server: asyncio.AbstractServer,
+                                executor: ThreadPoolExecutor) -> None:
+    """Shuts down the worker thread of a server once it is closed."""
+    try:
+        await server.wait_closed()
+    finally:
+        executor.shutdown(wait=False)
+
+
+# Tasks that shut down the worker threads of the running servers
+_SHUTDOWNS = set()
+
+
+async def start_server(service: QueryService, host: str = "127.0.0.1",
+                       port: int = 8000,
+                       executor: Optional[ThreadPoolExecutor] = None
+                       ) -> asyncio.AbstractServer:
+    """
+    Starts serving the queries of a `QueryService` over HTTP. The queries
+    run one at a time in a worker thread, since the figures are shared.
+
+    Args:
+        service (QueryService): Service that answers the queries.
+        host (str, optional): Address to listen on. Defaults to
+            "127.0.0.1".
+        port (int, optional): Port to listen on, 0 for any free port.
+            Defaults to 8000.
+        executor (ThreadPoolExecutor, optional): Worker thread of the
+            queries, which the caller shuts down. Defaults to None, which
+            starts one that is shut down when the server is closed.
+
+    Returns:
+        asyncio.AbstractServer: Running server.
+    """
+    owned = executor is None
+    if owned:
+        executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        server = await asyncio.start_server(
+            lambda reader, writer: _respond(service, executor, reader,
+                                            writer),
+            host, port)
+    except BaseException:
+        if owned:
+            executor.shutdown(wait=False)
+        raise
+    if owned:
+        task = asyncio.get_running_loop().create_task(
+            _shutdown_when_closed(server, executor))
+        _SHUTDOWNS.add(task)
+        task.add_done_callback(_SHUTDOWNS.discard)
+    logger.info("Serving on %s",
+                ", ".join(str(s.getsockname()) for s in server.sockets))
+    return server
+
+
+async def serve(service: QueryService, host: str = "127.0.0.1",
+                port: int = 8000) -> None:
+    """
+    Serves the queries of a `QueryService` until the task is cancelled.
+
+    Args:
+        service (QueryService): Service that answers the queries.
+        host (str, optional): Address to listen on. Defaults to
+            "127.0.0.1".
+        port (int, optional): Port to listen on. Defaults to 8000.
+
+    Returns:
+        None
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        server = await start_server(service, host, port, executor)
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """
+    Runs the query service from the command line:
+    `python -m firearm_analysis.service --port 8000`.
+
+    Args:
+        argv (sequence of str, optional): Command line arguments. Defaults to
+            the ones of the process.
+
+    Returns:
+        None
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m firearm_analysis.service",
+        description="Serves the NICS aggregates as JSON and images.")
+    parser.add_argument("--data",
+                        default="./Data/nics-firearm-background-checks.csv",
+                        help="NICS CSV file")
+    parser.add_argument("--population",
+                        default="./Data/us-state-populations.csv",
+                        help="population CSV file")
+    parser.add_argument("--geo-data", default="./Data/us-states.json",
+                        help="GeoJSON file of the states")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--cache-size", type=int, default=256,
+                        help="maximum number of cached responses")
+    args = parser.parse_args(argv)
+    set_verbose()
+    service = QueryService(args.data, args.population, args.geo_data,
+                           args.cache_size)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
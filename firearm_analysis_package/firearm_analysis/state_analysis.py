@@ -1,39 +1,46 @@
 # firearm_analysis/state_analysis.py
 
-import pandas as pd
+import logging
 import textwrap
+from typing import Optional, Union
+
+import pandas as pd
+
+from .data_processing import load_dataset, widen_counts
+from .population import load_population, rates
+from .profiling import profiled
+from .state_index import TERRITORIES
+
+logger = logging.getLogger(__name__)
 
 
-def groupby_state(url: str =
-                  "./Data/nics-firearm-background-checks.csv") -> pd.DataFrame:
+@profiled
+def groupby_state(data: Union[str, pd.DataFrame] =
+                  "./Data/nics-firearm-background-checks.csv"
+                  ) -> pd.DataFrame:
     """
-    Reads a CSV file from a specified URL, renames some columns, modifies the
-    "month" column, groups the DataFrame by the "state" column and calculates
-    the sum of the "permit", "handgun" and "long_gun" columns.
+    Groups the NICS data by the "state" column and calculates the sum of the
+    "permit", "handgun" and "long_gun" columns.
 
     Args:
-        (str, optional): URL of the CSV file. Must contain, at least, the
-            columns "month", "state", "permit", "handgun" and "long_gun".
-            Defaults to "./Data/nics-firearm-background-checks.csv"
+        data (str or pd.DataFrame, optional): Path of the CSV file or the
+            DataFrame returned by `load_dataset`. The CSV file must contain,
+            at least, the columns "month", "state", "permit", "handgun" and
+            "long_gun". Defaults to
+            "./Data/nics-firearm-background-checks.csv"
 
     Returns:
         pd.DataFrame: DataFrame grouped by "state" with cumulative values.
     """
-    df = pd.read_csv(url)
-    df.rename(columns={"longgun": "long_gun"}, inplace=True)
-    df = df[["month", "state", "permit", "handgun", "long_gun"]]
-    # Extract the year out of the 'month' column
-    month_index = df.columns.get_loc("month")  # find index of 'month' column
-    df.insert(month_index, "year", "")  # insert 'year' col right before
-    # Copy-on-Write recommended way to change the values of an object
-    df.loc[:, ["year"]] = df["month"].str.split("-", expand=True)[0]
-    df = df.drop(columns=["month"])
-    df_grouped = df.groupby('state').sum().reset_index()
-    df_grouped.drop(columns=["year"], inplace=True)
-    display(df_grouped.head(5))
+    df = load_dataset(data)
+    df = widen_counts(df[["state", "permit", "handgun", "long_gun"]])
+    df_grouped = df.groupby('state', observed=True).sum().reset_index()
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("%s", df_grouped.head(5))
     return df_grouped
 
 
+@profiled
 def clean_states(df: pd.DataFrame) -> pd.DataFrame:
     """
     Removes rows corresponding to specific U.S. territories from the DataFrame.
@@ -44,22 +51,26 @@ def clean_states(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         pd.DataFrame: A DataFrame with specified U.S. territories removed.
     """
-    print(f"Number of states before removing undesired data: "
-          f"{df['state'].nunique()}")
-    states_to_remove = ["Guam", "Mariana Islands",
-                        "Puerto Rico", "Virgin Islands"]
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Number of states before removing undesired data: %s",
+                    df["state"].nunique())
+    states_to_remove = list(TERRITORIES)
     df_cleaned = df[~df["state"].isin(states_to_remove)]
-    print(f"Number of states after removing undesired data: "
-          f"{df_cleaned['state'].nunique()}")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Number of states after removing undesired data: %s",
+                    df_cleaned["state"].nunique())
     return df_cleaned
 
 
+@profiled
 def merge_datasets(df: pd.DataFrame,
                    url2: str = "./Data/us-state-populations.csv"
                    ) -> pd.DataFrame:
     """
     Merges the input DataFrame with a population DataFrame from a URL
-    based on the "state" column.
+    based on the "state" column. The population CSV file is only parsed
+    once (see `load_population`) and the states are matched by integer
+    identifiers.
 
     Args:
         df (pd.DataFrame): The input DataFrame containing, at least, a
@@ -71,39 +82,57 @@ def merge_datasets(df: pd.DataFrame,
         pd.DataFrame: A merged DataFrame containing data from the input
             DataFrame and the DataFrame from the URL.
     """
-    pop_df = pd.read_csv(url2)
-    merged_df = pd.merge(df, pop_df, on="state")
-    print("\nFirst rows of the merged DataFrames:")
-    display(merged_df.head(5))
+    table = load_population(url2)
+    ids = table.ids(df["state"])
+    keep = ids >= 0
+    pop_df = table.frame.drop(columns="state").iloc[ids[keep]]
+    merged_df = pd.concat([df[keep].reset_index(drop=True),
+                           pop_df.reset_index(drop=True)], axis=1)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("\nFirst rows of the merged DataFrames:\n%s",
+                    merged_df.head(5))
     return merged_df
 
 
-def calculate_relative_values(df: pd.DataFrame) -> pd.DataFrame:
+@profiled
+def calculate_relative_values(df: pd.DataFrame,
+                              population: str = "pop_2014",
+                              decimals: Optional[int] = 3) -> pd.DataFrame:
     """
     Calculates values for the columns "permit", "long_gun", and "hand_gun"
-    as percentages of the population.
+    as percentages of the population. The three columns are calculated with
+    a single NumPy operation (see `rates`).
 
     Args:
         df (pd.DataFrame): The input DataFrame containing, at least, the
-            columns "permit", "long_gun", "hand_gun", and the "pop_2014"
-            columns.
+            columns "permit", "long_gun", "hand_gun", and the population
+            column.
+        population (str, optional): Column with the population. Defaults to
+            "pop_2014".
+        decimals (int, optional): Number of decimals of the percentages,
+            None to keep the full precision. Defaults to 3.
 
     Returns:
         pd.DataFrame: The DataFrame with additional columns for the relative
             values.
     """
-    df["permit_perc"] = round((df["permit"] * 100) / df["pop_2014"], 3)
-    df["longgun_perc"] = round((df["long_gun"] * 100) / df["pop_2014"], 3)
-    df["handgun_perc"] = round((df["handgun"] * 100) / df["pop_2014"], 3)
-    # TODO: comment out the next line
-    display(df.head(5))
+    values = rates(df[["permit", "long_gun", "handgun"]].to_numpy(),
+                   df[population].to_numpy())
+    if decimals is not None:
+        values = values.round(decimals)
+    df[["permit_perc", "longgun_perc", "handgun_perc"]] = values
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("%s", df.head(5))
     return df
 
 
+@profiled
 def analyze_kentucky(df: pd.DataFrame) -> pd.DataFrame:
     """
     Analyzes the colum "permit_perc" for the state of Kentucky and
     adjusts its value to the mean of the other states if it is an outlier.
+    See `find_outliers` for the detection of the outliers of every state and
+    column.
 
     Args:
         df (pd.DataFrame): The input DataFrame containing, at least, the
@@ -113,18 +142,19 @@ def analyze_kentucky(df: pd.DataFrame) -> pd.DataFrame:
         df (pd.DataFrame): The DataFrame with modified mean for outliers.
     """
     mean_permit_perc = round(df["permit_perc"].mean(), 2)
-    print(f"Mean of registered firearms permits (permit_perc): "
-          f"{mean_permit_perc}")
-    print("\nData of the state of Kentucky:")
-    display(df.loc[df["state"] == "Kentucky", :])
+    logger.info("Mean of registered firearms permits (permit_perc): %s",
+                mean_permit_perc)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("\nData of the state of Kentucky:\n%s",
+                    df.loc[df["state"] == "Kentucky", :])
     # Replace Kentucky mean value with the mean of the other states
     df.loc[df["state"] == "Kentucky", "permit_perc"] = mean_permit_perc
     new_mean_permit_perc = round(df["permit_perc"].mean(), 2)
-    print(f"\nNew mean of registered firearms permits (permit_perc): "
-          f"{new_mean_permit_perc}")
+    logger.info("\nNew mean of registered firearms permits (permit_perc): %s",
+                new_mean_permit_perc)
     # Draw conclusions for the mean change in outliers
-    if new_mean_permit_perc != mean_permit_perc:
-        print("\nConclusions:\n")
+    if (new_mean_permit_perc != mean_permit_perc
+            and logger.isEnabledFor(logging.INFO)):
         text = f"""
         The new mean is
         {round(abs((new_mean_permit_perc-mean_permit_perc)/mean_permit_perc),
@@ -137,5 +167,5 @@ def analyze_kentucky(df: pd.DataFrame) -> pd.DataFrame:
         """
         # Wrap the text to fit within 79 characters per line
         wrapped_lines = textwrap.wrap(textwrap.dedent(text), width=79)
-        print("\n".join(wrapped_lines))
+        logger.info("\nConclusions:\n\n%s", "\n".join(wrapped_lines))
     return df
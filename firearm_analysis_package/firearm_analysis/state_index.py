@@ -0,0 +1,301 @@
+# firearm_analysis/state_index.py
+
+import functools
+from typing import Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from .cube import AggregationCube
+from .data_processing import COLUMNS_OF_INTEREST
+from .population import PopulationTable, load_population
+
+# Territories of the NICS data, which are not in the population file, and
+# their postal codes
+TERRITORIES = {"Guam": "GU", "Mariana Islands": "MP", "Puerto Rico": "PR",
+               "Virgin Islands": "VI"}
+
+
+class StateIndex:
+    """
+    Small integer identifiers of the states and territories, looked up by
+    name or by postal code. The states come first and the territories
+    last, so the states without the territories are the identifiers below
+    `n_states`.
+
+    Args:
+        states (sequence of str): Names, in the order of the identifiers.
+        codes (sequence of str): Postal codes, in the same order.
+        n_states (int): Number of states (the rest are territories).
+    """
+
+    def __init__(self, states: Sequence[str], codes: Sequence[str],
+                 n_states: int):
+        self.states = list(states)
+        self.codes = list(codes)
+        self.n_states = n_states
+        self._ids = {label: i for labels in (self.states, self.codes)
+                     for i, label in enumerate(labels)}
+        self._names = pd.Index(self.states)
+        self._codes = pd.Index(self.codes)
+
+    @classmethod
+    def from_population(cls, table: PopulationTable) -> "StateIndex":
+        """
+        Builds the index of the states of a population table followed by
+        the territories.
+
+        Args:
+            table (PopulationTable): Population table (see
+                `load_population`).
+
+        Returns:
+            StateIndex: Index with the same identifiers as the rows of the
+                population table.
+        """
+        territories = [t for t in TERRITORIES if t not in table.states]
+        return cls(table.states + territories,
+                   table.codes + [TERRITORIES[t] for t in territories],
+                   len(table.states))
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def id(self, label: str) -> int:
+        """
+        Returns the identifier of a state.
+
+        Args:
+            label (str): Name or postal code of the state.
+
+        Returns:
+            int: Identifier of the state.
+        """
+        if label not in self._ids:
+            raise KeyError(f"Unknown state: {label}")
+        return self._ids[label]
+
+    def ids(self, labels: Sequence[str]) -> np.ndarray:
+        """
+        Returns the identifiers of many states at once. Categorical labels
+        are only looked up once per category.
+
+        Args:
+            labels (sequence of str): Names or postal codes of the states.
+
+        Returns:
+            np.ndarray: Identifiers, -1 for the unknown labels.
+        """
+        labels = pd.Series(labels)
+        if isinstance(labels.dtype, pd.CategoricalDtype):
+            ids = self.ids(labels.cat.categories)
+            codes = labels.cat.codes.to_numpy()
+            return np.where(codes >= 0, ids[codes], -1).astype(np.int64)
+        ids = self._names.get_indexer(labels)
+        by_code = self._codes.get_indexer(labels)
+        return np.where(ids >= 0, ids, by_code).astype(np.int64)
+
+    def is_territory(self, labels: Sequence[str]) -> np.ndarray:
+        """
+        Tells which labels are territories.
+
+        Args:
+            labels (sequence of str): Names or postal codes.
+
+        Returns:
+            np.ndarray: Boolean mask, False for the unknown labels.
+        """
+        return self.ids(labels) >= self.n_states
+
+
+@functools.lru_cache(maxsize=None)
+def _index_of(table: PopulationTable) -> StateIndex:
+    """Index of a population table, built once per table."""
+    return StateIndex.from_population(table)
+
+
+def load_state_index(url2: str = "./Data/us-state-populations.csv"
+                     ) -> StateIndex:
+    """
+    Returns the index of the states of the population CSV file and the
+    territories. It is built once per version of the file.
+
+    Args:
+        url2 (str, optional): The URL of the population CSV file. Defaults to
+            "./Data/us-state-populations.csv".
+
+    Returns:
+        StateIndex: Index of the states and territories.
+    """
+    return _index_of(load_population(url2))
+
+
+class StateYearArray:
+    """
+    Sums of the metrics of every state and year in a dense array indexed by
+    (state identifier, year - first year, metric). Selecting a state, a year,
+    a metric or the states without the territories returns a view of the
+    array, without scanning or copying any data.
+
+    Args:
+        index (StateIndex): Identifiers of the states (first axis).
+        years (sequence of int): Consecutive years (second axis).
+        values (np.ndarray): Values with shape (states, years, metrics), NaN
+            for the pairs without data.
+        metrics (sequence of str): Names of the metrics (last axis).
+    """
+
+    def __init__(self, index: StateIndex, years: Sequence[int],
+                 values: np.ndarray, metrics: Sequence[str]):
+        self.index = index
+        self.years = [int(year) for year in years]
+        self.values = values
+        self.metrics = list(metrics)
+        self._metric_ids = {metric: i for i, metric in enumerate(metrics)}
+
+    @classmethod
+    def from_aggregates(cls, data: Union[pd.DataFrame, AggregationCube],
+                        url2: str = "./Data/us-state-populations.csv",
+                        metrics: Sequence[str] = COLUMNS_OF_INTEREST[2:]
+                        ) -> "StateYearArray":
+        """
+        Lays out the sums grouped by state and year in the dense array.
+
+        Args:
+            data (pd.DataFrame or AggregationCube): DataFrame grouped by
+                "state" and "year" (as returned by `groupby_state_and_year`)
+                or an `AggregationCube`.
+            url2 (str, optional): The URL of the population CSV file, for the
+                index of the states. Defaults to
+                "./Data/us-state-populations.csv".
+            metrics (sequence of str, optional): Columns to keep. Defaults to
+                "permit", "handgun" and "long_gun".
+
+        Returns:
+            StateYearArray: Array of the given aggregates.
+        """
+        index = load_state_index(url2)
+        metrics = list(metrics)
+        if isinstance(data, AggregationCube):
+            positions = [data.metrics.index(metric) for metric in metrics]
+            labels, years = data.states, data.years
+            rows = data.to_array(["state", "year"])[..., positions]
+            offsets = slice(None)
+        else:
+            labels = data["state"]
+            year = data["year"].to_numpy(dtype=np.int64)
+            first_year = int(year.min()) if len(year) else 0
+            years = range(first_year, int(year.max()) + 1 if len(year) else 0)
+            rows = data[metrics].to_numpy(dtype=np.float64)
+            offsets = year - first_year
+        ids = index.ids(labels)
+        if (ids < 0).any():
+            unknown = pd.Series(labels)[ids < 0].unique().tolist()
+            raise KeyError(f"Unknown states: {unknown}")
+        values = np.full((len(index), len(years), len(metrics)), np.nan)
+        values[ids, offsets] = rows
+        return cls(index, years, values, metrics)
+
+    def _offset(self, year: int) -> int:
+        """Position of a year in the second axis."""
+        offset = int(year) - self.years[0] if self.years else -1
+        if not 0 <= offset < len(self.years):
+            raise KeyError(f"Unknown year: {year}")
+        return offset
+
+    def state(self, state: str) -> np.ndarray:
+        """
+        Returns the values of a state.
+
+        Args:
+            state (str): Name or postal code of the state.
+
+        Returns:
+            np.ndarray: View with shape (years, metrics).
+        """
+        return self.values[self.index.id(state)]
+
+    def year(self, year: int) -> np.ndarray:
+        """
+        Returns the values of a year.
+
+        Args:
+            year (int): Year.
+
+        Returns:
+            np.ndarray: View with shape (states, metrics).
+        """
+        return self.values[:, self._offset(year)]
+
+    def metric(self, metric: str) -> np.ndarray:
+        """
+        Returns the values of a metric.
+
+        Args:
+            metric (str): Name of the metric.
+
+        Returns:
+            np.ndarray: View with shape (states, years).
+        """
+        if metric not in self._metric_ids:
+            raise KeyError(f"Unknown metric: {metric}")
+        return self.values[..., self._metric_ids[metric]]
+
+    def states_only(self) -> np.ndarray:
+        """
+        Returns the values of the states, without the territories.
+
+        Returns:
+            np.ndarray: View with shape (states, years, metrics).
+        """
+        return self.values[:self.index.n_states]
+
+    def get(self, state: str, year: int,
+            metric: Optional[str] = None) -> Union[float, np.ndarray]:
+        """
+        Returns the values of a state in a year.
+
+        Args:
+            state (str): Name or postal code of the state.
+            year (int): Year.
+            metric (str, optional): Only this metric. Defaults to all.
+
+        Returns:
+            float or np.ndarray: Value of the metric, or view of the values
+                of all the metrics.
+        """
+        values = self.values[self.index.id(state), self._offset(year)]
+        if metric is None:
+            return values
+        if metric not in self._metric_ids:
+            raise KeyError(f"Unknown metric: {metric}")
+        return values[self._metric_ids[metric]]
+
+    def to_frame(self, territories: bool = True) -> pd.DataFrame:
+        """
+        Returns the values in the shape of `groupby_state_and_year`.
+
+        Args:
+            territories (bool, optional): Includes the territories. Defaults
+                to True.
+
+        Returns:
+            pd.DataFrame: DataFrame with the columns "state", "year" and the
+                metrics, without the pairs without data.
+        """
+        values = self.values if territories else self.states_only()
+        n_states, n_years, _ = values.shape
+        flat = values.reshape(n_states * n_years, len(self.metrics))
+        observed = ~np.isnan(flat).all(axis=1)
+        state_ids, offsets = np.divmod(np.flatnonzero(observed), n_years)
+        df = pd.DataFrame({
+            "state": pd.Categorical.from_codes(
+                state_ids, self.index.states[:n_states]),
+            "year": np.asarray(self.years, dtype=np.int64)[offsets],
+        })
+        rows = flat[observed]
+        # The sums are integers, unless some of them are missing
+        if np.all(rows % 1 == 0):
+            rows = rows.astype(np.int64)
+        df[self.metrics] = rows
+        return df
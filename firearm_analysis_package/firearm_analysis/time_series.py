@@ -0,0 +1,373 @@
+# firearm_analysis/time_series.py
+
+import warnings
+from typing import Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from .cube import AggregationCube
+from .data_processing import COLUMNS_OF_INTEREST
+from .outliers import MAD_SCALE, THRESHOLDS
+
+# Aggregations of the rolling windows
+ROLLING = ("sum", "mean")
+
+# Smallest spread of the values of a window, relative to their median, so a
+# change after months of constant values is scored instead of left as NaN
+MIN_SPREAD = 1e-6
+
+
+def change(values: np.ndarray, periods: int = 1,
+           axis: int = 1) -> np.ndarray:
+    """
+    Calculates the relative change of every value with respect to the value
+    `periods` steps before along an axis: month over month with 1 period,
+    year over year with 12 periods of a monthly axis.
+
+    Args:
+        values (np.ndarray): Values, NaN for missing data.
+        periods (int, optional): Distance of the compared value. Defaults
+            to 1.
+        axis (int, optional): Axis of the time. Defaults to 1.
+
+    Returns:
+        np.ndarray: Changes as fractions (0.25 is 25% more), NaN for the
+            first periods and where the earlier value is missing or zero.
+    """
+    if periods < 1:
+        raise ValueError(f"The periods must be at least 1, not {periods}")
+    values = np.moveaxis(np.asarray(values, dtype=np.float64), axis, 0)
+    changes = np.full_like(values, np.nan)
+    before, after = values[:-periods], values[periods:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        changes[periods:] = np.where(before != 0, after / before - 1, np.nan)
+    return np.moveaxis(changes, 0, axis)
+
+
+def rolling(values: np.ndarray, window: int, how: str = "sum",
+            axis: int = 1, min_periods: Optional[int] = None) -> np.ndarray:
+    """
+    Calculates the sums or means of the trailing windows of an axis (the
+    value at step t covers the steps t - window + 1 to t) from cumulative
+    sums, so every window of every series costs the same two subtractions.
+    Missing values are skipped.
+
+    Args:
+        values (np.ndarray): Values, NaN for missing data.
+        window (int): Number of steps of each window.
+        how (str, optional): "sum" or "mean". Defaults to "sum".
+        axis (int, optional): Axis of the time. Defaults to 1.
+        min_periods (int, optional): Minimum number of values of a window,
+            NaN below it. Defaults to the size of the window.
+
+    Returns:
+        np.ndarray: Aggregates of the windows, with the shape of `values`.
+    """
+    if how not in ROLLING:
+        raise ValueError(f"Unknown aggregation: {how}")
+    if window < 1:
+        raise ValueError(f"The window must be at least 1, not {window}")
+    if min_periods is None:
+        min_periods = window
+    values = np.moveaxis(np.asarray(values, dtype=np.float64), axis, 0)
+    valid = ~np.isnan(values)
+    zero = np.zeros((1,) + values.shape[1:])
+    sums = np.concatenate([zero, np.cumsum(np.where(valid, values, 0),
+                                           axis=0)])
+    counts = np.concatenate([zero, np.cumsum(valid, axis=0)])
+    end = np.arange(1, len(values) + 1)
+    start = np.maximum(end - window, 0)
+    total = sums[end] - sums[start]
+    count = counts[end] - counts[start]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = total if how == "sum" else total / count
+    result = np.where(count >= max(min_periods, 1), result, np.nan)
+    return np.moveaxis(result, 0, axis)
+
+
+def _by_calendar_month(values: np.ndarray, first_month: int) -> np.ndarray:
+    """
+    Lays out a monthly axis (the first one) as (years, 12), NaN padded, so
+    the values of each calendar month are in the same column.
+    """
+    before = first_month - 1
+    after = -(before + len(values)) % 12
+    padding = [(before, after)] + [(0, 0)] * (values.ndim - 1)
+    padded = np.pad(values, padding, constant_values=np.nan)
+    return padded.reshape((-1, 12) + values.shape[1:])
+
+
+def seasonal_indices(values: np.ndarray, first_month: int = 1,
+                     axis: int = 1) -> np.ndarray:
+    """
+    Calculates the seasonal index of every calendar month with the ratio to
+    the centered 12-month moving average: the median ratio of the values of
+    a calendar month to their trend (so a surge in one year does not move
+    the index), normalized so the 12 indices have a mean of 1. An index of
+    1.3 in December means that December is 30% above the trend. All the
+    series (states and metrics) are computed at once.
+
+    Args:
+        values (np.ndarray): Monthly values, NaN for missing data.
+        first_month (int, optional): Calendar month (1 to 12) of the first
+            step of the axis. Defaults to 1.
+        axis (int, optional): Axis of the months. Defaults to 1.
+
+    Returns:
+        np.ndarray: Indices with the shape of `values`, except for the 12
+            calendar months (January first) along the axis.
+    """
+    values = np.moveaxis(np.asarray(values, dtype=np.float64), axis, 0)
+    means = rolling(values, 12, "mean", axis=0)
+    # The 2x12 moving average centered on each month averages the windows
+    # that end 5 and 6 months after it
+    trend = np.full_like(values, np.nan)
+    trend[:-6] = (means[5:-1] + means[6:]) / 2
+    with np.errstate(divide="ignore", invalid="ignore"), \
+            warnings.catch_warnings():
+        # Series without enough data just get NaN indices
+        warnings.simplefilter("ignore", RuntimeWarning)
+        ratios = np.where(trend > 0, values / trend, np.nan)
+        indices = np.nanmedian(_by_calendar_month(ratios, first_month),
+                                axis=0)
+        indices = indices / np.nanmean(indices, axis=0)
+    return np.moveaxis(indices, 0, axis)
+
+
+def spike_scores(values: np.ndarray, window: int = 12,
+                 axis: int = 1) -> np.ndarray:
+    """
+    Scores every value against the values of the trailing window before it
+    with a robust z-score: its distance to their median in scaled MADs (see
+    `robust_bounds`). The windows of all the steps and series are views of
+    the same array (`sliding_window_view`), reduced by a single median.
+
+    Args:
+        values (np.ndarray): Values, NaN for missing data.
+        window (int, optional): Number of earlier steps of each window.
+            Defaults to 12.
+        axis (int, optional): Axis of the time. Defaults to 1.
+
+    Returns:
+        np.ndarray: Scores with the shape of `values`, NaN for the first
+            steps and for windows of zeros. Windows of other constant values
+            get a tiny spread (see `MIN_SPREAD`).
+    """
+    if window < 2:
+        raise ValueError(f"The window must be at least 2, not {window}")
+    values = np.moveaxis(np.asarray(values, dtype=np.float64), axis, 0)
+    scores = np.full_like(values, np.nan)
+    if len(values) > window:
+        # Window ending right before each of the steps after the first ones
+        earlier = np.lib.stride_tricks.sliding_window_view(
+            values[:-1], window, axis=0)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            center = np.nanmedian(earlier, axis=-1)
+            spread = MAD_SCALE * np.nanmedian(
+                np.abs(earlier - center[..., None]), axis=-1)
+        spread = np.maximum(spread, MIN_SPREAD * np.abs(center))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores[window:] = np.where(spread > 0,
+                                       (values[window:] - center) / spread,
+                                       np.nan)
+    return np.moveaxis(scores, 0, axis)
+
+
+class MonthlySeries:
+    """
+    Monthly sums of the NICS metrics of every state in a dense array
+    indexed by (state, month, metric), with the changes, rolling windows,
+    seasonal indices and spikes of all the states computed at once.
+
+    Args:
+        states (sequence of str): Names of the states (first axis).
+        start (str or pd.Period): First month of the second axis, such as
+            "1998-11".
+        values (np.ndarray): Values with shape (states, months, metrics), NaN
+            for the months without data.
+        metrics (sequence of str): Names of the metrics (last axis).
+    """
+
+    def __init__(self, states: Sequence[str], start: Union[str, pd.Period],
+                 values: np.ndarray, metrics: Sequence[str]):
+        self.states = list(states)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.metrics = list(metrics)
+        self.months = pd.period_range(pd.Period(start, freq="M"),
+                                      periods=self.values.shape[1], freq="M")
+        self._metric_ids = {metric: i for i, metric in enumerate(metrics)}
+
+    @classmethod
+    def from_aggregates(cls, data: Union[str, pd.DataFrame,
+                                         AggregationCube] =
+                        "./Data/nics-firearm-background-checks.csv",
+                        metrics: Sequence[str] = COLUMNS_OF_INTEREST[2:]
+                        ) -> "MonthlySeries":
+        """
+        Lays out the monthly sums of the states, from the first to the last
+        month with data.
+
+        Args:
+            data (str, pd.DataFrame or AggregationCube, optional): Path of
+                the CSV file, DataFrame returned by `load_dataset` or an
+                `AggregationCube`. Defaults to
+                "./Data/nics-firearm-background-checks.csv".
+            metrics (sequence of str, optional): Metrics to keep. Defaults to
+                "permit", "handgun" and "long_gun".
+
+        Returns:
+            MonthlySeries: Series of the given data.
+        """
+        cube = (data if isinstance(data, AggregationCube)
+                else AggregationCube.from_dataset(data, metrics))
+        positions = [cube.metrics.index(metric) for metric in metrics]
+        values = cube.to_array(["state", "year", "month"])[..., positions]
+        n_states, n_years = values.shape[:2]
+        values = values.reshape(n_states, n_years * 12, len(positions))
+        observed = np.flatnonzero(~np.isnan(values).all(axis=(0, 2)))
+        first, last = (observed[0], observed[-1]) if len(observed) else (0, -1)
+        start = pd.Period(year=cube.years[0] if cube.years else 2000,
+                          month=1, freq="M") + int(first)
+        return cls(cube.states, start, values[:, first:last + 1],
+                   list(metrics))
+
+    def _like(self, values: np.ndarray) -> "MonthlySeries":
+        """Series with the same axes and other values."""
+        return MonthlySeries(self.states, self.months[0], values,
+                             self.metrics)
+
+    def metric(self, metric: str) -> np.ndarray:
+        """
+        Returns the values of a metric.
+
+        Args:
+            metric (str): Name of the metric.
+
+        Returns:
+            np.ndarray: View with shape (states, months).
+        """
+        if metric not in self._metric_ids:
+            raise KeyError(f"Unknown metric: {metric}")
+        return self.values[..., self._metric_ids[metric]]
+
+    def change(self, periods: int = 1) -> "MonthlySeries":
+        """
+        Returns the relative changes (see `change`): month over month by
+        default, year over year with 12 periods.
+
+        Args:
+            periods (int, optional): Number of months. Defaults to 1.
+
+        Returns:
+            MonthlySeries: Changes as fractions.
+        """
+        return self._like(change(self.values, periods, axis=1))
+
+    def rolling(self, window: int = 3, how: str = "sum",
+                min_periods: Optional[int] = None) -> "MonthlySeries":
+        """
+        Returns the sums or means of the trailing windows (see `rolling`).
+
+        Args:
+            window (int, optional): Number of months. Defaults to 3.
+            how (str, optional): "sum" or "mean". Defaults to "sum".
+            min_periods (int, optional): Minimum number of months with data.
+                Defaults to the window.
+
+        Returns:
+            MonthlySeries: Aggregates of the windows.
+        """
+        return self._like(rolling(self.values, window, how, 1, min_periods))
+
+    def seasonal_indices(self) -> pd.DataFrame:
+        """
+        Returns the seasonal index of every state, calendar month and metric
+        (see `seasonal_indices`).
+
+        Returns:
+            pd.DataFrame: DataFrame with the columns "state", "month" (1 to
+                12) and the metrics.
+        """
+        indices = seasonal_indices(self.values, self.months[0].month, axis=1)
+        df = pd.DataFrame({"state": np.repeat(self.states, 12),
+                           "month": np.tile(np.arange(1, 13),
+                                            len(self.states))})
+        df[self.metrics] = indices.reshape(-1, len(self.metrics))
+        return df
+
+    def spikes(self, metrics: Optional[Sequence[str]] = None,
+               window: int = 12, threshold: Optional[float] = None,
+               seasonal: bool = True) -> pd.DataFrame:
+        """
+        Finds the surges: months whose value is far above the values of the
+        months before them (see `spike_scores`). With `seasonal`, the values
+        are first divided by the seasonal index of their state and calendar
+        month, so the usual December peak is not a surge.
+
+        Args:
+            metrics (sequence of str, optional): Metrics to analyze. Defaults
+                to all of them.
+            window (int, optional): Number of earlier months compared with
+                each month. Defaults to 12.
+            threshold (float, optional): Minimum score of a surge, in scaled
+                MADs. Defaults to 3.5.
+            seasonal (bool, optional): Removes the seasonality first.
+                Defaults to True.
+
+        Returns:
+            pd.DataFrame: One row per surge, with the columns "state",
+                "year", "month", "metric", "value" and "score", sorted by
+                month and by decreasing score.
+        """
+        if threshold is None:
+            threshold = THRESHOLDS["mad"]
+        metrics = self.metrics if metrics is None else list(metrics)
+        unknown = [metric for metric in metrics
+                   if metric not in self._metric_ids]
+        if unknown:
+            raise KeyError(f"Unknown metrics: {unknown}")
+        positions = [self._metric_ids[metric] for metric in metrics]
+        values = self.values[..., positions]
+        adjusted = values
+        if seasonal:
+            indices = seasonal_indices(values, self.months[0].month, axis=1)
+            calendar = (self.months.month - 1).to_numpy()
+            with np.errstate(divide="ignore", invalid="ignore"):
+                adjusted = values / indices[:, calendar]
+        scores = spike_scores(adjusted, window, axis=1)
+        with np.errstate(invalid="ignore"):
+            state, month, metric = np.nonzero(scores > threshold)
+        order = np.lexsort((-scores[state, month, metric], month))
+        state, month, metric = state[order], month[order], metric[order]
+        months = self.months[month]
+        return pd.DataFrame({
+            "state": np.asarray(self.states, dtype=object)[state],
+            "year": months.year.to_numpy(dtype=np.int64),
+            "month": months.month.to_numpy(dtype=np.int64),
+            "metric": np.asarray(metrics, dtype=object)[metric],
+            "value": values[state, month, metric],
+            "score": scores[state, month, metric],
+        })
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Returns the values with a row per state and month.
+
+        Returns:
+            pd.DataFrame: DataFrame with the columns "state", "year",
+                "month" and the metrics, without the months without data.
+        """
+        n_states, n_months, n_metrics = self.values.shape
+        flat = self.values.reshape(n_states * n_months, n_metrics)
+        observed = ~np.isnan(flat).all(axis=1)
+        state_ids, offsets = np.divmod(np.flatnonzero(observed), n_months)
+        months = self.months[offsets]
+        df = pd.DataFrame({
+            "state": np.asarray(self.states, dtype=object)[state_ids],
+            "year": months.year.to_numpy(dtype=np.int64),
+            "month": months.month.to_numpy(dtype=np.int64),
+        })
+        df[self.metrics] = flat[observed]
+        return df
@@ -1,64 +1,183 @@
 # firearm_analysis/visualization.py
 
-import matplotlib.pyplot as plt
-import pandas as pd
+import functools
+import io
+import os
 import textwrap
+from typing import (
+    TYPE_CHECKING, BinaryIO, Dict, Optional, Sequence, Tuple, Union
+)
+
+import pandas as pd
+
+from .cube import AggregationCube
+from .data_processing import load_dataset, widen_counts
+from .profiling import profiled
+
+# matplotlib is only imported when a chart is drawn
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+    from matplotlib.figure import Figure
+
+# Label, line style and color of each metric of the chart
+LINES = {
+    "permit": dict(label="Permits", linestyle="dashed", color="#003f5c"),
+    "handgun": dict(label="Handguns", color="#bc5090", linewidth=2),
+    "long_gun": dict(label="Long Guns", color="#ffa600", linewidth=2),
+}
 
 
-def time_evolution(url: str = "./Data/nics-firearm-background-checks.csv",
-                   analysis: bool = False) -> None:
+@functools.lru_cache(maxsize=None)
+def _template(size: Tuple[float, float], dpi: int
+              ) -> Tuple["Figure", "Axes", Dict[str, object]]:
     """
-    Reads a CSV file from a specified URL, renames some columns, modifies
-    the "month" column and creates a plot showing the temporal evolution of the
-    total number of "permit", "handgun", and "long_gun" per year.
+    Creates the styled figure shared by all the charts of the same size, so
+    a new chart only needs to update the data of the lines and the title.
 
     Args:
-        (str, optional): URL of the CSV file. Must contain, at least, the
-            columns "month", "state", "permit", "handgun" and "long_gun".
-            Defaults to "./Data/nics-firearm-background-checks.csv".
+        size (tuple): Width and height of the figure in inches.
+        dpi (int): Resolution of the figure.
 
     Returns:
-        None
+        tuple: Figure, axes and lines of the chart keyed by metric.
     """
-    df = pd.read_csv(url)
-    df.rename(columns={"longgun": "long_gun"}, inplace=True)
-    df = df[["month", "state", "permit", "handgun", "long_gun"]]
-    # Extract the year out of the 'month' column
-    month_index = df.columns.get_loc("month")  # find index of 'month' column
-    df.insert(month_index, "year", "")  # insert 'year' col right before
-    # Copy-on-Write recommended way to change the values of an object
-    df.loc[:, ["year"]] = df["month"].str.split("-", expand=True)[0]
-    df = df.drop(columns=["month"])
-    df_grouped = df.groupby('year').sum().reset_index()
-    # Create the plot
-    plt.figure(figsize=(10, 6))
-    plt.plot(df_grouped["year"], df_grouped["permit"], label="Permits",
-             linestyle="dashed", color="#003f5c")
-    plt.plot(df_grouped["year"], df_grouped["handgun"], label="Handguns",
-             color="#bc5090", linewidth=2)
-    plt.plot(df_grouped["year"], df_grouped["long_gun"], label="Long Guns",
-             color="#ffa600", linewidth=2)
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from matplotlib.ticker import MaxNLocator
+
+    fig = Figure(figsize=size, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    lines = {metric: ax.plot([], [], **style)[0]
+             for metric, style in LINES.items()}
     # Labels properties
-    plt.xlabel("Year")
-    plt.ylabel("# Quantity")
-    plt.title("Time Evolution of Firearms and Permits in the US (1998-2020)")
-    plt.legend()
-    plt.grid(True)
+    ax.set_xlabel("Year")
+    ax.set_ylabel("# Quantity")
+    ax.legend()
     # Set grid properties
-    ax = plt.gca()
     ax.set_axisbelow(True)  # Draw grid lines behind other elements
-    ax.xaxis.grid(color="gray", linestyle="dotted")  # grey dotted grid lines
-    ax.yaxis.grid(color="gray", linestyle="dotted")  # grey dotted grid lines
-    # Rotate x-axis labels
-    plt.xticks(rotation=45)
+    ax.grid(True, color="gray", linestyle="dotted")  # grey dotted lines
+    # Only whole years, with rotated labels
+    ax.xaxis.set_major_locator(MaxNLocator(integer=True))
+    ax.tick_params(axis="x", labelrotation=45)
     # Set thicker border for the plot
     for spine in ax.spines.values():
-        spine.set_linewidth(1.5)  # Adjust the thickness as needed
-        spine.set_color("black")  # Adjust the color as needed
+        spine.set_linewidth(1.5)
+        spine.set_color("black")
     # Add outer tick marks for x and y axes
-    ax.tick_params(axis='x', direction='out', length=6, width=1.5)
-    ax.tick_params(axis='y', direction='out', length=6, width=1.5)
-    plt.show()
+    ax.tick_params(axis="both", direction="out", length=6, width=1.5)
+    return fig, ax, lines
+
+
+def _yearly_totals(data: Union[str, pd.DataFrame, AggregationCube],
+                   state: Optional[Union[str, Sequence[str]]],
+                   metrics: Sequence[str]) -> pd.DataFrame:
+    """
+    Sums the metrics of the chart per year.
+
+    Args:
+        data (str, pd.DataFrame or AggregationCube): Data of the chart (see
+            `time_evolution`).
+        state (str or sequence of str, optional): Only these states.
+        metrics (sequence of str): Columns to sum.
+
+    Returns:
+        pd.DataFrame: DataFrame with the column "year" and the metrics,
+            sorted by year.
+    """
+    if isinstance(data, AggregationCube):
+        if state is None:
+            df = data.query(["year"])
+        else:
+            df = data.query(["state", "year"], state=state)
+    else:
+        df = load_dataset(data)
+        if state is not None:
+            states = [state] if isinstance(state, str) else list(state)
+            df = df[df["state"].isin(states)]
+    df = widen_counts(df[["year"] + list(metrics)].astype({"year": "int64"}))
+    # Pre-aggregated yearly frames are already unique, this only sorts them
+    return df.groupby("year").sum().reset_index()
+
+
+@profiled
+def time_evolution(data: Union[str, pd.DataFrame, AggregationCube] =
+                   "./Data/nics-firearm-background-checks.csv",
+                   analysis: bool = False,
+                   output: Optional[Union[str, BinaryIO]] = None,
+                   state: Optional[Union[str, Sequence[str]]] = None,
+                   title: Optional[str] = None, fmt: Optional[str] = None,
+                   size: Tuple[float, float] = (10, 6), dpi: int = 100,
+                   metrics: Optional[Sequence[str]] = None
+                   ) -> Optional[bytes]:
+    """
+    Creates a plot showing the temporal evolution of the total number of
+    "permit", "handgun", and "long_gun" (or other metrics) per year.
+
+    The chart is drawn without a display with the Agg renderer of
+    matplotlib. The styled figure is created once and reused by every call
+    with the same size, which only updates the data of the lines, so many
+    charts (per state, per region, ...) can be drawn quickly.
+
+    Args:
+        data (str, pd.DataFrame or AggregationCube, optional): Path of the
+            CSV file, a DataFrame with the monthly rows (as returned by
+            `load_dataset`) or already grouped by year (and state), or an
+            `AggregationCube`. Defaults to
+            "./Data/nics-firearm-background-checks.csv".
+        analysis (bool, optional): Prints the analysis of the plot.
+            Defaults to False.
+        output (str or file, optional): Path or binary file of the image.
+            Defaults to None, which returns the image.
+        state (str or sequence of str, optional): Only plots the sums of
+            these states. The data must have the column "state". Defaults to
+            all the states.
+        title (str, optional): Title of the chart. Defaults to the states
+            and the years of the data.
+        fmt (str, optional): Image format ("png", "svg", ...). Defaults to
+            the extension of the path, or "png".
+        size (tuple, optional): Width and height in inches. Defaults to
+            (10, 6).
+        dpi (int, optional): Resolution. Defaults to 100.
+        metrics (sequence of str, optional): Lines of the chart. The metrics
+            without a style in `LINES` are drawn with the default colors of
+            matplotlib. Defaults to the metrics of `LINES`.
+
+    Returns:
+        bytes or None: The image, if `output` is None.
+    """
+    metrics = list(LINES) if metrics is None else list(metrics)
+    df_grouped = _yearly_totals(data, state, metrics)
+    fig, ax, lines = _template(tuple(size), dpi)
+    for metric in metrics:
+        if metric not in lines:
+            label = metric.replace("_", " ").title()
+            lines[metric] = ax.plot([], [], label=label)[0]
+        lines[metric].set_data(df_grouped["year"], df_grouped[metric])
+    # The template is shared, so the lines of other calls are hidden
+    for metric, line in lines.items():
+        line.set_visible(metric in metrics)
+    ax.legend(handles=[lines[metric] for metric in metrics])
+    ax.relim(visible_only=True)
+    ax.autoscale_view()
+    if title is None:
+        region = "the US"
+        if state is not None:
+            region = state if isinstance(state, str) else ", ".join(state)
+        years = ""
+        if len(df_grouped):
+            years = (f" ({df_grouped['year'].iloc[0]}-"
+                     f"{df_grouped['year'].iloc[-1]})")
+        title = f"Time Evolution of Firearms and Permits in {region}{years}"
+    ax.set_title(title)
+    if fmt is None:
+        fmt = "png"
+        if isinstance(output, str):
+            fmt = os.path.splitext(output)[1][1:] or fmt
+    image = None
+    if output is None:
+        output = image = io.BytesIO()
+    fig.savefig(output, format=fmt)
     # Toggle the plot analysis to display the text
     if analysis:
         text = """
@@ -74,3 +193,4 @@ def time_evolution(url: str = "./Data/nics-firearm-background-checks.csv",
         # Wrap the text to fit within 79 characters per line
         wrapped_lines = textwrap.wrap(textwrap.dedent(text), width=79)
         print("\n".join(wrapped_lines))
+    return image.getvalue() if image is not None else None
@@ -1,61 +1,52 @@
 # main.py
 
-from firearm_analysis.data_processing import (
-    read_csv, clean_csv, rename_col, breakdown_date, erase_month,
-    groupby_state_and_year, print_biggest_handguns, print_biggest_longguns
-)
+from firearm_analysis.config import set_verbose
+from firearm_analysis.cube import AggregationCube
+from firearm_analysis.outliers import find_outliers
+from firearm_analysis.ranking import Ranking
 from firearm_analysis.visualization import time_evolution
 from firearm_analysis.state_analysis import (
-    groupby_state, clean_states, merge_datasets, calculate_relative_values, analyze_kentucky
+    clean_states, merge_datasets, calculate_relative_values
 )
 from firearm_analysis.map_generation import create_maps
 
 
 def main():
 
-    # Read the CSV file
-    url = "./Data/nics-firearm-background-checks.csv"
-    df = read_csv(url)
+    # Show the intermediate DataFrames of each step
+    set_verbose()
 
-    # Rename column
-    df_renamed = rename_col(df)
-    
-    # Clean the DataFrame
-    df_clean = clean_csv(df_renamed)
-    
-    # Split the "month" column into "year" and "month"
-    df_date = breakdown_date(df_clean)
-
-    # Delete the "month" column
-    df_no_month = erase_month(df_date)
-    
-    # Group the data by the "year" and "state" columns
-    df_grouped = groupby_state_and_year(df_no_month)
+    # Parse the CSV file once into the aggregation cube that serves all the
+    # groupings used by the reports
+    url = "./Data/nics-firearm-background-checks.csv"
+    cube = AggregationCube.from_dataset(url)
 
-    # Print out the biggest number of registered handguns
-    df_max_handguns = print_biggest_handguns(df_grouped)
+    # Rank the state-year pairs by every metric, also per capita
+    ranking = Ranking.from_aggregates(cube)
 
-    # Print out the biggest number of registered long guns
-    df_max_longguns = print_biggest_longguns(df_grouped)
+    # Print out the biggest numbers of registered handguns and long guns
+    for metric, df_top in ranking.top(["handgun", "long_gun"], k=3).items():
+        print(f"\nState-years with the most {metric}:\n{df_top}")
 
     # Create temporal evolution graph
-    time_evolution(url)
+    time_evolution(cube, output="time_evolution.png")
 
-    # Group the DataFrame by states
-    df_states = groupby_state(url)
+    # Group the data by states
+    df_states = cube.query(["state"])
 
     # Remove territories
     df_states_removed = clean_states(df_states)
 
     # Merge the DataFrames from another URL
     url2 = "./Data/us-state-populations.csv"
-    df_merged = merge_datasets(df_states_removed)
+    df_merged = merge_datasets(df_states_removed, url2)
 
     # Calculate relative values
     df_percent = calculate_relative_values(df_merged)
 
-    # Analyze and remove outliers
-    df_final = analyze_kentucky(df_percent)
+    # Replace the outliers of every percentage (Kentucky permits, ...) with
+    # the median of the states
+    df_final, _ = find_outliers(df_percent, treatment="median")
     
     # Create choroplétic maps
     create_maps(df_final)
@@ -0,0 +1,44 @@
+# tests/test_batch_rendering.py
+
+import os
+import tempfile
+import unittest
+import pandas as pd
+from firearm_analysis.batch_rendering import render_batch
+
+
+class TestBatchRendering(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Create a sample DataFrame for testing
+        cls.df = pd.DataFrame({
+            "state": ["Kentucky", "Kentucky", "Alabama", "Alabama", "Guam"],
+            "year": [2019, 2020, 2019, 2020, 2020],
+            "permit": [100, 150, 10, 15, 1],
+            "handgun": [200, 250, 20, 25, 2],
+        })
+
+    def test_render_batch(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            result = render_batch(self.df, tmp, metrics=["permit"],
+                                  per_state=True, max_workers=2)
+            self.assertEqual(len(result["rendered"]), 6)
+            self.assertTrue(os.path.exists(
+                os.path.join(tmp, "maps", "permit_2019.png")))
+            self.assertTrue(os.path.exists(
+                os.path.join(tmp, "charts", "Kentucky_permit.png")))
+            # Only the figures whose data changed are drawn again
+            df = self.df.copy()
+            df.loc[1, "permit"] = 160
+            result = render_batch(df, tmp, metrics=["permit"],
+                                  per_state=True, max_workers=1)
+        self.assertEqual(sorted(os.path.basename(path)
+                                for path in result["rendered"]),
+                         ["Kentucky_permit.png", "permit.png",
+                          "permit_2020.png"])
+        self.assertEqual(len(result["skipped"]), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
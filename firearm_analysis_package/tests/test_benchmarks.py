@@ -0,0 +1,72 @@
+# tests/test_benchmarks.py
+
+import os
+import tempfile
+import unittest
+import pandas as pd
+from benchmarks.run import compare, run_benchmarks
+from benchmarks.synthetic import (
+    HEADER, STATE_WEIGHTS, generate_nics, synthetic_month, synthetic_rows
+)
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_generate_nics(self):
+        path = os.path.join(self.tmp.name, "nics.csv")
+        generate_nics(path, scale=3, seed=1, first="2016-01",
+                      last="2016-03")
+        df = pd.read_csv(path)
+        self.assertEqual(list(df.columns), HEADER)
+        self.assertEqual(len(df), synthetic_rows(3, "2016-01", "2016-03"))
+        self.assertEqual(len(df), 3 * len(STATE_WEIGHTS) * 3)
+        # From the last month to the first, states in order
+        self.assertEqual(df["month"].iloc[0], "2016-03")
+        self.assertEqual(df["month"].iloc[-1], "2016-01")
+        self.assertEqual(list(df["state"].iloc[:4]),
+                         ["Alabama"] * 3 + ["Alaska"])
+        # The columns start in the same months as the shipped file
+        january = df[df["month"] == "2016-01"]
+        self.assertTrue(january["permit_recheck"].isna().all())
+        self.assertTrue(df.loc[df["month"] == "2016-02",
+                               "permit_recheck"].notna().all())
+        totals = df[HEADER[2:-1]].sum(axis=1)
+        self.assertTrue((totals == df["totals"]).all())
+
+    def test_generate_nics_deterministic(self):
+        first, second = (os.path.join(self.tmp.name, f"{name}.csv")
+                         for name in ("first", "second"))
+        generate_nics(first, scale=2, first="2019-11", last="2020-01")
+        generate_nics(second, scale=2, first="2019-11", last="2020-01")
+        with open(first) as file1, open(second) as file2:
+            self.assertEqual(file1.read(), file2.read())
+        month = pd.Period("2019-12", freq="M")
+        self.assertFalse(synthetic_month(month, seed=0).equals(
+            synthetic_month(month, seed=1)))
+        with self.assertRaises(ValueError):
+            generate_nics(first, scale=0, overwrite=True)
+
+    def test_run_benchmarks(self):
+        results = run_benchmarks([1], ["read_csv", "groupby_state"],
+                                 data_dir=self.tmp.name, repeat=1)
+        self.assertEqual([(r["benchmark"], r["scale"]) for r in results],
+                         [("read_csv", 1), ("groupby_state", 1)])
+        for result in results:
+            self.assertEqual(result["rows"], synthetic_rows(1))
+            self.assertGreater(result["seconds"], 0)
+            self.assertGreater(result["peak_bytes"], 0)
+        with self.assertRaises(ValueError):
+            run_benchmarks([1], ["unknown"], data_dir=self.tmp.name)
+        report = {"results": results}
+        df = compare(report, report)
+        self.assertEqual(list(df["time_ratio"]), [1.0, 1.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# tests/test_breakdown.py
+
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from firearm_analysis.breakdown import (
+    read_breakdown, add_groups, breakdown_cube, transaction_breakdown
+)
+from firearm_analysis.data_processing import read_csv
+
+
+class TestBreakdown(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Create a sample CSV file with some of the transaction columns
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.url = os.path.join(cls.tmp.name, "nics.csv")
+        pd.DataFrame({
+            "month": ["2020-02", "2020-01", "2019-12", "2020-01"],
+            "state": ["Kentucky", "Kentucky", "Kentucky", "Alabama"],
+            "permit": [100, 200, None, 1],
+            "permit_recheck": [5, None, None, 0],
+            "handgun": [300, 70000, 20, 2],
+            "other": [2 ** 24 + 1, 0, 1, 2],
+            "long_gun": [400, 500, 30, 3],
+            "prepawn_handgun": [1, 2, 3, 4],
+            "private_sale_long_gun": [10, 20, 30, 40],
+            "totals": [2 ** 24 + 817, 70722, 84, 52],
+        }).to_csv(cls.url, index=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_read_breakdown(self):
+        df = read_breakdown(self.url, cache=False)
+        self.assertEqual(df.columns.tolist()[:3], ["year", "month", "state"])
+        self.assertEqual(df["year"].dtype, np.int16)
+        self.assertEqual(df["month"].dtype, np.int8)
+        self.assertIsInstance(df["state"].dtype, pd.CategoricalDtype)
+        # Missing values are read as 0, with the smallest integer dtype
+        self.assertEqual(df["permit_recheck"].tolist(), [5, 0, 0, 0])
+        self.assertEqual(df["permit_recheck"].dtype, np.uint8)
+        self.assertEqual(df["handgun"].dtype, np.uint32)
+        self.assertEqual(df["handgun"].tolist(), [300, 70000, 20, 2])
+        # Exact above the 24 bits of the mantissa of a 32-bit float
+        self.assertEqual(df["other"].tolist(), [2 ** 24 + 1, 0, 1, 2])
+        cached = read_breakdown(self.url)
+        pd.testing.assert_frame_equal(cached, df)
+
+    def test_add_groups(self):
+        df = add_groups(read_breakdown(self.url, cache=False))
+        self.assertEqual(df["handgun_all"].tolist(), [301, 70002, 23, 6])
+        self.assertEqual(df["permit_all"].tolist(), [105, 200, 0, 1])
+        self.assertEqual(df["private_sale"].tolist(), [10, 20, 30, 40])
+        # Groups without any column in the file are left out
+        self.assertNotIn("rentals", df.columns)
+
+    def test_breakdown_cube(self):
+        cube = breakdown_cube(read_breakdown(self.url, cache=False))
+        totals = cube.national()
+        self.assertEqual(totals["handgun"], 70322)
+        self.assertEqual(totals["long_gun_all"], 1033)
+        self.assertEqual(totals["other_all"], 2 ** 24 + 4)
+        self.assertEqual(totals["totals"], 2 ** 24 + 71675)
+        self.assertIn("prepawn", cube.metrics)
+        self.assertNotIn("returned", cube.metrics)
+        self.assertEqual(breakdown_cube(self.url, groups=None).metrics,
+                         ["permit", "permit_recheck", "handgun", "long_gun",
+                          "other", "prepawn_handgun", "private_sale_long_gun",
+                          "totals"])
+
+    def test_transaction_breakdown(self):
+        cube = breakdown_cube(self.url)
+        df = transaction_breakdown(cube, categories=["handgun_all"])
+        self.assertEqual(df.columns.tolist(),
+                         ["state", "year", "handgun_all"])
+        row = df[(df["state"] == "Kentucky") & (df["year"] == 2020)]
+        self.assertEqual(row["handgun_all"].item(), 70303)
+        df = transaction_breakdown(cube, by=["year"],
+                                   categories=["permit", "handgun"],
+                                   long=True)
+        self.assertEqual(df.columns.tolist(), ["year", "category", "count"])
+        self.assertEqual(len(df), 4)
+        with self.assertRaises(KeyError):
+            transaction_breakdown(cube, categories=["rifle"])
+
+    def test_read_csv_breakdown(self):
+        df = read_csv(self.url, cache=False, breakdown=True)
+        self.assertIn("private_sale_long_gun", df.columns)
+        self.assertEqual(df["handgun"].dtype, np.uint32)
+
+
+if __name__ == '__main__':
+    unittest.main()
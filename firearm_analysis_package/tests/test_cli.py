@@ -0,0 +1,97 @@
+# tests/test_cli.py
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+import pandas as pd
+from firearm_analysis.cli import Build, main
+
+
+class TestCli(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Create a sample DataFrame for testing
+        cls.df = pd.DataFrame({
+            "month": ["2020-01", "2020-02", "2019-12", "2020-01", "2020-01"],
+            "state": ["Kentucky", "Kentucky", "Alabama", "Alabama", "Guam"],
+            "permit": [100, 150, 10, 20, 1],
+            "handgun": [200, 250, 20, 30, 2],
+            "long_gun": [300, 350, 30, 40, 3],
+        })
+        cls.population = pd.DataFrame({
+            "code": ["KY", "AL"],
+            "state": ["Kentucky", "Alabama"],
+            "pop_2014": [1000, 100],
+        })
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.data = os.path.join(self.tmp.name, "nics.csv")
+        self.url2 = os.path.join(self.tmp.name, "populations.csv")
+        self.output = os.path.join(self.tmp.name, "output")
+        self.df.to_csv(self.data, index=False)
+        self.population.to_csv(self.url2, index=False)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def build(self, *stages, force=False):
+        build = Build(self.data, self.url2, output_dir=self.output,
+                      map_backend="matplotlib")
+        return build.run(stages, force=force)
+
+    def test_stages(self):
+        status = self.build("per-capita")
+        self.assertEqual(status, {"ingest": "ran", "aggregate": "ran",
+                                  "per-capita": "ran"})
+        df = pd.read_csv(os.path.join(self.output, "per_capita_state.csv"))
+        self.assertEqual(df["permit_perc"].tolist(), [30.0, 25.0])
+        # Nothing changed
+        self.assertEqual(set(self.build("per-capita").values()), {"skipped"})
+        # Only the stages that use the population file run again
+        self.population.assign(pop_2014=[500, 100]).to_csv(self.url2,
+                                                            index=False)
+        self.assertEqual(self.build("outliers"), {
+            "ingest": "skipped", "aggregate": "skipped", "per-capita": "ran",
+            "outliers": "ran"})
+        self.assertEqual(self.build("aggregate", force=True),
+                         {"ingest": "skipped", "aggregate": "ran"})
+        with self.assertRaises(ValueError):
+            self.build("deploy")
+
+    def test_main(self):
+        argv = ["--data", self.data, "--population", self.url2, "--output",
+                self.output, "--map-backend", "matplotlib"]
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            status = main(argv)
+        self.assertEqual(set(status.values()), {"ran"})
+        self.assertIn("maps: ran", stdout.getvalue())
+        for name in ("maps/permit_perc.png", "charts/time_evolution.png",
+                     "outlier_mask_state_year.csv", "manifest.json"):
+            self.assertTrue(os.path.exists(os.path.join(self.output, name)))
+        # A deleted output is built again
+        os.remove(os.path.join(self.output, "maps", "permit_perc.png"))
+        with contextlib.redirect_stdout(io.StringIO()):
+            status = main(argv + ["--stages", "maps", "charts"])
+        self.assertEqual(status["maps"], "ran")
+        self.assertEqual(status["charts"], "skipped")
+
+    def test_main_profile(self):
+        profile = os.path.join(self.tmp.name, "profile.json")
+        with contextlib.redirect_stdout(io.StringIO()):
+            main(["--data", self.data, "--population", self.url2, "--output",
+                  self.output, "--stages", "per-capita", "--profile",
+                  profile])
+        with open(profile) as file:
+            stages = json.load(file)["stages"]
+        self.assertEqual(stages["state_analysis.merge_datasets"]["rows_out"],
+                         2)
+        self.assertIn("state_analysis.calculate_relative_values", stages)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+# tests/test_cube.py
+
+import os
+import tempfile
+import unittest
+import pandas as pd
+from firearm_analysis.cube import AggregationCube
+
+
+class TestAggregationCube(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Create a sample cube for testing
+        cls.cube = AggregationCube.from_dataset(pd.DataFrame({
+            "month": ["2019-12", "2020-01", "2020-02", "2020-01"],
+            "state": ["Kentucky", "Kentucky", "Kentucky", "Alabama"],
+            "permit": [10, 100, 150, 1],
+            "handgun": [20, 200, 250, 2],
+            "long_gun": [30, 300, 350, 3],
+        }))
+
+    def test_query_state_and_year(self):
+        df = self.cube.query(["state", "year"])
+        self.assertEqual(df.columns.tolist(),
+                         ["state", "year", "permit", "handgun", "long_gun"])
+        # Alabama has no data in 2019
+        self.assertEqual(df.shape[0], 3)
+        row = df[(df["state"] == "Kentucky") & (df["year"] == 2020)]
+        self.assertEqual(row["handgun"].item(), 450)
+
+    def test_query_filters(self):
+        df = self.cube.query(["year", "month"], year=2020, month=1)
+        self.assertEqual(df["permit"].tolist(), [101])
+        with self.assertRaises(ValueError):
+            self.cube.query(["state"], year=2020)
+        with self.assertRaises(KeyError):
+            self.cube.query(["state"], state="Texas")
+
+    def test_national(self):
+        self.assertEqual(self.cube.national()["long_gun"], 683)
+
+    def test_with_sums(self):
+        cube = self.cube.with_sums({"guns": ["handgun", "long_gun"]})
+        self.assertEqual(cube.metrics[-1], "guns")
+        self.assertEqual(cube.national()["guns"], 1155)
+        df = cube.query(["state"], state="Alabama")
+        self.assertEqual(df["guns"].item(), 5)
+        with self.assertRaises(KeyError):
+            self.cube.with_sums({"guns": ["rifle"]})
+
+    def test_missing_counts(self):
+        cube = AggregationCube.from_dataset(pd.DataFrame({
+            "month": ["2020-01", "2020-02", "2020-01"],
+            "state": ["Kentucky", "Kentucky", "Guam"],
+            "permit": [10, None, None],
+            "handgun": [20, 30, None],
+            "long_gun": [30, 40, 5],
+        }))
+        df = cube.query(["state"]).set_index("state")
+        self.assertEqual(df.loc["Kentucky", "permit"], 10)
+        self.assertEqual(df.loc["Guam", "handgun"], 0)
+        self.assertEqual(cube.national()["long_gun"], 75)
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cube.npz")
+            self.cube.save(path)
+            cube = AggregationCube.load(path)
+        pd.testing.assert_frame_equal(cube.query(["state"]),
+                                      self.cube.query(["state"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,20 @@
 # tests/test_data_processing.py
 
+import contextlib
+import hashlib
+import io
+import os
+import tempfile
 import unittest
+from unittest import mock
 import pandas as pd
+from firearm_analysis import data_processing
+from firearm_analysis.config import set_verbose
 from firearm_analysis.data_processing import (
-    read_csv, clean_csv, rename_col, breakdown_date, erase_month,
-    groupby_state_and_year, print_biggest_handguns, print_biggest_longguns
+    read_csv, read_nics, read_compact, load_dataset, clean_csv, rename_col,
+    split_date, breakdown_date, erase_month, file_hash,
+    groupby_state_and_year, print_biggest_handguns, print_biggest_longguns,
+    widen_counts
 )
 
 
@@ -26,11 +36,134 @@ class TestDataProcessing(unittest.TestCase):
         df = read_csv(url)
         self.assertIsInstance(df, pd.DataFrame)
 
+    def test_read_nics_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            url = os.path.join(tmp, "nics.csv")
+            self.df.iloc[:1].to_csv(url, index=False)
+            df = read_nics(url, columns=["state", "permit"])
+            self.assertEqual(df.columns.tolist(), ["state", "permit"])
+            cache_file = os.path.join(tmp, ".cache", "nics.parquet")
+            self.assertTrue(os.path.exists(cache_file))
+            # A changed source file must rebuild the cache
+            self.df.iloc[:2].to_csv(url, index=False)
+            self.assertEqual(len(read_nics(url, columns=None)), 2)
+            self.assertEqual(len(read_nics(url, columns=None)), 2)
+
+    def test_file_hash(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "data.bin")
+            with open(path, "wb") as file:
+                file.write(b"x" * (3 << 20))
+            self.assertEqual(file_hash(path),
+                             hashlib.sha256(b"x" * (3 << 20)).hexdigest())
+
+    def test_read_nics_cache_hash(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            url = os.path.join(tmp, "nics.csv")
+            self.df.to_csv(url, index=False)
+            read_nics(url)
+            cache_file = os.path.join(tmp, ".cache", "nics.parquet")
+            built = os.stat(cache_file).st_mtime_ns
+            with mock.patch.object(data_processing, "file_hash",
+                                   wraps=data_processing.file_hash) as hash_:
+                # A warm hit does not read the source file
+                read_nics(url)
+                hash_.assert_not_called()
+                # A touched file with the same content keeps the cache
+                stat = os.stat(url)
+                os.utime(url, ns=(stat.st_atime_ns,
+                                  stat.st_mtime_ns + 10 ** 9))
+                self.assertEqual(len(read_nics(url)), 2)
+                read_nics(url)
+                self.assertEqual(hash_.call_count, 1)
+            self.assertEqual(os.stat(cache_file).st_mtime_ns, built)
+
+    def test_read_nics_cache_failure(self):
+        import pyarrow
+        with tempfile.TemporaryDirectory() as tmp:
+            url = os.path.join(tmp, "nics.csv")
+            self.df.to_csv(url, index=False)
+            with mock.patch.object(pd.DataFrame, "to_parquet",
+                                   side_effect=pyarrow.ArrowTypeError):
+                with self.assertLogs("firearm_analysis.data_processing",
+                                     "WARNING"):
+                    df = read_nics(url)
+            # The parsed file is returned, without any cache or leftover
+            self.assertEqual(len(df), 2)
+            self.assertEqual(os.listdir(os.path.join(tmp, ".cache")), [])
+            read_nics(url)
+            self.assertEqual(sorted(os.listdir(os.path.join(tmp, ".cache"))),
+                             ["nics.json", "nics.parquet"])
+
+    def test_read_compact(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            url = os.path.join(tmp, "nics.csv")
+            with open(url, "w") as file:
+                file.write("month,state,permit,handgun,longgun,totals\n"
+                           "2019-12,Kentucky,100,,300,400\n"
+                           "2020-01,Alabama,150,250,350,750\n")
+            df = read_compact(url, cache=False)
+        self.assertEqual(df.columns.tolist(), [
+            "year", "month", "state", "permit", "handgun", "long_gun"])
+        self.assertEqual(df["year"].tolist(), [2019, 2020])
+        self.assertEqual(df["month"].tolist(), [12, 1])
+        self.assertEqual(df["handgun"].tolist(), [0, 250])
+        self.assertEqual(df["state"].dtype, "category")
+        self.assertEqual(df["long_gun"].dtype, "int32")
+
+    def test_widen_counts(self):
+        # Two monthly counts that fit in 32 bits, but not their sum
+        df = pd.DataFrame({
+            "state": pd.Categorical(["Kentucky", "Kentucky"]),
+            "year": [2020, 2020],
+            "permit": pd.array([2 ** 31 - 1] * 2, dtype="int32"),
+            "handgun": pd.array([1, 2], dtype="int32"),
+            "long_gun": pd.array([3, 4], dtype="int32"),
+        })
+        self.assertEqual(widen_counts(df)["permit"].dtype, "int64")
+        self.assertEqual(widen_counts(df)["year"].dtype, "int64")
+        df_grouped = groupby_state_and_year(df)
+        self.assertEqual(df_grouped["permit"].item(), 2 ** 32 - 2)
+
+    def test_load_dataset(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            url = os.path.join(tmp, "nics.csv")
+            pd.DataFrame({
+                "month": ["2020-01", "2020-02"],
+                "state": ["Kentucky", "Kentucky"],
+                "permit": [100, 150],
+                "handgun": [200, 250],
+                "longgun": [300, 350],
+                "other": [1, 1],
+            }).to_csv(url, index=False)
+            df = load_dataset(url)
+            self.assertEqual(df.columns.tolist(), [
+                "year", "month", "state", "permit", "handgun", "long_gun"])
+            self.assertEqual(df["year"].tolist(), [2020, 2020])
+            self.assertEqual(df["month"].tolist(), [1, 2])
+            # Modifying the returned copy must not alter the cached data
+            df.drop(columns=["month"], inplace=True)
+            self.assertIn("month", load_dataset(url).columns)
+        self.assertIs(load_dataset(df), df)
+
     def test_clean_csv(self):
         df_clean = clean_csv(self.df)
         self.assertIn("permit", df_clean.columns)
         self.assertNotIn("permit_recheck", df_clean.columns)
 
+    def test_verbose(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            clean_csv(self.df)
+        self.assertEqual(output.getvalue(), "")
+        try:
+            with contextlib.redirect_stdout(output):
+                set_verbose()
+                clean_csv(self.df)
+        finally:
+            set_verbose(False)
+        self.assertIn("Columns of the cleaned DataFrame", output.getvalue())
+
     def test_rename_col(self):
         df_renamed = rename_col(self.df)
         self.assertIn("long_gun", df_renamed.columns)
@@ -41,6 +174,17 @@ class TestDataProcessing(unittest.TestCase):
         self.assertIn("year", df_with_date.columns)
         self.assertIn("month", df_with_date.columns)
 
+    def test_split_date(self):
+        df = pd.DataFrame({"month": ["2019-12", "2020-01", "2019-12"]})
+        df_split = split_date(df, as_period=True)
+        self.assertEqual(df_split.columns.tolist(), ["year", "month"])
+        self.assertEqual(df_split["year"].tolist(), [2019, 2020, 2019])
+        self.assertEqual(df_split["month"].tolist(), [12, 1, 12])
+        self.assertEqual(str(df_split.index[1]), "2020-01")
+        self.assertNotIn("year", df.columns)
+        split_date(df, inplace=True)
+        self.assertIn("year", df.columns)
+
     def test_erase_month(self):
         df_no_month = erase_month(self.df)
         self.assertNotIn("month", df_no_month.columns)
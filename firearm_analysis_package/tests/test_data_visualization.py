@@ -1,8 +1,9 @@
 # tests/test_visualization.py
 
+import io
 import unittest
 import pandas as pd
-# from firearm_analysis.visualization import time_evolution
+from firearm_analysis.visualization import _template, time_evolution
 
 
 class TestVisualization(unittest.TestCase):
@@ -23,6 +24,47 @@ class TestVisualization(unittest.TestCase):
         except Exception as e:
             self.fail(f"`time_evolution()` raised Exception unexpectedly! {e}")
 
+    def test_time_evolution_output(self):
+        image = time_evolution(self.df)
+        self.assertTrue(image.startswith(b"\x89PNG"))
+        buffer = io.BytesIO()
+        self.assertIsNone(time_evolution(self.df, output=buffer, fmt="svg"))
+        self.assertIn(b"<svg", buffer.getvalue())
 
-# if __name__ == '__main__':
-#     unittest.main()
+    def test_time_evolution_template(self):
+        df = self.df.assign(state="Texas")
+        df = pd.concat([df, df.assign(state="Ohio", permit=1)])
+        time_evolution(df)
+        fig, ax, lines = _template((10, 6), 100)
+        self.assertEqual(list(lines["permit"].get_ydata()),
+                         [101, 114, 116, 115, 119])
+        time_evolution(df, state="Ohio")
+        # The same figure is reused with the new data
+        self.assertIs(_template((10, 6), 100)[0], fig)
+        self.assertEqual(list(lines["permit"].get_ydata()), [1] * 5)
+        self.assertEqual(list(lines["handgun"].get_xdata()),
+                         [2020, 2021, 2022, 2023, 2024])
+        self.assertEqual(ax.get_title(), "Time Evolution of Firearms and "
+                         "Permits in Ohio (2020-2024)")
+
+    def test_time_evolution_metrics(self):
+        df = self.df.assign(totals=[1, 2, 3, 4, 5])
+        time_evolution(df[["year", "handgun"]], metrics=["handgun"])
+        fig, ax, lines = _template((10, 6), 100)
+        # Only the selected lines are drawn, with the style of the template
+        self.assertEqual([line.get_label() for line in lines.values()
+                          if line.get_visible()], ["Handguns"])
+        self.assertEqual([text.get_text() for text
+                          in ax.get_legend().get_texts()], ["Handguns"])
+        self.assertEqual(lines["handgun"].get_color(), "#bc5090")
+        time_evolution(df, metrics=["permit", "totals"])
+        self.assertEqual(list(lines["totals"].get_ydata()), [1, 2, 3, 4, 5])
+        self.assertFalse(lines["handgun"].get_visible())
+        time_evolution(df)
+        self.assertEqual([metric for metric, line in lines.items()
+                          if line.get_visible()],
+                         ["permit", "handgun", "long_gun"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# tests/test_imports.py
+
+import json
+import subprocess
+import sys
+import unittest
+
+# Libraries that are only needed to draw the maps and charts
+RENDERING_MODULES = ["folium", "selenium", "matplotlib", "PIL", "branca"]
+
+# Seconds the import of the package may take, once pandas is loaded
+IMPORT_BUDGET = 0.5
+
+
+def run(code):
+    """Runs Python code in a new interpreter and returns its JSON output."""
+    output = subprocess.run([sys.executable, "-c", code], check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+class TestImports(unittest.TestCase):
+
+    def test_data_functions_do_not_import_rendering(self):
+        loaded = run(
+            "import json, sys\n"
+            "from firearm_analysis import read_csv, AggregationCube, "
+            "per_capita, find_outliers, Ranking\n"
+            "import firearm_analysis.cli, firearm_analysis.service\n"
+            f"print(json.dumps([m for m in {RENDERING_MODULES!r} "
+            "if m in sys.modules]))")
+        self.assertEqual(loaded, [])
+
+    def test_import_time(self):
+        seconds = run(
+            "import json, time\n"
+            "import pandas, numpy\n"
+            "start = time.perf_counter()\n"
+            "import firearm_analysis\n"
+            "from firearm_analysis import read_csv, AggregationCube\n"
+            "print(json.dumps(time.perf_counter() - start))")
+        self.assertLess(seconds, IMPORT_BUDGET)
+
+    def test_lazy_names(self):
+        names = run(
+            "import json, firearm_analysis\n"
+            "print(json.dumps([firearm_analysis.per_capita.__module__,\n"
+            "                  firearm_analysis.create_maps.__name__,\n"
+            "                  sorted(firearm_analysis.__all__) == "
+            "sorted(set(firearm_analysis.__all__))]))")
+        self.assertEqual(names, ["firearm_analysis.population",
+                                 "create_maps", True])
+        import firearm_analysis
+        with self.assertRaises(AttributeError):
+            firearm_analysis.plot_everything
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# tests/test_incremental.py
+
+import os
+import tempfile
+import shutil
+import unittest
+from unittest import mock
+import pandas as pd
+from firearm_analysis import incremental
+from firearm_analysis.incremental import IncrementalAggregates
+
+
+class TestIncrementalAggregates(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Create a sample DataFrame for testing
+        cls.df = pd.DataFrame({
+            "month": ["2019-12", "2019-12", "2020-01", "2020-02"],
+            "state": ["Kentucky", "Alabama", "Kentucky", "Kentucky"],
+            "permit": [10, 1, 100, 150],
+            "handgun": [20, 2, 200, 250],
+            "long_gun": [30, 3, 300, 350],
+        })
+
+    def test_update(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            url = os.path.join(tmp, "nics.csv")
+            store = os.path.join(tmp, "store")
+            self.df.iloc[:3].to_csv(url, index=False)
+            result = IncrementalAggregates(store).update(url)
+            self.assertEqual(result["added"], [201912, 202001])
+            # New release with one more month and a late correction
+            df = self.df.copy()
+            df.loc[1, "permit"] = 5
+            df.to_csv(url, index=False)
+            aggregates = IncrementalAggregates(store)
+            self.assertEqual(aggregates.watermark, 202001)
+            result = aggregates.update(url)
+            self.assertEqual(result, {"added": [202002],
+                                      "corrected": [201912]})
+            df_state = IncrementalAggregates(store).state.set_index("state")
+        self.assertEqual(df_state.loc["Alabama", "permit"], 5)
+        self.assertEqual(df_state.loc["Kentucky", "permit"], 260)
+
+    def test_unchanged_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            url = os.path.join(tmp, "nics.csv")
+            store = os.path.join(tmp, "store")
+            self.df.to_csv(url, index=False)
+            IncrementalAggregates(store).update(url)
+            with mock.patch.object(incremental, "read_compact") as read:
+                result = IncrementalAggregates(store).update(url)
+            read.assert_not_called()
+            self.assertEqual(result, {"added": [], "corrected": []})
+
+    def test_interrupted_save(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            url = os.path.join(tmp, "nics.csv")
+            store = os.path.join(tmp, "store")
+            self.df.iloc[:3].to_csv(url, index=False)
+            IncrementalAggregates(store).update(url)
+            meta = os.path.join(tmp, "meta.json")
+            shutil.copy(os.path.join(store, "meta.json"), meta)
+            self.df.to_csv(url, index=False)
+            # A save that fails keeps the previous files
+            with mock.patch.object(incremental.json, "dump",
+                                   side_effect=OSError):
+                with self.assertRaises(OSError):
+                    IncrementalAggregates(store).update(url)
+            self.assertEqual(sorted(os.listdir(store)),
+                             ["meta.json", "state.csv", "state_month.csv",
+                              "state_year.csv"])
+            # Updating again after a crash before the metadata was replaced
+            # does not count the new month twice
+            shutil.copy(meta, os.path.join(store, "meta.json"))
+            IncrementalAggregates(store).update(url)
+            df_state = IncrementalAggregates(store).state.set_index("state")
+        self.assertEqual(df_state.loc["Kentucky", "permit"], 260)
+
+
+if __name__ == '__main__':
+    unittest.main()
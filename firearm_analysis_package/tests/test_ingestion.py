@@ -0,0 +1,66 @@
+# tests/test_ingestion.py
+
+import os
+import tempfile
+import unittest
+import pandas as pd
+from firearm_analysis.data_processing import (
+    load_dataset, erase_month, groupby_state_and_year
+)
+from firearm_analysis.ingestion import (
+    stream_groupby_state_and_year, parallel_groupby_state_and_year
+)
+
+
+class TestIngestion(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Create a sample DataFrame for testing
+        cls.df = pd.DataFrame({
+            "month": ["2020-01", "2020-02", "2019-12", "2019-11", "2020-01"],
+            "state": ["Kentucky", "Kentucky", "Alabama", "Kentucky", "Guam"],
+            "permit": [100, 150, 10, 5, None],
+            "handgun": [200, 250, 20, 6, 1],
+            "longgun": [300, 350, 30, 7, 2],
+            "totals": [600, 750, 60, 18, 3],
+        })
+
+    def test_stream_groupby_state_and_year(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            url = os.path.join(tmp, "nics.csv.gz")
+            self.df.to_csv(url, index=False)
+            df_stream = stream_groupby_state_and_year(url, chunksize=2)
+            df_memory = groupby_state_and_year(
+                erase_month(load_dataset(url)))
+        pd.testing.assert_frame_equal(df_stream, df_memory,
+                                      check_dtype=False)
+
+    def test_parallel_groupby_state_and_year(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            url = os.path.join(tmp, "nics.csv")
+            self.df.to_csv(url, index=False)
+            for i in range(3):
+                self.df.iloc[i::3].to_csv(
+                    os.path.join(tmp, f"part-{i}.csv"), index=False)
+            df_memory = groupby_state_and_year(
+                erase_month(load_dataset(url)))
+            pattern = os.path.join(tmp, "part-*.csv")
+            for max_workers in (1, 2):
+                df_parallel = parallel_groupby_state_and_year(
+                    pattern, max_workers=max_workers, chunksize=1)
+                pd.testing.assert_frame_equal(df_parallel, df_memory,
+                                              check_dtype=False)
+            # Overlapping patterns read every file only once
+            df_parallel = parallel_groupby_state_and_year(
+                [pattern, os.path.join(tmp, "part-1.csv"),
+                 os.path.join(tmp, ".", "part-*.csv")], max_workers=1)
+            pd.testing.assert_frame_equal(df_parallel, df_memory,
+                                          check_dtype=False)
+            with self.assertRaises(FileNotFoundError):
+                parallel_groupby_state_and_year(
+                    os.path.join(tmp, "missing-*.csv"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,11 @@
 # tests/test_map_generation.py
 
+import os
+import tempfile
 import unittest
+from unittest import mock
 import pandas as pd
-from firearm_analysis.map_generation import create_maps
+from firearm_analysis.map_generation import create_maps, load_geojson
 
 
 class TestMapGeneration(unittest.TestCase):
@@ -17,12 +20,51 @@ class TestMapGeneration(unittest.TestCase):
             "longgun_perc": [23, 15, 5, 9, 58],
         })
 
+    def test_load_geojson(self):
+        state_geo = load_geojson("./Data/us-states.json")
+        self.assertEqual(len(state_geo["features"]), 50)
+        # The file is only parsed once
+        self.assertIs(load_geojson("./Data/us-states.json"), state_geo)
+        self.assertGreaterEqual(load_geojson.cache_info().hits, 1)
+        load_geojson.cache_clear()
+        self.assertIsNot(load_geojson("./Data/us-states.json"), state_geo)
+
     def test_create_maps(self):
         try:
-            create_maps(self.df)
+            with tempfile.TemporaryDirectory() as tmp:
+                create_maps(self.df, output_dir=tmp)
         except Exception as e:
             self.fail(f"create_maps raised Exception unexpectedly! {e}")
 
+    def test_create_maps_failed_render(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "permit_perc.png")
+            with open(path, "wb") as file:
+                file.write(b"previous")
+            with mock.patch("firearm_analysis.map_generation.render_png",
+                            side_effect=TimeoutError):
+                with self.assertRaises(TimeoutError):
+                    create_maps(self.df, output_dir=tmp, fallback=False)
+            # The previous image is neither truncated nor replaced
+            with open(path, "rb") as file:
+                self.assertEqual(file.read(), b"previous")
+            self.assertEqual(os.listdir(tmp), ["permit_perc.png"])
+
+    def test_create_maps_fallback(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with mock.patch("firearm_analysis.map_generation.render_png",
+                            side_effect=TimeoutError) as render:
+                with self.assertLogs("firearm_analysis.map_generation",
+                                     "WARNING"):
+                    create_maps(self.df, output_dir=tmp)
+            # Only the first map waits for the browser
+            self.assertEqual(render.call_count, 1)
+            self.assertEqual(sorted(os.listdir(tmp)),
+                             ["handgun_perc.png", "longgun_perc.png",
+                              "permit_perc.png"])
+            with open(os.path.join(tmp, "permit_perc.png"), "rb") as file:
+                self.assertEqual(file.read(8), b"\x89PNG\r\n\x1a\n")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,78 @@
+# tests/test_outliers.py
+
+import unittest
+import numpy as np
+import pandas as pd
+from firearm_analysis.cube import AggregationCube
+from firearm_analysis.outliers import detect_outliers, find_outliers
+
+
+class TestOutliers(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Create a sample DataFrame for testing
+        cls.df = pd.DataFrame({
+            "state": ["Alabama", "Kentucky", "Ohio", "Texas", "Utah"] * 2,
+            "year": [2019] * 5 + [2020] * 5,
+            "permit_perc": [1.0, 50.0, 1.2, 0.8, 1.1,
+                            10.0, 11.0, 9.0, 10.5, 30.0],
+            "handgun_perc": [3.0, 3.1, 2.9, 3.2, 3.0,
+                             3.0, 3.1, 2.9, 3.2, 3.0],
+        })
+
+    def test_detect_outliers(self):
+        values = np.array([[1.0, 10.0], [1.2, 11.0], [0.9, np.nan],
+                           [1.1, 12.0], [30.0, 10.5]])
+        treated, mask = detect_outliers(values, treatment="median")
+        self.assertEqual(mask.tolist(), [[False, False], [False, False],
+                                         [False, False], [False, False],
+                                         [True, False]])
+        self.assertEqual(treated[4, 0], 1.1)
+        self.assertTrue(np.isnan(treated[2, 1]))
+        treated, _ = detect_outliers(values, method="iqr", treatment="clip")
+        self.assertAlmostEqual(treated[4, 0], 1.2 + 1.5 * 0.2)
+        with self.assertRaises(ValueError):
+            detect_outliers(values, treatment="drop")
+
+    def test_find_outliers(self):
+        result, mask = find_outliers(self.df,
+                                     ["permit_perc", "handgun_perc"])
+        # Compared across all the rows, no value stands out
+        self.assertFalse(mask.to_numpy().any())
+        pd.testing.assert_frame_equal(result, self.df)
+        result, mask = find_outliers(self.df,
+                                     ["permit_perc", "handgun_perc"],
+                                     by="year", treatment="median")
+        # Compared within each year, Kentucky in 2019 and Utah in 2020
+        self.assertEqual(mask.index[mask["permit_perc"]].tolist(), [1, 9])
+        self.assertFalse(mask["handgun_perc"].any())
+        self.assertEqual(result["permit_perc"].tolist(),
+                         [1.0, 1.1, 1.2, 0.8, 1.1, 10.0, 11.0, 9.0, 10.5,
+                          10.5])
+        self.assertEqual(self.df.loc[1, "permit_perc"], 50.0)
+
+    def test_find_outliers_missing_key(self):
+        df = pd.concat([self.df, pd.DataFrame({
+            "state": ["Iowa"], "year": [np.nan], "permit_perc": [500.0],
+            "handgun_perc": [3.0]})], ignore_index=True)
+        result, mask = find_outliers(df, ["permit_perc", "handgun_perc"],
+                                     by="year", treatment="median")
+        # The row without a year is left as it is
+        self.assertEqual(mask.index[mask["permit_perc"]].tolist(), [1, 9])
+        self.assertEqual(result.loc[10, "permit_perc"], 500.0)
+        _, mask = find_outliers(df.iloc[10:], ["permit_perc"], by="year")
+        self.assertFalse(mask.to_numpy().any())
+
+    def test_cube_outliers(self):
+        df = self.df[["state", "year"]].assign(
+            month=1, permit=[10, 500, 12, 8, 11, 100, 110, 90, 105, 300])
+        cube = AggregationCube.from_dataset(df, metrics=["permit"])
+        values = cube.to_array(["state", "year"])
+        self.assertEqual(values.shape, (5, 2, 1))
+        _, mask = detect_outliers(values, axis=0)
+        self.assertEqual(np.argwhere(mask).tolist(), [[1, 0, 0], [4, 1, 0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
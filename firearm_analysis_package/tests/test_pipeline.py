@@ -0,0 +1,59 @@
+# tests/test_pipeline.py
+
+import unittest
+import pandas as pd
+from firearm_analysis.pipeline import Pipeline
+
+
+class TestPipeline(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Create a sample DataFrame for testing
+        cls.df = pd.DataFrame({
+            "month": ["2020-01", "2020-02", "2019-12"],
+            "state": ["Kentucky", "Kentucky", "Alabama"],
+            "permit": [100, 150, 10],
+            "handgun": [200, 250, 20],
+            "long_gun": [300, 350, 30],
+        })
+
+    def test_optimize(self):
+        pipeline = (Pipeline().rename_col().clean_csv().breakdown_date()
+                    .erase_month().groupby_state_and_year().groupby_year())
+        plan = pipeline.optimize()
+        self.assertEqual([name for name, _ in plan],
+                         ["scan_compact", "aggregate"])
+        self.assertNotIn("month", plan[0][1])
+
+    def test_collect(self):
+        results = (Pipeline(self.df).clean_csv().breakdown_date()
+                   .erase_month().groupby_state_and_year().groupby_state()
+                   .groupby_year().collect())
+        self.assertEqual(results["groupby_state_and_year"].shape, (2, 5))
+        df_states = results["groupby_state"].set_index("state")
+        self.assertEqual(df_states.loc["Kentucky", "permit"], 250)
+        df_years = results["groupby_year"].set_index("year")
+        self.assertEqual(df_years.loc[2020, "handgun"], 450)
+
+    def test_partial_plans(self):
+        # The aggregations split the date even when the plan does not
+        for pipeline in (Pipeline(self.df).groupby_state(),
+                         Pipeline(self.df).clean_csv().groupby_state(),
+                         Pipeline(self.df).rename_col().groupby_year()):
+            plan = pipeline.optimize()
+            self.assertEqual(plan[0], ("scan_compact",
+                                       ("year", "state", "permit",
+                                        "handgun", "long_gun")))
+        df = Pipeline(self.df).groupby_state().collect().set_index("state")
+        self.assertEqual(df.loc["Kentucky", "handgun"], 450)
+        df = Pipeline(self.df).clean_csv().groupby_year().collect()
+        self.assertEqual(df.set_index("year").loc[2019, "permit"], 10)
+
+    def test_aggregation_order(self):
+        with self.assertRaises(ValueError):
+            Pipeline().groupby_state().clean_csv().optimize()
+
+
+if __name__ == '__main__':
+    unittest.main()
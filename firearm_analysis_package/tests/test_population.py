@@ -0,0 +1,65 @@
+# tests/test_population.py
+
+import os
+import tempfile
+import unittest
+import pandas as pd
+from firearm_analysis.population import load_population, per_capita
+
+
+class TestPopulation(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Create a sample population file with a gap in 2012
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.url2 = os.path.join(cls.tmp.name, "populations.csv")
+        pd.DataFrame({
+            "code": ["KY", "AL"],
+            "state": ["Kentucky", "Alabama"],
+            "pop_2011": [1000, 2000],
+            "pop_2013": [2000, 4000],
+        }).to_csv(cls.url2, index=False)
+        # Create a sample DataFrame for testing
+        cls.df = pd.DataFrame({
+            "state": ["Kentucky", "Guam", "Alabama", "Kentucky"],
+            "year": [2010, 2011, 2012, 2013],
+            "permit": [10, 1, 30, 40],
+            "handgun": [20, 1, 60, 2],
+            "long_gun": [30, 1, 90, 1],
+        })
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_load_population(self):
+        table = load_population(self.url2)
+        self.assertIs(load_population(self.url2), table)
+        self.assertEqual(table.years, [2011, 2012, 2013])
+        self.assertEqual(table.values.tolist(),
+                         [[1000, 1000, 2000], [2000, 2000, 4000]])
+        self.assertEqual(table.ids(["Alabama", "Guam"]).tolist(), [1, -1])
+
+    def test_per_capita(self):
+        result = per_capita(self.df, self.url2)
+        # Guam has no population and the years are clipped to the table
+        self.assertEqual(result["state"].tolist(),
+                         ["Kentucky", "Alabama", "Kentucky"])
+        self.assertEqual(result["code"].tolist(), ["KY", "AL", "KY"])
+        self.assertEqual(result["population"].tolist(), [1000, 2000, 2000])
+        self.assertEqual(result["permit_perc"].tolist(), [1.0, 1.5, 2.0])
+        self.assertEqual(result["longgun_perc"].tolist(), [3.0, 4.5, 0.05])
+        self.assertEqual(result["handgun_perc"].tolist(), [2.0, 3.0, 0.1])
+
+    def test_per_capita_totals(self):
+        df = self.df.drop(columns="year")
+        result = per_capita(df, self.url2, metrics=["permit"], year=2011,
+                            per=1, decimals=2)
+        self.assertEqual(result["population"].tolist(), [1000, 2000, 1000])
+        self.assertEqual(result["permit_perc"].tolist(), [0.01, 0.02, 0.04])
+        self.assertNotIn("handgun_perc", result.columns)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# tests/test_profiling.py
+
+import json
+import os
+import pstats
+import subprocess
+import sys
+import tempfile
+import unittest
+import pandas as pd
+from firearm_analysis import profiling
+from firearm_analysis.data_processing import (
+    breakdown_date, erase_month, groupby_state_and_year
+)
+from firearm_analysis.profiling import (
+    PROFILE_ENV, Profiler, profile_stages, profiled
+)
+
+
+@profiled
+def outer(df):
+    return inner(df).head(1)
+
+
+@profiled
+def inner(df):
+    return pd.concat([df, df])
+
+
+class TestProfiling(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Create a sample DataFrame for testing
+        cls.df = pd.DataFrame({
+            "month": ["2020-01", "2020-02", "2019-12", "2020-01"],
+            "state": ["Kentucky", "Kentucky", "Alabama", "Alabama"],
+            "permit": [100, 150, 10, 20],
+            "handgun": [200, 250, 20, 30],
+            "long_gun": [300, 350, 30, 40],
+        })
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_disabled(self):
+        self.assertIsNone(profiling._ACTIVE)
+        self.assertEqual(len(outer(self.df)), 1)
+        self.assertEqual(outer.__name__, "outer")
+        self.assertEqual(breakdown_date.__name__, "breakdown_date")
+
+    def test_profile_stages(self):
+        output = os.path.join(self.tmp.name, "profile.json")
+        with profile_stages(output) as profiler:
+            self.assertIsInstance(profiler, Profiler)
+            df = breakdown_date(self.df.copy())
+            groupby_state_and_year(erase_month(df))
+            outer(self.df)
+            outer(self.df)
+        self.assertIsNone(profiling._ACTIVE)
+        with open(output) as file:
+            summary = json.load(file)
+        stages = summary["stages"]
+        self.assertEqual(list(stages)[:3], [
+            "data_processing.breakdown_date", "data_processing.split_date",
+            "data_processing.erase_month"])
+        grouped = stages["data_processing.groupby_state_and_year"]
+        self.assertEqual((grouped["calls"], grouped["rows_in"],
+                          grouped["rows_out"]), (1, 4, 3))
+        self.assertEqual((stages["test_profiling.outer"]["calls"],
+                          stages["test_profiling.outer"]["rows_out"]), (2, 2))
+        self.assertEqual(stages["test_profiling.inner"]["rows_out"], 16)
+        # The allocations of the inner stage are part of the outer stage
+        self.assertGreater(stages["test_profiling.inner"]["allocated_bytes"],
+                           0)
+        self.assertGreaterEqual(
+            stages["test_profiling.outer"]["allocated_bytes"],
+            stages["test_profiling.inner"]["allocated_bytes"])
+        self.assertGreaterEqual(stages["test_profiling.outer"]["seconds"],
+                                stages["test_profiling.inner"]["seconds"])
+        self.assertGreater(summary["seconds"], 0)
+        if profiling.resource is not None:
+            self.assertGreater(summary["peak_rss_bytes"], 0)
+
+    def test_cprofile_dumps(self):
+        directory = os.path.join(self.tmp.name, "prof")
+        with profile_stages(memory=False, cprofile_dir=directory) as profiler:
+            outer(self.df)
+        self.assertIsNone(
+            profiler.summary()["stages"]["test_profiling.outer"]
+            ["allocated_bytes"])
+        profiler.write(os.path.join(self.tmp.name, "profile.json"))
+        # Only the outermost stage has a dump
+        self.assertEqual(os.listdir(directory), ["test_profiling.outer.prof"])
+        stats = pstats.Stats(os.path.join(directory,
+                                          "test_profiling.outer.prof"))
+        self.assertTrue(any(function == "inner"
+                            for _, _, function in stats.stats))
+
+    def test_environment_variable(self):
+        output = os.path.join(self.tmp.name, "profile.json")
+        code = ("import pandas as pd\n"
+                "from firearm_analysis import split_date\n"
+                "split_date(pd.DataFrame({'month': ['2020-01']}))\n")
+        env = dict(os.environ, **{PROFILE_ENV: output})
+        subprocess.run([sys.executable, "-c", code], check=True, env=env)
+        with open(output) as file:
+            summary = json.load(file)
+        self.assertEqual(summary["stages"]["data_processing.split_date"]
+                         ["rows_out"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
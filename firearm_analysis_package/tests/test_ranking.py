@@ -0,0 +1,77 @@
+# tests/test_ranking.py
+
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from firearm_analysis.cube import AggregationCube
+from firearm_analysis.ranking import Ranking, top_k
+
+
+class TestRanking(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Create a sample DataFrame grouped by state and year for testing
+        cls.df = pd.DataFrame({
+            "state": ["Kentucky", "Kentucky", "Alabama", "Alabama", "Guam"],
+            "year": [2019, 2020, 2019, 2020, 2020],
+            "permit": [100, 400, 30, 50, 500],
+            "handgun": [200, 250, 20, 600, 1],
+            "long_gun": [300, 350, 10, 15, 2],
+        })
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.url2 = os.path.join(cls.tmp.name, "populations.csv")
+        pd.DataFrame({
+            "code": ["KY", "AL"],
+            "state": ["Kentucky", "Alabama"],
+            "pop_2019": [1000, 100],
+        }).to_csv(cls.url2, index=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_top_k(self):
+        values = np.array([[3.0, 1.0], [np.nan, 5.0], [7.0, 2.0], [1.0, 4.0]])
+        self.assertEqual(top_k(values, 2).tolist(), [[2, 1], [0, 3]])
+        self.assertEqual(top_k(values, 3, largest=False)[:, 0].tolist(),
+                         [3, 0, 2])
+        self.assertEqual(top_k(values, 10).shape, (4, 2))
+
+    def test_top(self):
+        ranking = Ranking.from_aggregates(self.df, url2=None)
+        df = ranking.top("permit", k=2)
+        self.assertEqual(df.columns.tolist(), ["state", "year", "permit"])
+        self.assertEqual(df.values.tolist(),
+                         [["Guam", 2020, 500], ["Kentucky", 2020, 400]])
+        # Guam has no data in 2019
+        df = ranking.top("handgun", k=5, year=2019, largest=False)
+        self.assertEqual(df["state"].tolist(), ["Alabama", "Kentucky"])
+        result = ranking.top(["handgun", "long_gun"], k=1, records=True)
+        self.assertEqual(result, {
+            "handgun": [{"state": "Alabama", "year": 2020, "handgun": 600}],
+            "long_gun": [{"state": "Kentucky", "year": 2020,
+                          "long_gun": 350}]})
+        with self.assertRaises(KeyError):
+            ranking.top("permit", year=2000)
+
+    def test_top_per_capita(self):
+        ranking = Ranking.from_aggregates(self.df, url2=self.url2)
+        df = ranking.top("permit_perc", k=3)
+        # Guam has no population, so it has no percentages
+        self.assertEqual(df["state"].tolist(),
+                         ["Alabama", "Kentucky", "Alabama"])
+        self.assertEqual(df["permit_perc"].tolist(), [50.0, 40.0, 30.0])
+
+    def test_from_cube(self):
+        cube = AggregationCube.from_dataset(self.df.assign(month=1))
+        ranking = Ranking.from_aggregates(cube, url2=None)
+        pd.testing.assert_frame_equal(
+            ranking.top("long_gun"),
+            Ranking.from_aggregates(self.df, url2=None).top("long_gun"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+# tests/test_raster_maps.py
+
+import io
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from firearm_analysis.map_generation import create_maps
+from firearm_analysis.raster_maps import bin_colors, render_choropleth
+
+
+class TestRasterMaps(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Create a sample DataFrame for testing
+        cls.df = pd.DataFrame({
+            "code": ["KY", "AL", "CA", "OR", "FL"],
+            "permit_perc": [53, 62, 10, 15, 95],
+            "handgun_perc": [34, 27, 7, 13, 83],
+            "longgun_perc": [23, 15, 5, 9, 58],
+        })
+
+    def test_bin_colors(self):
+        values = np.array([0.0, 6.0, 3.0, np.nan])
+        bin_edges, colors, index = bin_colors(values, bins=6)
+        self.assertEqual(len(bin_edges), 7)
+        self.assertEqual(colors[0], "#ffffcc")
+        # The maximum belongs to the last bin and NaN to none
+        self.assertEqual(index.tolist(), [0, 5, 3, -1])
+
+    def test_render_choropleth(self):
+        buffer = io.BytesIO()
+        render_choropleth(self.df, "permit_perc", buffer)
+        self.assertTrue(buffer.getvalue().startswith(b"\x89PNG"))
+
+    def test_create_maps(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            create_maps(self.df, output_dir=tmp, backend="matplotlib",
+                        fmt="svg")
+            self.assertEqual(sorted(os.listdir(tmp)), [
+                "handgun_perc.svg", "longgun_perc.svg", "permit_perc.svg"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+# tests/test_service.py
+
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import pandas as pd
+from firearm_analysis import service as service_module
+from firearm_analysis.service import QueryService, serve, start_server
+
+
+class TestQueryService(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Create sample NICS and population files for testing
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.url = os.path.join(cls.tmp.name, "nics.csv")
+        cls.url2 = os.path.join(cls.tmp.name, "populations.csv")
+        cls.df = pd.DataFrame({
+            "month": ["2020-01", "2020-02", "2019-12", "2020-01"],
+            "state": ["Kentucky", "Kentucky", "Alabama", "Guam"],
+            "permit": [100, 150, 10, 1],
+            "handgun": [200, 250, 20, 2],
+            "long_gun": [300, 350, 30, 3],
+        })
+        cls.df.to_csv(cls.url, index=False)
+        pd.DataFrame({
+            "code": ["KY", "AL"],
+            "state": ["Kentucky", "Alabama"],
+            "pop_2014": [1000, 100],
+        }).to_csv(cls.url2, index=False)
+        cls.service = QueryService(cls.url, cls.url2,
+                                   geo_data="./Data/us-states.json")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def query(self, target):
+        status, content_type, body = self.service.handle(target)
+        self.assertEqual(content_type, "application/json")
+        return int(status), json.loads(body)
+
+    def test_totals(self):
+        status, data = self.query("/totals?by=state&state=Kentucky")
+        self.assertEqual(status, 200)
+        self.assertEqual(data, [{"state": "Kentucky", "permit": 250,
+                                 "handgun": 450, "long_gun": 650}])
+        status, data = self.query("/totals?by=year,month&year=2020&month=1")
+        self.assertEqual(data[0]["permit"], 101)
+        self.assertEqual(self.query("/totals?by=state&state=Texas")[0], 404)
+        self.assertEqual(self.query("/totals?by=county")[0], 400)
+
+    def test_per_capita_and_rankings(self):
+        status, data = self.query("/per-capita?by=state")
+        self.assertEqual([row["state"] for row in data],
+                         ["Alabama", "Kentucky"])
+        self.assertEqual(data[1]["permit_perc"], 25.0)
+        status, data = self.query("/rankings?metric=permit_perc&k=1")
+        self.assertEqual(data, [{"state": "Kentucky", "year": 2020,
+                                 "permit_perc": 25.0}])
+        status, data = self.query("/rankings?metric=handgun&order=asc&k=1")
+        self.assertEqual(data[0]["state"], "Guam")
+        self.assertEqual(self.query("/rankings")[0], 400)
+        for k in ("-5", "0", "1.5", "ten"):
+            self.assertEqual(self.query(
+                f"/rankings?metric=permit&k={k}")[0], 400)
+
+    def test_images(self):
+        status, content_type, body = self.service.handle(
+            "/maps/permit_perc.png?year=2020")
+        self.assertEqual((status, content_type), (200, "image/png"))
+        self.assertTrue(body.startswith(b"\x89PNG"))
+        status, content_type, body = self.service.handle(
+            "/charts/time_evolution.svg?state=Kentucky")
+        self.assertEqual(content_type, "image/svg+xml")
+        # The second request is answered from the cache
+        self.assertIs(self.service.handle(
+            "/charts/time_evolution.svg?state=Kentucky")[2], body)
+
+    def test_reload(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            url = os.path.join(tmp, "nics.csv")
+            self.df.to_csv(url, index=False)
+            service = QueryService(url, self.url2)
+            self.assertEqual(json.loads(service.handle(
+                "/totals?by=year")[2])[-1]["permit"], 251)
+            self.df.assign(permit=0).to_csv(url, index=False)
+            stat = os.stat(url)
+            os.utime(url, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            self.assertEqual(json.loads(service.handle(
+                "/totals?by=year")[2])[-1]["permit"], 0)
+
+    def test_http(self):
+        async def get(target):
+            server = await start_server(self.service, port=0)
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(f"GET {target} HTTP/1.1\r\n\r\n".encode())
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            server.close()
+            await server.wait_closed()
+            return response
+
+        response = asyncio.run(get("/rankings?metric=long_gun&k=1"))
+        head, body = response.split(b"\r\n\r\n", 1)
+        self.assertTrue(head.startswith(b"HTTP/1.1 200 OK"))
+        self.assertEqual(json.loads(body)[0]["state"], "Kentucky")
+
+    def test_executor_shutdown(self):
+        executors = []
+
+        def executor(*args, **kwargs):
+            executors.append(ThreadPoolExecutor(*args, **kwargs))
+            return executors[-1]
+
+        async def run():
+            # The worker thread of a server is shut down with the server
+            server = await start_server(self.service, port=0)
+            server.close()
+            await server.wait_closed()
+            await asyncio.sleep(0)
+            # and the one of `serve` when the task is cancelled
+            task = asyncio.ensure_future(serve(self.service, port=0))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with mock.patch.object(service_module, "ThreadPoolExecutor",
+                               side_effect=executor):
+            asyncio.run(run())
+        self.assertEqual(len(executors), 2)
+        for pool in executors:
+            with self.assertRaises(RuntimeError):
+                pool.submit(print)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# tests/test_state_index.py
+
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from firearm_analysis.cube import AggregationCube
+from firearm_analysis.state_index import StateYearArray, load_state_index
+
+
+class TestStateIndex(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.url2 = os.path.join(cls.tmp.name, "populations.csv")
+        pd.DataFrame({
+            "code": ["KY", "AL"],
+            "state": ["Kentucky", "Alabama"],
+            "pop_2014": [1000, 100],
+        }).to_csv(cls.url2, index=False)
+        # Create a sample DataFrame grouped by state and year for testing
+        cls.df = pd.DataFrame({
+            "state": ["Alabama", "Guam", "Kentucky", "Kentucky"],
+            "year": [2019, 2020, 2019, 2020],
+            "permit": [30, 500, 100, 400],
+            "handgun": [20, 1, 200, 250],
+        })
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_state_index(self):
+        index = load_state_index(self.url2)
+        self.assertIs(load_state_index(self.url2), index)
+        self.assertEqual(len(index), 6)
+        self.assertEqual(index.id("Kentucky"), index.id("KY"))
+        self.assertEqual(index.id("Guam"), 2)
+        self.assertEqual(index.ids(["AL", "Puerto Rico", "Texas"]).tolist(),
+                         [1, 4, -1])
+        labels = pd.Series(["Guam", "Alabama", "Guam"], dtype="category")
+        self.assertEqual(index.is_territory(labels).tolist(),
+                         [True, False, True])
+        with self.assertRaises(KeyError):
+            index.id("Texas")
+
+    def test_state_year_array(self):
+        array = StateYearArray.from_aggregates(
+            self.df, self.url2, metrics=["permit", "handgun"])
+        self.assertEqual(array.values.shape, (6, 2, 2))
+        self.assertEqual(array.get("KY", 2020, "permit"), 400)
+        self.assertEqual(array.state("Kentucky").tolist(),
+                         [[100, 200], [400, 250]])
+        self.assertTrue(np.isnan(array.year(2020)[1]).all())
+        self.assertEqual(array.metric("permit")[2, 1], 500)
+        # The slices are views of the array
+        for view in (array.state("Guam"), array.year(2019),
+                     array.metric("handgun"), array.states_only()):
+            self.assertTrue(np.shares_memory(view, array.values))
+        self.assertEqual(array.states_only().shape, (2, 2, 2))
+        df = array.to_frame(territories=False)
+        self.assertEqual(df.values.tolist(), [
+            ["Kentucky", 2019, 100, 200], ["Kentucky", 2020, 400, 250],
+            ["Alabama", 2019, 30, 20]])
+        with self.assertRaises(KeyError):
+            array.year(2021)
+
+    def test_from_cube(self):
+        cube = AggregationCube.from_dataset(self.df.assign(month=1),
+                                            metrics=["permit", "handgun"])
+        array = StateYearArray.from_aggregates(
+            cube, self.url2, metrics=["permit", "handgun"])
+        expected = StateYearArray.from_aggregates(
+            self.df, self.url2, metrics=["permit", "handgun"])
+        np.testing.assert_array_equal(array.values, expected.values)
+        with self.assertRaises(KeyError):
+            StateYearArray.from_aggregates(self.df.assign(state="Texas"),
+                                           self.url2, metrics=["permit"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+# tests/test_time_series.py
+
+import unittest
+import numpy as np
+import pandas as pd
+from firearm_analysis.cube import AggregationCube
+from firearm_analysis.time_series import (
+    MonthlySeries, change, rolling, seasonal_indices, spike_scores
+)
+
+
+class TestTimeSeries(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Five years of a seasonal series with a surge in March 2020
+        months = pd.period_range("2015-07", "2020-06", freq="M")
+        season = np.where(months.month == 12, 2.0, 1.0)
+        handgun = 100 * season
+        handgun[list(months).index(pd.Period("2020-03", freq="M"))] = 1000
+        cls.df = pd.DataFrame({
+            "year": np.tile(months.year, 2),
+            "month": np.tile(months.month, 2),
+            "state": ["Kentucky"] * len(months) + ["Alabama"] * len(months),
+            "permit": np.arange(2 * len(months)),
+            "handgun": np.concatenate([handgun, 10 * season]),
+            "long_gun": np.ones(2 * len(months)),
+        })
+        # The cube sums integer counts
+        cls.df[["handgun", "long_gun"]] = (cls.df[["handgun", "long_gun"]]
+                                           .astype("int64"))
+
+    def test_change(self):
+        values = np.array([[1.0, 2.0, 0.0, 3.0, np.nan, 4.0]])
+        np.testing.assert_allclose(
+            change(values), [[np.nan, 1.0, -1.0, np.nan, np.nan, np.nan]])
+        np.testing.assert_allclose(
+            change(values, 2), [[np.nan, np.nan, -1.0, 0.5, np.nan, 1 / 3]])
+        with self.assertRaises(ValueError):
+            change(values, 0)
+
+    def test_rolling(self):
+        values = np.array([[1.0, 2.0, 3.0, np.nan, 5.0]])
+        np.testing.assert_allclose(rolling(values, 2),
+                                   [[np.nan, 3, 5, np.nan, np.nan]])
+        np.testing.assert_allclose(rolling(values, 2, min_periods=1),
+                                   [[1, 3, 5, 3, 5]])
+        np.testing.assert_allclose(rolling(values, 3, "mean",
+                                           min_periods=2),
+                                   [[np.nan, 1.5, 2, 2.5, 4]])
+        # Same result along another axis
+        np.testing.assert_allclose(rolling(values.T, 2, axis=0),
+                                   rolling(values, 2).T)
+        with self.assertRaises(ValueError):
+            rolling(values, 2, "max")
+
+    def test_seasonal_indices(self):
+        months = pd.period_range("2015-01", "2019-12", freq="M")
+        values = np.where(months.month == 12, 2.0, 1.0)[None, :]
+        indices = seasonal_indices(values, first_month=1)
+        self.assertEqual(indices.shape, (1, 12))
+        self.assertAlmostEqual(indices.mean(), 1.0)
+        self.assertAlmostEqual(indices[0, 11] / indices[0, 0], 2.0)
+        # Starting in another calendar month gives the same indices
+        shifted = seasonal_indices(values[:, 5:], first_month=6)
+        np.testing.assert_allclose(shifted, indices)
+
+    def test_spike_scores(self):
+        values = np.array([[1.0, 2.0, 1.0, 2.0, 1.0, 9.0, 1.0]])
+        scores = spike_scores(values, window=4)
+        self.assertTrue(np.isnan(scores[0, :4]).all())
+        self.assertGreater(scores[0, 5], 3.5)
+        self.assertLess(abs(scores[0, 4]), 3.5)
+        with self.assertRaises(ValueError):
+            spike_scores(values, window=1)
+
+    def test_from_aggregates(self):
+        series = MonthlySeries.from_aggregates(self.df)
+        self.assertEqual(series.values.shape, (2, 60, 3))
+        self.assertEqual(str(series.months[0]), "2015-07")
+        self.assertEqual(series.states, ["Alabama", "Kentucky"])
+        cube = AggregationCube.from_dataset(self.df)
+        same = MonthlySeries.from_aggregates(cube, ["handgun"])
+        np.testing.assert_array_equal(same.values[..., 0],
+                                      series.metric("handgun"))
+        df = series.to_frame()
+        self.assertEqual(len(df), 120)
+        row = df[(df["state"] == "Kentucky") & (df["year"] == 2020)
+                 & (df["month"] == 3)]
+        self.assertEqual(row["handgun"].item(), 1000)
+        with self.assertRaises(KeyError):
+            series.metric("unknown")
+
+    def test_change_and_rolling(self):
+        series = MonthlySeries.from_aggregates(self.df)
+        yearly = series.change(12).metric("handgun")
+        self.assertAlmostEqual(yearly[1, 56], 9.0)
+        sums = series.rolling(3).metric("permit")
+        self.assertEqual(sums[1, 2], 0 + 1 + 2)
+
+    def test_seasonal_and_spikes(self):
+        series = MonthlySeries.from_aggregates(self.df)
+        indices = series.seasonal_indices()
+        self.assertEqual(len(indices), 24)
+        december = indices[(indices["state"] == "Alabama")
+                           & (indices["month"] == 12)]
+        self.assertGreater(december["handgun"].item(), 1.5)
+        spikes = series.spikes(["handgun"])
+        # The surge is found, the Decembers are not surges
+        self.assertEqual(spikes[["state", "year", "month"]].values.tolist(),
+                         [["Kentucky", 2020, 3]])
+        self.assertEqual(spikes["value"].item(), 1000)
+        # Without the seasonal adjustment the Decembers are surges too
+        raw = series.spikes(["handgun"], seasonal=False)
+        self.assertIn(12, raw["month"].tolist())
+        with self.assertRaises(KeyError):
+            series.spikes(["unknown"])
+
+
+if __name__ == '__main__':
+    unittest.main()